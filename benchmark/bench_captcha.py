@@ -0,0 +1,120 @@
+"""
+/user_auth/captcha 接口的吞吐和延迟：原来的同步实现（每个请求现场渲染 + 同步 Redis）
+vs 现在的预生成池 + 异步 Redis
+
+python -m benchmark.bench_captcha
+用 httpx 的 ASGITransport 直接调 ASGI 应用，Redis 换成 fakeredis（需要 pip install fakeredis），
+限流、响应都走真实路由；每个请求带不同的 X-Forwarded-For，不会被 60/minute 挡住
+- burst: 请求数等于池子大小，池子事先补满
+- sustained: 请求数是池子的 5 倍，池子取空之后退回现场渲染，看的是稳态
+BENCH_CAPTCHA_CONCURRENCY 指定并发数（默认 20）
+结果写到 benchmark_results/captcha.json
+"""
+
+import os
+
+os.environ.setdefault("DATABASE_URL", "sqlite://")
+
+import asyncio
+import io
+import logging
+import time
+import uuid
+
+import fakeredis
+import httpx
+from fastapi import APIRouter, FastAPI, Request
+from fastapi.responses import StreamingResponse
+
+from benchmark.utils import write_results
+from database import redis_client
+from database.redis_client import get_redis
+from router import user_auth
+from security.captcha import captcha_manager
+from security.limit_request import limiter
+
+POOL_SIZE = captcha_manager.pool_size
+CONCURRENCY = int(os.environ.get("BENCH_CAPTCHA_CONCURRENCY", "20"))
+SCENARIOS = {"burst": POOL_SIZE, "sustained": POOL_SIZE * 5}
+
+# 每个请求一行的访问日志会拖慢计时
+logging.getLogger("httpx").setLevel(logging.WARNING)
+
+legacy_router = APIRouter()
+
+
+@legacy_router.get("/captcha")
+@limiter.limit("60/minute")
+def legacy_captcha(request: Request):
+    # 改成预生成池之前的实现：同步路由跑在线程池里，现场渲染再同步写 Redis
+    code, image = captcha_manager.render()
+    captcha_id = str(uuid.uuid4())
+    get_redis().setex(f"captcha:{captcha_id}", captcha_manager.ttl, code.upper())
+    return StreamingResponse(
+        io.BytesIO(image), media_type="image/png", headers={"X-Captcha-ID": captcha_id}
+    )
+
+
+def make_app(router: APIRouter) -> FastAPI:
+    app = FastAPI()
+    app.include_router(router, prefix="/user_auth")
+    return app
+
+
+async def fill_pool():
+    captcha_manager.start()
+    while captcha_manager._pool.qsize() < POOL_SIZE:
+        await asyncio.sleep(0.05)
+
+
+async def run(app: FastAPI, total: int) -> dict:
+    samples = []
+    counter = iter(range(total))
+
+    async def worker(client: httpx.AsyncClient):
+        for i in counter:
+            headers = {"X-Forwarded-For": f"10.{i >> 16 & 255}.{i >> 8 & 255}.{i & 255}"}
+            t0 = time.perf_counter()
+            response = await client.get("/user_auth/captcha", headers=headers)
+            samples.append(time.perf_counter() - t0)
+            assert response.status_code == 200, response.status_code
+
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        start = time.perf_counter()
+        await asyncio.gather(*(worker(client) for _ in range(CONCURRENCY)))
+        elapsed = time.perf_counter() - start
+    samples.sort()
+    return {
+        "requests": total,
+        "concurrency": CONCURRENCY,
+        "rps": total / elapsed,
+        "p50_ms": samples[len(samples) // 2] * 1000,
+        "p99_ms": samples[int(len(samples) * 0.99)] * 1000,
+    }
+
+
+async def main():
+    server = fakeredis.FakeServer()
+    redis_client._redis_client = fakeredis.FakeRedis(server=server, decode_responses=True)
+    redis_client._async_redis_client = fakeredis.FakeAsyncRedis(
+        server=server, decode_responses=True
+    )
+    apps = {"sync_render": make_app(legacy_router), "pool": make_app(user_auth.router)}
+    results = {}
+    for scenario, total in SCENARIOS.items():
+        for name, app in apps.items():
+            if name == "pool":
+                await fill_pool()
+            result = await run(app, total)
+            await captcha_manager.stop()
+            results.setdefault(scenario, {})[name] = result
+            print(
+                f"{scenario:<10} {name:<12} {result['rps']:8.0f} req/s "
+                f"p50 {result['p50_ms']:7.2f} ms p99 {result['p99_ms']:7.2f} ms"
+            )
+    write_results("captcha", results)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
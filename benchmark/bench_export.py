@@ -0,0 +1,66 @@
+"""
+聊天记录 NDJSON 导出的吞吐和内存，数据量从 10 万到 1000 万条
+
+python -m benchmark.bench_export
+BENCH_EXPORT_SIZES 指定数据量（逗号分隔，默认 100000，可以加到 10000000），
+数据库和 bench_management 共用（同样的 BENCHMARK_DATABASE_URL，灌好的库直接复用）
+导出的内容直接丢掉，只统计行数、字节数、耗时和导出过程中进程 RSS 的峰值；
+内存占用应该和数据量无关，只随 EXPORT_BATCH_SIZE 变化
+结果写到 benchmark_results/export.json
+"""
+
+import os
+
+os.environ.setdefault("HISTORY_CACHE_SIZE", "0")
+os.environ.setdefault("ENDPOINT_CACHE_ENABLED", "false")
+os.environ.setdefault("DATABASE_URL", "sqlite://")
+
+import asyncio
+
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker, AsyncSession
+
+from database.engine_creating import to_async_url
+from database.export import ChatExport, export_batch_size
+from benchmark.bench_management import prepare, layout, database_url
+from benchmark.utils import run_export, write_results
+
+SIZES = [
+    int(size) for size in os.environ.get("BENCH_EXPORT_SIZES", "100000").split(",")
+]
+
+
+async def bench_size(rows: int) -> dict:
+    engine, session = prepare(rows)
+    session.close()
+    engine.dispose()
+    users, _ = layout(rows)
+    async_engine = create_async_engine(to_async_url(database_url.format(rows=rows)))
+    session_factory = async_sessionmaker(bind=async_engine, class_=AsyncSession)
+    cases = {
+        "export_all": ChatExport(),
+        "export_one_user": ChatExport(user_id=users // 2 + 1),
+    }
+    results = {}
+    for name, export in cases.items():
+        results[name] = await run_export(export, session_factory)
+        result = results[name]
+        print(
+            f"{rows:>10} {name:<16} {result['rows']:>10} rows "
+            f"{result['rows_per_second']:>10.0f} rows/s {result['mb_per_second']:7.1f} MB/s "
+            f"rss peak {result['rss_peak_mb']:7.1f} MB (+{result['rss_growth_mb']:.1f})"
+        )
+    await async_engine.dispose()
+    return results
+
+
+async def main():
+    results = {
+        "database": database_url.split("://")[0],
+        "batch_size": export_batch_size,
+        "sizes": {str(rows): await bench_size(rows) for rows in SIZES},
+    }
+    write_results("export", results)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
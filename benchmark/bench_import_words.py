@@ -0,0 +1,111 @@
+"""
+违禁词导入：/admin/import_not_allowed_words 的批量导入 vs 逐个调用 create_not_allowed_word
+
+python -m benchmark.bench_import_words
+BENCH_IMPORT_WORDS 导入的词数（默认 100000），CSV 和一行一个词两种文件各导一次；
+逐个添加太慢，只跑前 BENCH_IMPORT_SINGLE 个（默认 2000）按速度折算
+每种情况用一个新建的 SQLite 文件库（BENCHMARK_DATABASE_URL 可以指向 MySQL 测试库，会先清空违禁词表），
+Redis 换成 fakeredis；统计耗时、每秒词数、SQL 条数和导入期间进程 RSS 的增长
+结果写到 benchmark_results/import_words.json
+"""
+
+import os
+
+os.environ.setdefault("DATABASE_URL", "sqlite://")
+
+import io
+import random
+import tempfile
+import time
+
+import fakeredis
+from sqlalchemy import create_engine, delete
+from sqlalchemy.orm import sessionmaker
+
+from benchmark.bench_not_allowed_words import random_words
+from benchmark.utils import current_rss, write_results
+from database import redis_client
+from database.database_structure import Base, NotAllowedWord
+from database.management import NotallowedWordManagement
+from monitoring.query_profiler import attach_profiler, profile_queries
+from security.not_allowed_words import read_uploaded_words
+
+WORDS = int(os.environ.get("BENCH_IMPORT_WORDS", "100000"))
+SINGLE = int(os.environ.get("BENCH_IMPORT_SINGLE", "2000"))
+database_url = os.environ.get("BENCHMARK_DATABASE_URL")
+
+
+def make_file(words: list[str], fmt: str) -> tuple[io.BytesIO, str]:
+    if fmt == "csv":
+        content = "word\n" + "\n".join(f'"{word}",备注' for word in words)
+        return io.BytesIO(content.encode()), "words.csv"
+    return io.BytesIO("\n".join(words).encode()), "words.txt"
+
+
+def fresh_session(tmp_dir: str, name: str):
+    engine = create_engine(database_url or f"sqlite:///{tmp_dir}/{name}.db")
+    attach_profiler(engine)
+    Base.metadata.create_all(engine)
+    with engine.begin() as conn:
+        conn.execute(delete(NotAllowedWord))
+    return engine, sessionmaker(bind=engine)()
+
+
+def run(name: str, tmp_dir: str, func) -> dict:
+    engine, session = fresh_session(tmp_dir, name)
+    baseline = current_rss()
+    started = time.perf_counter()
+    with profile_queries() as profile:
+        words = func(NotallowedWordManagement(session))
+    elapsed = time.perf_counter() - started
+    session.close()
+    engine.dispose()
+    return {
+        "words": words,
+        "seconds": elapsed,
+        "words_per_second": words / elapsed,
+        "queries": profile.count,
+        "rss_growth_mb": (current_rss() - baseline) / 1024 / 1024,
+    }
+
+
+def main():
+    server = fakeredis.FakeServer()
+    redis_client._redis_client = fakeredis.FakeRedis(server=server, decode_responses=True)
+    words = random_words(WORDS)
+    random.Random(1).shuffle(words)
+
+    def batch_import(fmt):
+        def func(management):
+            file, filename = make_file(words, fmt)
+            stats = management.import_not_allowed_words(read_uploaded_words(file, filename))
+            assert stats["inserted"] == WORDS, stats
+            return stats["received"]
+
+        return func
+
+    def one_by_one(management):
+        for word in words[:SINGLE]:
+            management.create_not_allowed_word(word)
+        return SINGLE
+
+    cases = {"import_csv": batch_import("csv"), "import_txt": batch_import("txt")}
+    cases["one_by_one"] = one_by_one
+    results = {"words": WORDS, "database": (database_url or "sqlite").split("://")[0]}
+    with tempfile.TemporaryDirectory(prefix="bench-import-") as tmp_dir:
+        for name, func in cases.items():
+            result = results[name] = run(name, tmp_dir, func)
+            print(
+                f"{name:<12} {result['words']:>8} words {result['seconds']:8.2f} s "
+                f"{result['words_per_second']:>10.0f} words/s {result['queries']:>7} queries "
+                f"rss +{result['rss_growth_mb']:.1f} MB"
+            )
+    results["speedup"] = (
+        results["import_txt"]["words_per_second"] / results["one_by_one"]["words_per_second"]
+    )
+    print(f"batch import is {results['speedup']:.0f}x faster than adding words one by one")
+    write_results("import_words", results)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,189 @@
+"""
+database/management.py 里热点方法的耗时，数据量从 1 万到 1000 万条聊天记录
+
+python -m benchmark.bench_management
+BENCH_MANAGEMENT_SIZES 指定数据量（逗号分隔，默认 10000,100000，可以加到 10000000），
+默认每个数据量一个 SQLite 文件库，已经灌好的库会直接复用；
+BENCHMARK_DATABASE_URL 可以指向 MySQL 测试库（写 {rows} 占位，每个数据量一个库）
+默认关掉 Redis 历史缓存和接口缓存（HISTORY_CACHE_SIZE=0、ENDPOINT_CACHE_ENABLED=false），只测数据库这一层
+结果写到 benchmark_results/management.json，用 python -m benchmark.compare 对比两次结果
+"""
+
+import os
+
+os.environ.setdefault("HISTORY_CACHE_SIZE", "0")
+os.environ.setdefault("ENDPOINT_CACHE_ENABLED", "false")
+# 应用自己的引擎这里用不到，指到内存库，免得导入时要求配好 MySQL
+os.environ.setdefault("DATABASE_URL", "sqlite://")
+
+from datetime import datetime, timedelta
+
+from sqlalchemy import create_engine, insert, select, func
+from sqlalchemy.orm import sessionmaker
+
+from database.database_structure import Base, User, Conversation, Chat
+from database.management import UserManagement, ConversationManagement
+from database.pagination import encode_cursor
+from database.utils import migrate_db, backfill_conversation_stats
+from benchmark.utils import measure, write_results
+
+SIZES = [
+    int(size)
+    for size in os.environ.get("BENCH_MANAGEMENT_SIZES", "10000,100000").split(",")
+]
+database_url = os.environ.get(
+    "BENCHMARK_DATABASE_URL", "sqlite:///benchmark_management_{rows}.db"
+)
+MESSAGES_PER_CONVERSATION = 200
+CONVERSATIONS_PER_USER = 20
+# 每隔多少个用户有一个是软删除的，给回收站列表准备数据
+DELETED_USER_EVERY = 10
+PAGE_SIZE = 20
+BATCH_SIZE = 10_000
+
+
+def layout(rows: int) -> tuple[int, int]:
+    conversations = max(1, rows // MESSAGES_PER_CONVERSATION)
+    users = max(1, conversations // CONVERSATIONS_PER_USER)
+    return users, conversations
+
+
+def seed(session, rows: int):
+    users, conversations = layout(rows)
+    session.execute(
+        insert(User),
+        [
+            {
+                "user_id": user_id,
+                "name": f"bench{user_id}",
+                "password": "x",
+                "is_deleted": user_id % DELETED_USER_EVERY == 0,
+            }
+            for user_id in range(1, users + 1)
+        ],
+    )
+    session.execute(
+        insert(Conversation),
+        [
+            {"id": chat_id, "user_id": chat_id % users + 1, "title": f"bench_{chat_id}"}
+            for chat_id in range(1, conversations + 1)
+        ],
+    )
+    start = datetime(2024, 1, 1)
+    batch = []
+    for i in range(rows):
+        batch.append(
+            {
+                "id": i + 1,
+                "chat_id": i // MESSAGES_PER_CONVERSATION % conversations + 1,
+                "role": "user" if i % 2 == 0 else "assistant",
+                "content": f"message {i} " * 8,
+                "token_count": 20,
+                "create_at": start + timedelta(seconds=i),
+            }
+        )
+        if len(batch) == BATCH_SIZE:
+            session.execute(insert(Chat), batch)
+            session.commit()
+            batch = []
+    if batch:
+        session.execute(insert(Chat), batch)
+    session.commit()
+    # 对话列表的冗余字段按灌好的聊天记录算一遍，和线上迁移后的数据一致
+    backfill_conversation_stats(session.connection())
+    session.commit()
+
+
+def prepare(rows: int):
+    engine = create_engine(database_url.format(rows=rows))
+    Base.metadata.create_all(engine)
+    # 复用的老库补上新加的列
+    migrate_db(engine)
+    session = sessionmaker(bind=engine)()
+    _, conversations = layout(rows)
+    if session.scalar(select(func.count()).select_from(Conversation)) != conversations:
+        Base.metadata.drop_all(engine)
+        Base.metadata.create_all(engine)
+        print(f"seeding {rows} chat rows ...")
+        seed(session, rows)
+    return engine, session
+
+
+def bench_size(rows: int) -> dict:
+    engine, session = prepare(rows)
+    users, conversations = layout(rows)
+    user_management = UserManagement(session)
+    conversation_management = ConversationManagement(session)
+    # 读的对话放在中间，写的对话单独一个，避免互相影响
+    read_chat = conversations // 2 + 1
+    write_chat = conversations
+    read_user = read_chat % users + 1
+    last_user_page = max(1, users // PAGE_SIZE)
+    last_conversation_page = max(1, conversations // PAGE_SIZE)
+    # 深分页的游标就是前一页最后一行的主键
+    deep_user_cursor = encode_cursor([(last_user_page - 1) * PAGE_SIZE])
+    deep_conversation_cursor = encode_cursor([(last_conversation_page - 1) * PAGE_SIZE])
+
+    def fetch(result):
+        return result.all()
+
+    cases = {
+        "get_history_chat": lambda: conversation_management.get_history_chat(read_chat),
+        "show_user_conversation": lambda: fetch(
+            conversation_management.show_user_conversation(read_user, PAGE_SIZE, 1)
+        ),
+        "send_user_content": lambda: conversation_management.send_user_content(
+            write_chat, [{"role": "user", "content": "bench"}]
+        ),
+        "update_history_chat": lambda: conversation_management.update_history_chat(
+            write_chat, [{"role": "assistant", "content": "bench"}]
+        ),
+        # 上面两项每次各写一条，这里每次删两条，跑完大致回到原来的数据量
+        "remove_recent_message": lambda: conversation_management.remove_recent_message(
+            write_chat
+        ),
+        "admin_show_user_first_page": lambda: fetch(
+            user_management.show_user(PAGE_SIZE, 1)
+        ),
+        "admin_show_user_last_page_offset": lambda: fetch(
+            user_management.show_user(PAGE_SIZE, last_user_page)
+        ),
+        "admin_show_user_last_page_cursor": lambda: fetch(
+            user_management.show_user(PAGE_SIZE, 1, cursor=deep_user_cursor)
+        ),
+        "admin_soft_deleted_users": lambda: fetch(
+            user_management.get_soft_deleted_users(PAGE_SIZE, 1)
+        ),
+        "admin_show_all_conversation_first_page": lambda: fetch(
+            conversation_management.show_all_conversation(PAGE_SIZE, 1)
+        ),
+        "admin_show_all_conversation_last_page_offset": lambda: fetch(
+            conversation_management.show_all_conversation(
+                PAGE_SIZE, last_conversation_page
+            )
+        ),
+        "admin_show_all_conversation_last_page_cursor": lambda: fetch(
+            conversation_management.show_all_conversation(
+                PAGE_SIZE, 1, cursor=deep_conversation_cursor
+            )
+        ),
+    }
+    results = {}
+    for name, case in cases.items():
+        results[name] = measure(case, rounds=5, number=20)
+        print(f"{rows:>10} {name:<46} {results[name]['median'] * 1000:8.3f} ms")
+    session.close()
+    engine.dispose()
+    return results
+
+
+def main():
+    results = {
+        "database": database_url.split("://")[0],
+        "sizes": {str(rows): bench_size(rows) for rows in SIZES},
+    }
+    write_results("management", results)
+
+
+if __name__ == "__main__":
+    main()
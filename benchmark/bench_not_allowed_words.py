@@ -0,0 +1,57 @@
+"""
+违禁词匹配：每条消息重建 KeywordProcessor vs 进程内编译好的匹配器
+
+python -m benchmark.bench_not_allowed_words
+（只比较匹配器本身，旧路径里每条消息一次的全表 SELECT 没有算进去）
+"""
+
+import random
+
+from security.not_allowed_words import CompiledMatcher
+from benchmark.utils import measure, write_results
+
+WORD_COUNTS = [1_000, 10_000, 100_000]
+alphabet = [chr(c) for c in range(0x4E00, 0x4E00 + 3000)]
+
+
+def random_words(count: int, seed: int = 42) -> list[str]:
+    rng = random.Random(seed)
+    words = set()
+    while len(words) < count:
+        words.add("".join(rng.choices(alphabet, k=rng.randint(2, 6))))
+    return list(words)
+
+
+def random_message(length: int = 200, seed: int = 7) -> str:
+    rng = random.Random(seed)
+    return "".join(rng.choices(alphabet, k=length))
+
+
+def main():
+    message = random_message()
+    results = []
+    for count in WORD_COUNTS:
+        words = random_words(count)
+        compiled = CompiledMatcher.compile(words)
+
+        rebuild = measure(
+            lambda: CompiledMatcher.compile(words).extract_keywords(message), rounds=5
+        )
+        cached = measure(lambda: compiled.extract_keywords(message), rounds=5, number=200)
+        results.append(
+            {
+                "words": count,
+                "rebuild_per_message": rebuild,
+                "compiled": cached,
+                "speedup": rebuild["median"] / cached["median"],
+            }
+        )
+        print(
+            f"{count:>7} words: rebuild {rebuild['median'] * 1000:9.3f} ms, "
+            f"compiled {cached['median'] * 1000:9.3f} ms"
+        )
+    write_results("not_allowed_words", results)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,89 @@
+"""
+聊天记录分页：LIMIT/OFFSET vs 游标分页，在第 1 页和第 10000 页的耗时
+
+python -m benchmark.bench_pagination
+默认用 SQLite 临时库，设置 BENCHMARK_DATABASE_URL 可以指向 MySQL 测试库
+"""
+
+import os
+
+# 应用自己的引擎这里用不到，指到内存库，免得导入时要求配好 MySQL
+os.environ.setdefault("DATABASE_URL", "sqlite://")
+
+from datetime import datetime, timedelta
+
+from sqlalchemy import create_engine, insert
+from sqlalchemy.orm import sessionmaker
+
+from database.database_structure import Base, User, Conversation, Chat
+from database.management import ConversationManagement
+from database.pagination import encode_cursor
+from benchmark.utils import measure, write_results
+
+PAGE_SIZE = 10
+PAGES = [1, 10_000]
+ROWS = PAGE_SIZE * max(PAGES) + PAGE_SIZE
+database_url = os.environ.get(
+    "BENCHMARK_DATABASE_URL", "sqlite:///benchmark_pagination.db"
+)
+
+
+def seed(session):
+    session.execute(insert(User), [{"user_id": 1, "name": "bench", "password": "x"}])
+    session.execute(insert(Conversation), [{"id": 1, "user_id": 1, "title": "bench"}])
+    start = datetime(2024, 1, 1)
+    batch = []
+    for i in range(1, ROWS + 1):
+        batch.append(
+            {
+                "id": i,
+                "chat_id": 1,
+                "role": "user" if i % 2 else "assistant",
+                "content": f"message {i}",
+                "token_count": 3,
+                "create_at": start + timedelta(seconds=i),
+            }
+        )
+        if len(batch) == 10_000:
+            session.execute(insert(Chat), batch)
+            batch = []
+    if batch:
+        session.execute(insert(Chat), batch)
+    session.commit()
+
+
+def main():
+    engine = create_engine(database_url)
+    Base.metadata.drop_all(engine)
+    Base.metadata.create_all(engine)
+    session = sessionmaker(bind=engine)()
+    seed(session)
+    conversation_management = ConversationManagement(session)
+
+    results = []
+    for page in PAGES:
+        cursor = ""
+        if page > 1:
+            # 游标就是上一页最后一行的 (create_at, id)，这里直接算出来
+            last = conversation_management.get_chat(
+                1, page_size=1, page_number=(page - 1) * PAGE_SIZE
+            )[0]
+            cursor = encode_cursor([last.create_at, last.id])
+        offset = measure(
+            lambda: conversation_management.get_chat(1, PAGE_SIZE, page), number=20
+        )
+        keyset = measure(
+            lambda: conversation_management.get_chat(1, PAGE_SIZE, 1, cursor=cursor),
+            number=20,
+        )
+        results.append({"page": page, "offset": offset, "cursor": keyset})
+        print(
+            f"page {page:>6}: offset {offset['median'] * 1000:8.3f} ms, "
+            f"cursor {keyset['median'] * 1000:8.3f} ms"
+        )
+    session.close()
+    write_results("pagination", results)
+
+
+if __name__ == "__main__":
+    main()
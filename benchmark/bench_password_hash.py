@@ -0,0 +1,57 @@
+"""
+登录时 Argon2 校验的吞吐：每核每秒能处理多少次登录
+
+python -m benchmark.bench_password_hash
+用当前环境变量里的 ARGON2_* 参数，分别测单进程直接校验和进程池并发校验
+"""
+
+import asyncio
+import os
+import time
+
+from security.security import SecurityUtils
+from security.password_pool import PasswordHashPool
+from benchmark.utils import measure, write_results
+
+LOGINS = 200
+WORKER_COUNTS = sorted({1, 2, os.cpu_count() or 1})
+
+
+async def pool_throughput(workers: int, hashed: str) -> float:
+    pool = PasswordHashPool(workers, queue_limit=LOGINS)
+    pool.startup()
+    # 先让子进程都起来，不把启动时间算进去
+    await asyncio.gather(*(pool.verify("password", hashed) for _ in range(workers)))
+    start = time.perf_counter()
+    await asyncio.gather(*(pool.verify("password", hashed) for _ in range(LOGINS)))
+    elapsed = time.perf_counter() - start
+    pool.shutdown()
+    return LOGINS / elapsed
+
+
+def main():
+    hashed = SecurityUtils.get_password_hash("password")
+    direct = measure(lambda: SecurityUtils.verify_password("password", hashed), number=10)
+    results = {
+        "direct_logins_per_second": 1 / direct["median"],
+        "pool": [],
+    }
+    print(f"direct: {results['direct_logins_per_second']:.1f} logins/s (1 core)")
+    for workers in WORKER_COUNTS:
+        throughput = asyncio.run(pool_throughput(workers, hashed))
+        results["pool"].append(
+            {
+                "workers": workers,
+                "logins_per_second": throughput,
+                "logins_per_second_per_core": throughput / workers,
+            }
+        )
+        print(
+            f"pool x{workers}: {throughput:.1f} logins/s, "
+            f"{throughput / workers:.1f} per core"
+        )
+    write_results("password_hash", results)
+
+
+if __name__ == "__main__":
+    main()
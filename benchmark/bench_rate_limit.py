@@ -0,0 +1,78 @@
+"""
+限流器每个请求的额外开销，按 5k req/s 的节奏发请求
+
+python -m benchmark.bench_rate_limit
+需要 REDIS_URL 指向一个可用的 Redis；分两种情况：
+- normal: 1000 个用户轮流请求，都在限额内，每次走一趟 Redis 脚本
+- flood: 单个用户狂刷，超限后由本地预检直接拒绝
+"""
+
+import asyncio
+import time
+
+from starlette.requests import Request
+
+from benchmark.utils import write_results
+from security.limit_request import Limiter, RateLimitExceeded, get_rate_limit_key
+
+RATE = 5000
+DURATION = 2
+
+
+def make_request(user_id: int) -> Request:
+    request = Request({"type": "http", "headers": [], "client": ("127.0.0.1", 0)})
+    request.state.user_id = user_id
+    return request
+
+
+async def run(limiter: Limiter, route: str, requests: list) -> dict:
+    total = RATE * DURATION
+    interval = 1 / RATE
+    samples = []
+    rejected = 0
+    start = time.perf_counter()
+    for i in range(total):
+        # 按固定节奏发，落后了就不睡
+        delay = start + i * interval - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        t0 = time.perf_counter()
+        try:
+            await limiter.check_async(requests[i % len(requests)], route)
+        except RateLimitExceeded:
+            rejected += 1
+        samples.append(time.perf_counter() - t0)
+    elapsed = time.perf_counter() - start
+    samples.sort()
+    return {
+        "requests": total,
+        "rejected": rejected,
+        "achieved_rps": total / elapsed,
+        "p50_us": samples[len(samples) // 2] * 1e6,
+        "p99_us": samples[int(len(samples) * 0.99)] * 1e6,
+    }
+
+
+async def main():
+    limiter = Limiter(key_func=get_rate_limit_key)
+
+    @limiter.limit("100/second")
+    @limiter.limit("1000/minute")
+    async def endpoint(request: Request):
+        pass
+
+    route = endpoint._rate_limit_route
+    results = {
+        "normal": await run(limiter, route, [make_request(i) for i in range(1000)]),
+        "flood": await run(limiter, route, [make_request(-1)]),
+    }
+    for name, result in results.items():
+        print(
+            f"{name}: p50 {result['p50_us']:.1f} us, p99 {result['p99_us']:.1f} us, "
+            f"{result['achieved_rps']:.0f} req/s, rejected {result['rejected']}"
+        )
+    write_results("rate_limit", results)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
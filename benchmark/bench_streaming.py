@@ -0,0 +1,104 @@
+"""
+流式输出的开销：逐 token 发送 vs 合并后按 SSE 组帧
+
+python -m benchmark.bench_streaming
+用 StreamingResponse 驱动 ASGI send，每条 http.response.body 真的写一次 socket
+（对应一次 send 系统调用），另一端由线程读掉；CPU 用 process_time 统计
+"""
+
+import asyncio
+import socket
+import threading
+import time
+
+from starlette.responses import StreamingResponse
+
+from benchmark.utils import write_results
+from model.streaming import sse_stream
+
+STREAMS = 50
+TOKENS = 400
+# 上游两种节奏：一口气到达（网络包里挤了很多增量）和每 2ms 一个
+PACES = {"burst": 0, "paced_2ms": 0.002}
+TOKEN = "你好"
+
+
+async def upstream(pace: float):
+    for _ in range(TOKENS):
+        await asyncio.sleep(pace)
+        yield TOKEN
+
+
+async def before(pace: float):
+    # 改造前：逐个 yield 原始增量，回复用字符串拼接累积
+    full_text = ""
+    async for chunk in upstream(pace):
+        full_text += chunk
+        yield chunk
+
+
+async def after(pace: float):
+    chunks = []
+    async for chunk in upstream(pace):
+        chunks.append(chunk)
+        yield chunk
+    "".join(chunks)
+
+
+def drain(sock: socket.socket):
+    while sock.recv(65536):
+        pass
+
+
+async def drive(body, sock: socket.socket) -> int:
+    sends = 0
+
+    async def send(message):
+        nonlocal sends
+        if message["type"] == "http.response.body" and message.get("body"):
+            sock.sendall(message["body"])
+            sends += 1
+
+    async def receive():
+        await asyncio.Event().wait()
+
+    response = StreamingResponse(body, media_type="text/event-stream")
+    await response({"type": "http", "asgi": {"spec_version": "2.4"}}, receive, send)
+    return sends
+
+
+async def run(make_body, pace: float) -> dict:
+    sock, peer = socket.socketpair()
+    reader = threading.Thread(target=drain, args=(peer,), daemon=True)
+    reader.start()
+    cpu_start = time.process_time()
+    sends = await asyncio.gather(
+        *(drive(make_body(pace), sock) for _ in range(STREAMS))
+    )
+    cpu = time.process_time() - cpu_start
+    sock.close()
+    reader.join()
+    peer.close()
+    return {
+        "sends_per_response": sum(sends) / STREAMS,
+        "cpu_ms_per_stream": cpu / STREAMS * 1000,
+    }
+
+
+async def main():
+    results = {}
+    for name, pace in PACES.items():
+        results[name] = {
+            "before": await run(before, pace),
+            "after": await run(lambda p: sse_stream(after(p)), pace),
+        }
+        for stage, result in results[name].items():
+            print(
+                f"{name} {stage}: {result['sends_per_response']:.0f} sends/response, "
+                f"{result['cpu_ms_per_stream']:.2f} ms CPU/stream"
+            )
+    write_results("streaming", results)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,166 @@
+"""
+滚动摘要对 /send_message 的影响：同一段长对话，有摘要 vs 没有摘要时
+发给上游的 prompt token 数和首字延迟（TTFT）
+
+python -m benchmark.bench_summary
+走真实路由（httpx 的 ASGITransport），Redis 换成 fakeredis，上游是 tests/fake_openai.py 的假上游；
+假上游按 prompt 的 token 数模拟处理耗时（BENCH_SUMMARY_PREFILL_US 微秒/token，默认 20），
+设成 0 时 TTFT 只剩本服务这一侧的开销（查库、拼 prompt、传输）
+BENCH_SUMMARY_MESSAGES 对话里的消息条数（默认 400），BENCH_SUMMARY_ROUNDS 每种情况发几条（默认 20）
+结果写到 benchmark_results/summary.json
+"""
+
+import os
+import tempfile
+
+_tmp_dir = tempfile.mkdtemp(prefix="bench-summary-")
+os.environ.setdefault("DATABASE_URL", f"sqlite:///{_tmp_dir}/bench.db")
+os.environ.setdefault("ENDPOINT_CACHE_ENABLED", "false")
+# 路由在导入时就读了这个开关
+os.environ["SUMMARY_ENABLED"] = "true"
+
+import asyncio
+import logging
+import shutil
+import statistics
+import time
+from datetime import datetime, timedelta
+
+import fakeredis
+import httpx
+from fastapi import FastAPI
+from sqlalchemy import insert
+
+from benchmark.utils import write_results
+from database import redis_client
+from database.async_management import AsyncConversationManagement
+from database.database_structure import Base, User, Conversation, Chat, Character
+from database.engine_creating import engine, AsyncSessionLocal, async_engine
+from database.user_state_cache import UserState
+from model import summarizer as summarizer_module
+from model.model import llm_client_manager
+from model.tokenizer import count_tokens
+from router import user_conversation
+from security.verification import get_current_user
+from tests.fake_openai import FakeUpstream
+
+MESSAGES = int(os.environ.get("BENCH_SUMMARY_MESSAGES", "400"))
+ROUNDS = int(os.environ.get("BENCH_SUMMARY_ROUNDS", "20"))
+PREFILL_PER_TOKEN = float(os.environ.get("BENCH_SUMMARY_PREFILL_US", "20")) / 1_000_000
+# 每条消息大约 100 个 token
+MESSAGE_TEXT = "今天和昔涟聊了很多事情，" * 9
+SUMMARY_TEXT = "用户和昔涟是老朋友，聊过旅行、工作和最近读的书。" * 20
+CASES = {"no_summary": 1, "summary": 2}
+
+logging.getLogger("httpx").setLevel(logging.WARNING)
+
+
+def seed():
+    Base.metadata.create_all(engine)
+    start = datetime(2026, 1, 1)
+    with engine.begin() as conn:
+        conn.execute(insert(User).values(user_id=1, name="bench", password="x"))
+        conn.execute(insert(Character).values(id=1, name="昔涟", system_prompt="你是昔涟"))
+        conn.execute(
+            insert(Conversation),
+            [
+                {"id": chat_id, "user_id": 1, "title": f"昔涟_{name}", "character_id": 1}
+                for name, chat_id in CASES.items()
+            ],
+        )
+        conn.execute(
+            insert(Chat),
+            [
+                {
+                    "chat_id": chat_id,
+                    "role": "user" if i % 2 == 0 else "assistant",
+                    "content": MESSAGE_TEXT,
+                    "create_at": start + timedelta(seconds=i),
+                    "token_count": count_tokens(MESSAGE_TEXT),
+                }
+                for chat_id in CASES.values()
+                for i in range(MESSAGES)
+            ],
+        )
+
+
+async def add_summary(chat_id: int):
+    # 摘要覆盖到倒数第 summary_keep_recent 条之前，和后台压缩的结果一样
+    async with AsyncSessionLocal() as db:
+        management = AsyncConversationManagement(db)
+        rows = await management.get_uncompacted_messages(chat_id)
+        covered = rows[-summarizer_module.summary_keep_recent - 1].id
+        await management.save_summary(chat_id, SUMMARY_TEXT, covered_until_id=covered)
+
+
+def make_app() -> FastAPI:
+    app = FastAPI()
+    app.include_router(user_conversation.router)
+    app.dependency_overrides[get_current_user] = lambda: UserState(1, "bench", False, False, False)
+    return app
+
+
+async def run(client: httpx.AsyncClient, upstream: FakeUpstream, chat_id: int) -> dict:
+    ttft = []
+    prompt_tokens = []
+    for i in range(ROUNDS):
+        body = {
+            "chat_id": chat_id,
+            "message": "你还记得我们上次聊了什么吗？",
+            "model": "deepseek-chat",
+            "whether_regenerate": False,
+        }
+        # 每个请求一个 IP，不会被 15/minute 挡住
+        headers = {"X-Forwarded-For": f"10.0.{chat_id}.{i}"}
+        started = time.perf_counter()
+        first = None
+        async with client.stream("POST", "/send_message", json=body, headers=headers) as response:
+            assert response.status_code == 200, response.status_code
+            async for line in response.aiter_lines():
+                if first is None and line.startswith("data: "):
+                    first = time.perf_counter() - started
+        ttft.append(first)
+        messages = upstream.requests[-1]["messages"]
+        prompt_tokens.append(sum(count_tokens(m["content"]) for m in messages))
+    return {
+        "rounds": ROUNDS,
+        "prompt_tokens": statistics.median(prompt_tokens),
+        "ttft_p50_ms": statistics.median(ttft) * 1000,
+        "ttft_max_ms": max(ttft) * 1000,
+    }
+
+
+async def main():
+    server = fakeredis.FakeServer()
+    redis_client._redis_client = fakeredis.FakeRedis(server=server, decode_responses=True)
+    redis_client._async_redis_client = fakeredis.FakeAsyncRedis(
+        server=server, decode_responses=True
+    )
+    # 只测拼 prompt，不让后台压缩在跑的过程中改掉对话
+    summarizer_module.summary_trigger_messages = 10**9
+    summarizer_module.summary_trigger_tokens = 10**9
+    seed()
+    await add_summary(CASES["summary"])
+    upstream = FakeUpstream(prefill_per_token=PREFILL_PER_TOKEN)
+    os.environ["BASE_URL"] = upstream.start()
+    os.environ.setdefault("API_KEY", "bench-key")
+    results = {"messages": MESSAGES, "prefill_us_per_token": PREFILL_PER_TOKEN * 1_000_000}
+    transport = httpx.ASGITransport(app=make_app())
+    try:
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+            for name, chat_id in CASES.items():
+                result = results[name] = await run(client, upstream, chat_id)
+                print(
+                    f"{name:<12} prompt {result['prompt_tokens']:>7.0f} tokens "
+                    f"TTFT p50 {result['ttft_p50_ms']:8.1f} ms max {result['ttft_max_ms']:8.1f} ms"
+                )
+    finally:
+        await llm_client_manager.shutdown()
+        await async_engine.dispose()
+        upstream.stop()
+        shutil.rmtree(_tmp_dir, ignore_errors=True)
+    write_results("summary", results)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
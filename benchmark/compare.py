@@ -0,0 +1,62 @@
+"""
+对比两次基准测试的 JSON 结果，按中位数算变化
+
+python -m benchmark.compare old.json new.json [阈值，默认 0.1]
+两边同一位置上带 median 的统计都会比较，变慢超过阈值的标成 REGRESSION，有的话退出码为 1
+"""
+
+import json
+import sys
+
+
+def collect(node, path=()) -> dict:
+    """
+    把结果树里所有 measure() 的统计拍平成 {路径: 中位数}
+    """
+    found = {}
+    if isinstance(node, dict):
+        if "median" in node:
+            found["/".join(path)] = node["median"]
+            return found
+        for key, value in node.items():
+            found.update(collect(value, path + (str(key),)))
+    elif isinstance(node, list):
+        for index, value in enumerate(node):
+            found.update(collect(value, path + (str(index),)))
+    return found
+
+
+def compare(old: dict, new: dict, threshold: float) -> list[tuple]:
+    rows = []
+    new_medians = collect(new)
+    for path, before in collect(old).items():
+        after = new_medians.get(path)
+        if after is None or not before:
+            continue
+        change = after / before - 1
+        rows.append((path, before, after, change, change > threshold))
+    return rows
+
+
+def main():
+    if len(sys.argv) < 3:
+        print(__doc__)
+        sys.exit(2)
+    with open(sys.argv[1], encoding="utf-8") as f:
+        old = json.load(f)
+    with open(sys.argv[2], encoding="utf-8") as f:
+        new = json.load(f)
+    threshold = float(sys.argv[3]) if len(sys.argv) > 3 else 0.1
+    rows = compare(old, new, threshold)
+    for path, before, after, change, regression in rows:
+        flag = "REGRESSION" if regression else ""
+        print(
+            f"{path:<70} {before * 1000:10.3f} ms -> {after * 1000:10.3f} ms "
+            f"{change:+8.1%} {flag}"
+        )
+    if any(row[-1] for row in rows):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+import json
+import os
+import resource
+import statistics
+import time
+
+# 基准测试的公共工具，结果统一写成 JSON 方便前后对比
+output_dir = os.environ.get("BENCHMARK_OUTPUT_DIR", "benchmark_results")
+
+
+def measure(func, rounds: int = 5, number: int = 1) -> dict:
+    """
+    跑 rounds 轮，每轮调用 number 次，返回单次调用耗时（秒）的统计
+    """
+    samples = []
+    for _ in range(rounds):
+        start = time.perf_counter()
+        for _ in range(number):
+            func()
+        samples.append((time.perf_counter() - start) / number)
+    return {
+        "min": min(samples),
+        "median": statistics.median(samples),
+        "max": max(samples),
+        "rounds": rounds,
+        "number": number,
+    }
+
+
+def write_results(name: str, results) -> str:
+    os.makedirs(output_dir, exist_ok=True)
+    path = os.path.join(output_dir, f"{name}.json")
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(results, f, ensure_ascii=False, indent=2, default=str)
+    print(f"results written to {path}")
+    return path
+
+
+def current_rss() -> int:
+    """
+    当前 RSS（字节），Linux 读 /proc，其他系统退回到 ru_maxrss（只能拿到历史峰值）
+    """
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except OSError:
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+async def run_export(export, session_factory) -> dict:
+    """
+    跑完一次 ChatExport.stream，统计吞吐和过程中 RSS 的峰值（测试里也用，两个数出自同一次导出）
+    """
+    baseline = current_rss()
+    peak = baseline
+    rows = 0
+    size = 0
+    started = time.perf_counter()
+    async for chunk in export.stream(session_factory):
+        rows += chunk.count(b"\n")
+        size += len(chunk)
+        peak = max(peak, current_rss())
+    elapsed = time.perf_counter() - started
+    return {
+        "rows": rows,
+        "bytes": size,
+        "seconds": elapsed,
+        "rows_per_second": rows / elapsed if elapsed else 0,
+        "mb_per_second": size / elapsed / 1024 / 1024 if elapsed else 0,
+        "rss_baseline_mb": baseline / 1024 / 1024,
+        "rss_peak_mb": peak / 1024 / 1024,
+        "rss_growth_mb": (peak - baseline) / 1024 / 1024,
+    }
@@ -1,15 +1,22 @@
 from . import database_structure
 from . import engine_creating
 from . import management
+from . import async_management
 from . import utils
 
 from .database_structure import (Base, Conversation, User,)
 from .engine_creating import (SessionLocal, db_host, db_password,
-                                      db_port, db_url, db_user, engine,)
+                                      db_port, db_url, db_user, engine,
+                                      AsyncSessionLocal, async_engine,)
 from .management import (UserManagement,ConversationManagement,NotallowedWordManagement)
-from .utils import (init_db,get_db)
+from .async_management import (AsyncUserManagement,AsyncConversationManagement,
+                               AsyncCharacterManagement,AsyncNotallowedWordManagement)
+from .utils import (init_db,get_db,get_async_db)
 
-__all__ = ['Base', 'Conversation', 'SessionLocal', 'User', 'UserManagement',
+__all__ = ['AsyncCharacterManagement', 'AsyncConversationManagement',
+           'AsyncNotallowedWordManagement', 'AsyncSessionLocal',
+           'AsyncUserManagement', 'Base', 'Conversation', 'SessionLocal', 'User',
+           'UserManagement', 'async_engine', 'async_management',
            'database_structure', 'db_host', 'db_password', 'db_port', 'db_url',
            'db_user', 'engine', 'engine_creating', 'init_db',
            'management', 'utils']
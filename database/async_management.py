@@ -0,0 +1,440 @@
+from typing import Any
+
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import select, insert, delete, func
+
+from .database_structure import (
+    User,
+    Conversation,
+    ConversationSummary,
+    Character,
+    Chat,
+    NotAllowedWord,
+    ArchivedChat,
+)
+from .pagination import paginate
+from .user_state_cache import UserState
+from .management import (
+    HISTORY_BATCH_SIZE,
+    history_batch_query,
+    fill_history_within_budget,
+    history_from_cache,
+    latest_turn_query,
+    cached_turn,
+    turn_rows,
+    CONVERSATION_LIST_COLUMNS,
+    append_stats_query,
+    refresh_stats_query,
+    stats_tags,
+    lock_conversation_query,
+    rehydrate_queries,
+)
+from .history_cache import history_cache
+from .endpoint_cache import endpoint_cache, user_conversations_tag
+from model.tokenizer import count_tokens, get_history_token_budget
+
+# management.py 的异步版本，聊天热路径直接 await，不再经过线程池
+# 管理员接口迁移完之前两边都要保留，改动时注意同步修改
+
+
+class AsyncUserManagement:
+    def __init__(self, db: AsyncSession):
+        self.db = db
+
+    async def get_user_by_name(self, name: str):
+        return (
+            await self.db.execute(select(User).where(User.name == name))
+        ).scalar_one_or_none()
+
+    async def get_user_by_id(self, user_id: int):
+        return (
+            await self.db.execute(select(User).where(User.user_id == user_id))
+        ).scalar_one_or_none()
+
+    async def create_user(
+        self,
+        name: str,
+        password: str,
+        is_admin: bool = False,
+        is_banned: bool = False,
+        is_deleted: bool = False,
+    ):
+        existing_user = await self.get_user_by_name(name)
+        if existing_user:
+            return existing_user
+        db_user = User(
+            name=name,
+            password=password,
+            is_admin=is_admin,
+            is_deleted=is_deleted,
+            is_banned=is_banned,
+        )
+        self.db.add(db_user)
+        # 字段都是显式给的，主键在 flush 时已经拿到，不用再 refresh 查一次
+        await self.db.commit()
+        return db_user
+
+    async def get_user_state(self, user_id: int):
+        row = (
+            await self.db.execute(
+                select(
+                    User.user_id,
+                    User.name,
+                    User.is_admin,
+                    User.is_banned,
+                    User.is_deleted,
+                ).where(User.user_id == user_id)
+            )
+        ).one_or_none()
+        if row is None:
+            return None
+        return UserState(*row)
+
+
+class AsyncConversationManagement:
+    def __init__(self, db: AsyncSession):
+        self.db = db
+
+    async def create_conversation(
+        self,
+        user_id: int,
+        title: str = "新对话",
+        character_id: int | None = None,
+    ):
+        new_chat = Conversation(
+            user_id=user_id,
+            title=title,
+            character_id=character_id,
+        )
+        self.db.add(new_chat)
+        # 调用方只用主键，flush 时已经拿到，不用再 refresh 查一次
+        await self.db.commit()
+        await endpoint_cache.invalidate_async(user_conversations_tag(user_id))
+        return new_chat
+
+    async def get_conversation(self, chat_id: int):
+        return (
+            await self.db.execute(
+                select(Conversation).where(Conversation.id == chat_id)
+            )
+        ).scalar_one_or_none()
+
+    async def show_user_conversation(
+        self, user_id, page_size, page_number, cursor=None
+    ):
+        return await self.db.execute(
+            paginate(
+                select(*CONVERSATION_LIST_COLUMNS).where(
+                    Conversation.user_id == user_id
+                ),
+                [Conversation.updated_at, Conversation.id],
+                page_size,
+                page_number,
+                cursor,
+                descending=True,
+            )
+        )
+
+    async def rehydrate_conversation(self, chat: Conversation) -> bool:
+        """
+        对话已归档时把聊天记录搬回 chats，没归档时不查库；读写聊天记录之前调用
+        """
+        if not chat.archived:
+            return False
+        if not (await self.db.execute(lock_conversation_query(chat.id))).scalar():
+            # 别的请求已经搬回去了
+            await self.db.commit()
+            return False
+        for statement in rehydrate_queries(chat.id):
+            await self.db.execute(statement)
+        await self.db.commit()
+        return True
+
+    async def get_chat(self, chat_id, page_size, page_number, cursor=None):
+        return (
+            (
+                await self.db.execute(
+                    paginate(
+                        select(Chat).where(Chat.chat_id == chat_id),
+                        [Chat.create_at, Chat.id],
+                        page_size,
+                        page_number,
+                        cursor,
+                        descending=True,
+                    )
+                )
+            )
+            .scalars()
+            .all()
+        )
+
+    async def send_user_content(
+        self, chat_id: int, history_chat: list[dict[str, Any]]
+    ):
+        chat = await self.get_conversation(chat_id)
+        if not chat:
+            return False
+        history_chat = history_chat[0]
+        data_object = [
+            {
+                "chat_id": chat_id,
+                "role": history_chat["role"],
+                "content": history_chat["content"],
+                "token_count": count_tokens(history_chat["content"]),
+            }
+        ]
+        await self.db.execute(insert(Chat), data_object)
+        await self.db.execute(
+            append_stats_query(chat_id, history_chat["role"], history_chat["content"], 1)
+        )
+        await self.db.commit()
+        await history_cache.drop_async(chat_id)
+        await endpoint_cache.invalidate_async(*stats_tags(chat_id, chat.user_id))
+        return True
+
+    async def update_history_chat(
+        self, chat_id: int, history_chat: list[dict[str, Any]]
+    ):
+        chat = await self.get_conversation(chat_id)
+        if not chat:
+            return False
+        history_chat = history_chat[-1]
+        data_object = [
+            {
+                "chat_id": chat_id,
+                "role": history_chat["role"],
+                "content": history_chat["content"],
+                "token_count": count_tokens(history_chat["content"]),
+            }
+        ]
+        await self.db.execute(insert(Chat), data_object)
+        await self.db.execute(
+            append_stats_query(chat_id, history_chat["role"], history_chat["content"], 1)
+        )
+        await self.db.commit()
+        await history_cache.drop_async(chat_id)
+        await endpoint_cache.invalidate_async(*stats_tags(chat_id, chat.user_id))
+        return True
+
+    async def persist_turn(
+        self,
+        chat_id: int,
+        user_content: str,
+        assistant_content: str,
+        regenerate: bool = False,
+        truncated: bool = False,
+        user_id: int | None = None,
+    ):
+        """
+        一轮对话的落库：（重新生成时先删掉上一轮）写入用户和助手两条消息、
+        更新对话列表的冗余字段，全部在同一个事务里提交
+        user_id 是对话的主人，传了就顺便让他的对话列表缓存失效
+        """
+        if regenerate:
+            ids_to_delete = (
+                (
+                    await self.db.execute(
+                        select(Chat.id)
+                        .where(Chat.chat_id == chat_id)
+                        .order_by(Chat.create_at.desc(), Chat.id.desc())
+                        .limit(2)
+                    )
+                )
+                .scalars()
+                .all()
+            )
+            if ids_to_delete:
+                await self.db.execute(delete(Chat).where(Chat.id.in_(ids_to_delete)))
+        else:
+            ids_to_delete = []
+        turn = turn_rows(chat_id, user_content, assistant_content, truncated)
+        await self.db.execute(insert(Chat), turn)
+        messages = cached_turn(
+            (await self.db.execute(latest_turn_query(chat_id))).all(), turn
+        )
+        await self.db.execute(
+            append_stats_query(
+                chat_id, "assistant", assistant_content, len(turn), len(ids_to_delete)
+            )
+        )
+        await self.db.commit()
+        # 提交之后再改缓存，对不上就直接丢掉，下次读的时候回源
+        if messages is None:
+            await history_cache.drop_async(chat_id)
+        else:
+            await history_cache.append_async(chat_id, messages, pop=len(ids_to_delete))
+        await endpoint_cache.invalidate_async(*stats_tags(chat_id, user_id))
+        return True
+
+    async def get_history_chat(
+        self,
+        chat_id: int,
+        token_budget: int | None = None,
+        after_id: int | None = None,
+    ):
+        if token_budget is None:
+            token_budget = get_history_token_budget(None)
+        cached = await history_cache.get_async(chat_id)
+        if cached is None and history_cache.enabled:
+            # 冷对话：取最近 N 条回填缓存，活跃对话之后拼 prompt 不再查库
+            version = await history_cache.get_version_async(chat_id)
+            rows = (
+                await self.db.execute(
+                    history_batch_query(chat_id, limit=history_cache.size)
+                )
+            ).all()[::-1]
+            cached = (rows, len(rows) < history_cache.size)
+            await history_cache.populate_async(chat_id, version, *cached)
+        if cached is not None:
+            history_chat = history_from_cache(cached, token_budget, after_id)
+            if history_chat is not None:
+                return history_chat
+        # 缓存里的不够预算，从最新的消息往回分批取，直到 token 预算用完
+        history_chat = []
+        used_tokens = 0
+        before = None
+        while True:
+            rows = (
+                await self.db.execute(history_batch_query(chat_id, before, after_id))
+            ).all()
+            used_tokens, exhausted = fill_history_within_budget(
+                rows, history_chat, used_tokens, token_budget
+            )
+            if exhausted or len(rows) < HISTORY_BATCH_SIZE:
+                break
+            before = (rows[-1].create_at, rows[-1].id)
+        history_chat.reverse()
+        return history_chat
+
+    async def get_certain_history_chat(
+        self, chat_id: int, page_size, page_number, cursor=None
+    ):
+        chat = await self.get_chat(
+            chat_id, page_size=page_size, page_number=page_number, cursor=cursor
+        )
+        if not chat:
+            return None
+        history_chat = []
+        for row in reversed(chat):
+            history_chat.append(
+                {
+                    "id": row.id,
+                    "role": row.role,
+                    "content": row.content,
+                    "time": row.create_at,
+                    "truncated": row.truncated,
+                }
+            )
+        return history_chat
+
+    async def delete_conversation(self, chat_id: int, user_id: int | None = None):
+        """
+        user_id 是对话的主人，传了就顺便让他的对话列表缓存失效
+        """
+        # 直接批量删，避免 ORM 级联先把整段聊天记录加载进来
+        await self.db.execute(delete(Chat).where(Chat.chat_id == chat_id))
+        await self.db.execute(delete(ArchivedChat).where(ArchivedChat.chat_id == chat_id))
+        await self.db.execute(
+            delete(ConversationSummary).where(ConversationSummary.chat_id == chat_id)
+        )
+        result = await self.db.execute(
+            delete(Conversation).where(Conversation.id == chat_id)
+        )
+        await self.db.commit()
+        await history_cache.drop_async(chat_id)
+        await endpoint_cache.invalidate_async(*stats_tags(chat_id, user_id))
+        return result.rowcount > 0
+
+    async def get_summary(self, chat_id: int):
+        return (
+            await self.db.execute(
+                select(ConversationSummary).where(
+                    ConversationSummary.chat_id == chat_id
+                )
+            )
+        ).scalar_one_or_none()
+
+    async def get_uncompacted_stats(self, chat_id: int, after_id: int | None = None):
+        """
+        摘要之后还有多少条消息、多少 token，用来判断要不要再压缩
+        """
+        stmt = select(
+            func.count(Chat.id), func.coalesce(func.sum(Chat.token_count), 0)
+        ).where(Chat.chat_id == chat_id)
+        if after_id is not None:
+            stmt = stmt.where(Chat.id > after_id)
+        message_count, token_count = (await self.db.execute(stmt)).one()
+        return message_count, token_count
+
+    async def get_uncompacted_messages(self, chat_id: int, after_id: int | None = None):
+        stmt = (
+            select(Chat.id, Chat.role, Chat.content)
+            .where(Chat.chat_id == chat_id)
+            .order_by(Chat.create_at, Chat.id)
+        )
+        if after_id is not None:
+            stmt = stmt.where(Chat.id > after_id)
+        return (await self.db.execute(stmt)).all()
+
+    async def save_summary(self, chat_id: int, content: str, covered_until_id: int):
+        summary = await self.get_summary(chat_id)
+        if summary is None:
+            summary = ConversationSummary(chat_id=chat_id)
+            self.db.add(summary)
+        elif summary.covered_until_id >= covered_until_id:
+            # 别的 worker 已经压缩到更后面了
+            return False
+        summary.content = content
+        summary.covered_until_id = covered_until_id
+        summary.token_count = count_tokens(content)
+        await self.db.commit()
+        return True
+
+    async def remove_recent_message(self, chat_id: int, user_id: int | None = None):
+        history_chat = await self.get_chat(chat_id, page_size=2, page_number=1)
+        if not history_chat:
+            return False
+        ids_to_delete = [msg.id for msg in history_chat]
+        await self.db.execute(delete(Chat).where(Chat.id.in_(ids_to_delete)))
+        await self.db.execute(refresh_stats_query(chat_id))
+        await self.db.commit()
+        await history_cache.append_async(chat_id, [], pop=len(ids_to_delete))
+        await endpoint_cache.invalidate_async(*stats_tags(chat_id, user_id))
+        return True
+
+
+class AsyncCharacterManagement:
+    def __init__(self, db: AsyncSession):
+        self.db = db
+
+    async def get_character_by_name(self, name):
+        return (
+            await self.db.execute(select(Character).where(Character.name == name))
+        ).scalar_one_or_none()
+
+    async def get_character_by_id(self, id):
+        return (
+            await self.db.execute(select(Character).where(Character.id == id))
+        ).scalar_one_or_none()
+
+    async def get_character(self, page_size, page_number, cursor=None):
+        return await self.db.execute(
+            paginate(
+                select(Character.id, Character.name),
+                [Character.id],
+                page_size,
+                page_number,
+                cursor,
+            )
+        )
+
+
+class AsyncNotallowedWordManagement:
+    def __init__(self, db: AsyncSession):
+        self.db = db
+
+    async def get_not_allowed_words_all(self):
+        result = (await self.db.execute(select(NotAllowedWord.word))).scalars().all()
+        if not result:
+            return None
+        return list(result)
@@ -0,0 +1,127 @@
+import asyncio
+import logging
+
+import redis
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from .database_structure import Character
+from .engine_creating import AsyncSessionLocal
+from .redis_client import get_redis, get_async_redis
+
+Logger = logging.getLogger(__name__)
+
+# 增删改角色后广播角色 id，各 worker 收到后丢掉本地那一份，下次用到再查库
+CHARACTER_CHANNEL = "character:invalidate"
+
+
+class CharacterInfo:
+    """
+    发消息只需要的几个字段，代替 ORM 的 Character 对象
+    """
+
+    __slots__ = ("id", "name", "system_prompt", "cacheable")
+
+    def __init__(self, id, name, system_prompt, cacheable):
+        self.id = int(id)
+        self.name = name
+        self.system_prompt = system_prompt
+        self.cacheable = bool(cacheable)
+
+    @classmethod
+    def from_row(cls, character: Character):
+        return cls(
+            character.id, character.name, character.system_prompt, character.cacheable
+        )
+
+
+class CharacterRegistry:
+    """
+    进程内的全部角色，启动时整表加载（角色只有几十个），之后按广播失效
+    热路径上命中时不查库；没命中（刚创建、刚失效）时查一次补进来
+    """
+
+    def __init__(self):
+        self._by_id = {}
+        self._by_name = {}
+        # 每收到一次失效加一；查库期间变了就说明查到的可能是旧数据，不放进注册表
+        self._generation = 0
+
+    def _put(self, info: CharacterInfo):
+        self._drop(info.id)
+        self._by_id[info.id] = info
+        self._by_name[info.name] = info
+
+    def _drop(self, character_id: int):
+        info = self._by_id.pop(character_id, None)
+        if info is not None and self._by_name.get(info.name) is info:
+            del self._by_name[info.name]
+
+    async def load(self):
+        generation = self._generation
+        async with AsyncSessionLocal() as db:
+            characters = (await db.execute(select(Character))).scalars().all()
+        self._by_id = {}
+        self._by_name = {}
+        if generation != self._generation:
+            # 加载期间有角色变更，整表结果可能是旧的，先空着按需查库
+            return
+        for character in characters:
+            self._put(CharacterInfo.from_row(character))
+        Logger.info(f"Loaded {len(self._by_id)} characters")
+
+    async def get(self, character_id: int, db: AsyncSession) -> CharacterInfo | None:
+        info = self._by_id.get(character_id)
+        if info is not None:
+            return info
+        return await self._fetch(db, Character.id == character_id)
+
+    async def get_by_name(self, name: str, db: AsyncSession) -> CharacterInfo | None:
+        info = self._by_name.get(name)
+        if info is not None:
+            return info
+        return await self._fetch(db, Character.name == name)
+
+    async def _fetch(self, db: AsyncSession, condition) -> CharacterInfo | None:
+        generation = self._generation
+        character = (
+            await db.execute(select(Character).where(condition))
+        ).scalar_one_or_none()
+        if character is None:
+            return None
+        info = CharacterInfo.from_row(character)
+        if generation == self._generation:
+            self._put(info)
+        return info
+
+    def invalidate(self, character_id: int):
+        # 管理员接口是同步的，这里用同步客户端；在写操作提交之后调用
+        self._generation += 1
+        self._drop(character_id)
+        try:
+            get_redis().publish(CHARACTER_CHANNEL, character_id)
+        except redis.RedisError as e:
+            Logger.error(f"Invalidate character {character_id} failed: {e}")
+
+    async def listen(self):
+        """
+        在 lifespan 里作为后台任务运行：先订阅再整表加载，断线重连后也重新加载，
+        这样断线期间漏掉的广播不会留下旧数据
+        """
+        while True:
+            try:
+                pubsub = get_async_redis().pubsub()
+                await pubsub.subscribe(CHARACTER_CHANNEL)
+                await self.load()
+                async for message in pubsub.listen():
+                    if message["type"] == "message":
+                        self._generation += 1
+                        self._drop(int(message["data"]))
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                Logger.error(f"Character registry subscriber error: {e}")
+                await asyncio.sleep(1)
+
+
+character_registry = CharacterRegistry()
@@ -1,8 +1,22 @@
-from typing import Dict, List, Any
+from typing import Dict, List, Any, Optional
 from datetime import datetime
-from sqlalchemy import String, BigInteger, JSON, Boolean, ForeignKey, func, text, Text
+from sqlalchemy import String, BigInteger, Integer, JSON, Boolean, ForeignKey, Index, func, text, Text, DateTime
 from sqlalchemy.dialects.mysql import DATETIME
 from sqlalchemy.orm import DeclarativeBase, Mapped, mapped_column, relationship
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.sql.functions import now
+
+# SQLite 只有 INTEGER PRIMARY KEY 才会自增，其它库仍然是 BIGINT
+Id = BigInteger().with_variant(Integer, "sqlite")
+# MySQL 的 DATETIME 默认只到秒，同一秒内的消息要靠微秒排序；SQLite 本身就存微秒
+PreciseDateTime = DateTime().with_variant(DATETIME(fsp=6), "mysql")
+
+
+@compiles(now, "sqlite")
+def sqlite_now(element, compiler, **kw):
+    # SQLite 的 CURRENT_TIMESTAMP 是 "YYYY-MM-DD HH:MM:SS"，而 SQLAlchemy 绑定的时间带 6 位微秒，
+    # 按字符串比较时游标那一行会被当成更小而重复出现；这里生成同样格式的时间（毫秒精度）
+    return "(STRFTIME('%Y-%m-%d %H:%M:%f', 'now') || '000')"
 
 
 class Base(DeclarativeBase):
@@ -11,15 +25,20 @@ class Base(DeclarativeBase):
 
 class User(Base):
     __tablename__ = "users"
-    __table_args__ = {"mysql_charset": "utf8mb4", "mysql_collate": "utf8mb4_unicode_ci"}
+    __table_args__ = (
+        Index("ix_users_is_deleted_user_id", "is_deleted", "user_id"),
+        {"mysql_charset": "utf8mb4", "mysql_collate": "utf8mb4_unicode_ci"},
+    )
     user_id: Mapped[int] = mapped_column(
-        BigInteger, primary_key=True, autoincrement=True, index=True
+        Id, primary_key=True, autoincrement=True, index=True
     )
     name: Mapped[str] = mapped_column(String(50), unique=True)
     password: Mapped[str] = mapped_column(String(1024))
     is_banned: Mapped[bool] = mapped_column(Boolean, server_default=text("false"))
     is_admin: Mapped[bool] = mapped_column(Boolean, server_default=text("false"))
     is_deleted: Mapped[bool] = mapped_column(Boolean, server_default=text("false"))
+    # 软删除的时间，过了保留期由后台任务彻底删除；老数据迁移时按迁移时间算
+    deleted_at: Mapped[Optional[datetime]] = mapped_column(DateTime, nullable=True)
     conversations: Mapped[List["Conversation"]] = relationship(
         back_populates="owner", cascade="all, delete-orphan"
     )
@@ -27,19 +46,44 @@ class User(Base):
 
 class Conversation(Base):
     __tablename__ = "conversations"
-    __table_args__ = {"mysql_charset": "utf8mb4", "mysql_collate": "utf8mb4_unicode_ci"}
+    __table_args__ = (
+        Index("ix_conversations_user_id_id", "user_id", "id"),
+        # 用户的对话列表按最近活跃倒序，(updated_at, id) 游标分页走这个索引
+        Index("ix_conversations_user_id_updated_at_id", "user_id", "updated_at", "id"),
+        # 后台归档任务按 (archived, updated_at) 找长时间没动的对话
+        Index("ix_conversations_archived_updated_at", "archived", "updated_at"),
+        {"mysql_charset": "utf8mb4", "mysql_collate": "utf8mb4_unicode_ci"},
+    )
 
     id: Mapped[int] = mapped_column(
-        BigInteger, primary_key=True, autoincrement=True, index=True
+        Id, primary_key=True, autoincrement=True, index=True
     )
-    user_id: Mapped[int] = mapped_column(BigInteger, ForeignKey("users.user_id"))
+    user_id: Mapped[int] = mapped_column(Id, ForeignKey("users.user_id"))
     owner: Mapped["User"] = relationship(
         back_populates="conversations"  # 指向对方模型里的属性名
     )
     chat: Mapped[List["Chat"]] = relationship(
         back_populates="owner", cascade="all,delete-orphan"
     )
+    summary: Mapped[Optional["ConversationSummary"]] = relationship(
+        back_populates="owner", cascade="all,delete-orphan"
+    )
     title: Mapped[str] = mapped_column(String(50), default="新对话")
+    # 老数据由 migrate_db 按标题前缀回填；角色被删后置空
+    character_id: Mapped[Optional[int]] = mapped_column(
+        Id, ForeignKey("character.id", ondelete="SET NULL"), nullable=True
+    )
+    # 对话列表要显示的冗余字段，和写入/删除 chats 在同一个事务里维护，列表不用再查 chats
+    message_count: Mapped[int] = mapped_column(Integer, server_default=text("0"))
+    last_message_preview: Mapped[Optional[str]] = mapped_column(
+        String(100), nullable=True
+    )
+    last_role: Mapped[Optional[str]] = mapped_column(String(50), nullable=True)
+    # 为 True 时聊天记录已经移到 chats_archive，再打开对话时搬回 chats
+    archived: Mapped[bool] = mapped_column(Boolean, server_default=text("false"))
+    # 最近一次从归档搬回的时间；只看不聊时 updated_at 不变，归档任务靠它避免马上又搬回去
+    rehydrated_at: Mapped[Optional[datetime]] = mapped_column(DateTime, nullable=True)
+    # 最后一条消息的时间（没有消息时是创建时间）
     updated_at: Mapped[datetime] = mapped_column(
         default=func.now(), onupdate=func.now()
     )
@@ -47,16 +91,66 @@ class Conversation(Base):
 
 class Chat(Base):
     __tablename__ = "chats"
-    __table_args__ = {"mysql_charset": "utf8mb4", "mysql_collate": "utf8mb4_unicode_ci"}
-    id: Mapped[int] = mapped_column(BigInteger, primary_key=True, autoincrement=True)
+    __table_args__ = (
+        # 聊天记录按 (create_at, id) 游标分页、按 token 预算往回取都走这个索引
+        Index("ix_chats_chat_id_create_at_id", "chat_id", "create_at", "id"),
+        # 归档的消息沿用原来的 id；SQLite 不加 AUTOINCREMENT 时按表里剩下的最大 id 续号，
+        # 会和归档里的 id 重复（MySQL 8 的自增计数器是持久化的，没有这个问题）
+        {
+            "mysql_charset": "utf8mb4",
+            "mysql_collate": "utf8mb4_unicode_ci",
+            "sqlite_autoincrement": True,
+        },
+    )
+    id: Mapped[int] = mapped_column(Id, primary_key=True, autoincrement=True)
     chat_id: Mapped[int] = mapped_column(
-        BigInteger, ForeignKey("conversations.id"), index=True
+        Id, ForeignKey("conversations.id"), index=True
     )
     owner: Mapped["Conversation"] = relationship(back_populates="chat")
     role: Mapped[str] = mapped_column(String(50))
     content: Mapped[str] = mapped_column(Text)
     create_at: Mapped[datetime] = mapped_column(
-        DATETIME(fsp=6), server_default=func.now()
+        PreciseDateTime, server_default=func.now()
+    )
+    # 写入时算好的 token 数，拼上下文时直接用，老数据为空时现算
+    token_count: Mapped[Optional[int]] = mapped_column(Integer, nullable=True)
+    # 客户端中途断开、按 truncated 策略保存下来的不完整回复
+    truncated: Mapped[bool] = mapped_column(Boolean, server_default=text("false"))
+
+
+class ArchivedChat(Base):
+    # 长时间没动的对话的聊天记录，字段和 chats 一样，id 沿用 chats 里的，搬回去时原样插回
+    __tablename__ = "chats_archive"
+    __table_args__ = (
+        Index("ix_chats_archive_chat_id_id", "chat_id", "id"),
+        {"mysql_charset": "utf8mb4", "mysql_collate": "utf8mb4_unicode_ci"},
+    )
+    id: Mapped[int] = mapped_column(Id, primary_key=True, autoincrement=False)
+    chat_id: Mapped[int] = mapped_column(Id, ForeignKey("conversations.id"))
+    role: Mapped[str] = mapped_column(String(50))
+    content: Mapped[str] = mapped_column(Text)
+    create_at: Mapped[datetime] = mapped_column(PreciseDateTime)
+    token_count: Mapped[Optional[int]] = mapped_column(Integer, nullable=True)
+    truncated: Mapped[bool] = mapped_column(Boolean, server_default=text("false"))
+    archived_at: Mapped[datetime] = mapped_column(
+        PreciseDateTime, server_default=func.now()
+    )
+
+
+class ConversationSummary(Base):
+    # 长对话滚动压缩后的摘要，covered_until_id 及之前的消息都已折叠进 content
+    __tablename__ = "conversation_summaries"
+    __table_args__ = {"mysql_charset": "utf8mb4", "mysql_collate": "utf8mb4_unicode_ci"}
+    id: Mapped[int] = mapped_column(Id, primary_key=True, autoincrement=True)
+    chat_id: Mapped[int] = mapped_column(
+        Id, ForeignKey("conversations.id"), unique=True
+    )
+    owner: Mapped["Conversation"] = relationship(back_populates="summary")
+    content: Mapped[str] = mapped_column(Text)
+    covered_until_id: Mapped[int] = mapped_column(BigInteger)
+    token_count: Mapped[int] = mapped_column(Integer, server_default=text("0"))
+    updated_at: Mapped[datetime] = mapped_column(
+        default=func.now(), onupdate=func.now()
     )
 
 
@@ -64,16 +158,26 @@ class Character(Base):
     __tablename__ = "character"
     __table_args__ = {"mysql_charset": "utf8mb4", "mysql_collate": "utf8mb4_unicode_ci"}
     id: Mapped[int] = mapped_column(
-        BigInteger, primary_key=True, autoincrement=True, index=True
+        Id, primary_key=True, autoincrement=True, index=True
     )
     name: Mapped[str] = mapped_column(String(50), unique=True)
     system_prompt: Mapped[str] = mapped_column(Text)
+    # 为 True 时相同的请求直接回放缓存的回复
+    cacheable: Mapped[bool] = mapped_column(Boolean, server_default=text("false"))
 
 
 class NotAllowedWord(Base):
     __tablename__ = "not_allowed_words"
     __table_args__ = {"mysql_charset": "utf8mb4", "mysql_collate": "utf8mb4_unicode_ci"}
     id: Mapped[int] = mapped_column(
-        BigInteger, primary_key=True, autoincrement=True, index=True
+        Id, primary_key=True, autoincrement=True, index=True
     )
     word: Mapped[str] = mapped_column(String(50), unique=True)
+
+
+class MigrationMarker(Base):
+    # migrate_db 里一次性的回填跑完之后记一行，和回填在同一个事务里提交
+    __tablename__ = "migration_markers"
+    __table_args__ = {"mysql_charset": "utf8mb4", "mysql_collate": "utf8mb4_unicode_ci"}
+    name: Mapped[str] = mapped_column(String(100), primary_key=True)
+    done_at: Mapped[datetime] = mapped_column(DateTime, server_default=func.now())
@@ -0,0 +1,161 @@
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import time
+
+import redis
+from dotenv import load_dotenv
+from fastapi.encoders import jsonable_encoder
+
+from .redis_client import get_redis, get_async_redis
+from .engine_creating import AsyncSessionLocal
+from monitoring.metrics import ENDPOINT_CACHE_REQUESTS
+
+load_dotenv()
+Logger = logging.getLogger(__name__)
+
+ENDPOINT_CACHE_KEY = "endpoint_cache:{}:{}"
+# 每个标签一个版本号，写操作提交后递增；缓存条目记着生成时各标签的版本，对不上就当没命中
+ENDPOINT_TAG_KEY = "endpoint_cache:tag:{}"
+CACHE_STATUS_HEADER = "X-Cache-Status"
+endpoint_cache_enabled = os.environ.get("ENDPOINT_CACHE_ENABLED", "true").lower() == "true"
+# 过期之后还能先返回旧值、后台刷新的时间窗口（秒）
+endpoint_cache_stale_ttl = int(os.environ.get("ENDPOINT_CACHE_STALE_TTL", "60"))
+# 标签版本号的过期时间，要比任何条目的 ttl + stale_ttl 都长
+TAG_TTL = 86400
+
+CHARACTERS_TAG = "characters"
+
+
+def user_conversations_tag(user_id) -> str:
+    return f"user:{user_id}:conversations"
+
+
+def chat_tag(chat_id) -> str:
+    return f"chat:{chat_id}"
+
+
+class EndpointCache:
+    """
+    接口响应缓存：键由调用方显式给出（用户 id、对话 id、分页参数），不依赖请求对象；
+    写操作按标签失效，过期不久的条目先返回旧值再后台刷新（stale-while-revalidate）
+    Redis 出错时直接回源
+    """
+
+    def __init__(self, enabled: bool, stale_ttl: int):
+        self.enabled = enabled
+        self.stale_ttl = stale_ttl
+        # 本 worker 正在刷新的键，同一个键只起一个刷新任务
+        self._refreshing = set()
+        self._tasks = set()
+
+    def _key(self, endpoint: str, key_parts) -> str:
+        raw = json.dumps(key_parts, ensure_ascii=False, separators=(",", ":"), default=str)
+        return ENDPOINT_CACHE_KEY.format(endpoint, hashlib.sha256(raw.encode()).hexdigest())
+
+    def _record(self, endpoint: str, result: str, response):
+        ENDPOINT_CACHE_REQUESTS.labels(endpoint, result).inc()
+        if response is not None:
+            response.headers[CACHE_STATUS_HEADER] = result.upper()
+
+    async def fetch(self, endpoint: str, key_parts, tags: list[str], ttl: int, compute, db, response=None):
+        """
+        compute(db) 回源，返回值会转成 JSON 能表示的形式再缓存，命中和未命中返回的结构一样
+        """
+        if not self.enabled:
+            return jsonable_encoder(await compute(db))
+        key = self._key(endpoint, key_parts)
+        tag_keys = [ENDPOINT_TAG_KEY.format(tag) for tag in tags]
+        try:
+            async with get_async_redis().pipeline(transaction=False) as pipe:
+                pipe.get(key)
+                pipe.mget(tag_keys)
+                raw, versions = await pipe.execute()
+        except redis.RedisError as e:
+            Logger.error(f"Read endpoint cache {endpoint} failed: {e}")
+            self._record(endpoint, "error", response)
+            return jsonable_encoder(await compute(db))
+        versions = [version or "0" for version in versions]
+        if raw is not None:
+            entry = json.loads(raw)
+            if entry["versions"] == versions:
+                if entry["expires_at"] > time.time():
+                    self._record(endpoint, "hit", response)
+                else:
+                    self._record(endpoint, "stale", response)
+                    self._revalidate(key, tag_keys, ttl, compute)
+                return entry["data"]
+        # 用回源之前读到的版本号，回源期间有写入的话这条缓存下次读就对不上
+        data = jsonable_encoder(await compute(db))
+        await self._store(key, versions, data, ttl)
+        self._record(endpoint, "miss", response)
+        return data
+
+    async def _store(self, key: str, versions: list, data, ttl: int):
+        entry = {"versions": versions, "expires_at": time.time() + ttl, "data": data}
+        try:
+            await get_async_redis().set(
+                key,
+                json.dumps(entry, ensure_ascii=False, separators=(",", ":")),
+                ex=ttl + self.stale_ttl,
+            )
+        except redis.RedisError as e:
+            Logger.error(f"Write endpoint cache {key} failed: {e}")
+
+    def _revalidate(self, key: str, tag_keys: list, ttl: int, compute):
+        if key in self._refreshing:
+            return
+        self._refreshing.add(key)
+        task = asyncio.create_task(self._refresh(key, tag_keys, ttl, compute))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _refresh(self, key: str, tag_keys: list, ttl: int, compute):
+        # 请求的数据库会话在响应之后就关了，刷新用自己的会话；各 worker 之间用锁只刷一次
+        try:
+            client = get_async_redis()
+            if not await client.set(f"{key}:refresh", 1, nx=True, ex=max(ttl, 5)):
+                return
+            versions = [version or "0" for version in await client.mget(tag_keys)]
+            async with AsyncSessionLocal() as db:
+                data = jsonable_encoder(await compute(db))
+            await self._store(key, versions, data, ttl)
+            await client.delete(f"{key}:refresh")
+        except Exception as e:
+            Logger.error(f"Refresh endpoint cache {key} failed: {e}")
+        finally:
+            self._refreshing.discard(key)
+
+    def invalidate(self, *tags: str):
+        """
+        在写操作提交之后调用，递增这些标签的版本号
+        """
+        if not self.enabled or not tags:
+            return
+        try:
+            with get_redis().pipeline(transaction=False) as pipe:
+                for tag in tags:
+                    tag_key = ENDPOINT_TAG_KEY.format(tag)
+                    pipe.incr(tag_key)
+                    pipe.expire(tag_key, TAG_TTL)
+                pipe.execute()
+        except redis.RedisError as e:
+            Logger.error(f"Invalidate endpoint cache {tags} failed: {e}")
+
+    async def invalidate_async(self, *tags: str):
+        if not self.enabled or not tags:
+            return
+        try:
+            async with get_async_redis().pipeline(transaction=False) as pipe:
+                for tag in tags:
+                    tag_key = ENDPOINT_TAG_KEY.format(tag)
+                    pipe.incr(tag_key)
+                    pipe.expire(tag_key, TAG_TTL)
+                await pipe.execute()
+        except redis.RedisError as e:
+            Logger.error(f"Invalidate endpoint cache {tags} failed: {e}")
+
+
+endpoint_cache = EndpointCache(endpoint_cache_enabled, endpoint_cache_stale_ttl)
@@ -1,5 +1,6 @@
 from sqlalchemy import create_engine
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker, AsyncSession
 from dotenv import load_dotenv
 import os
 
@@ -9,6 +10,32 @@ db_password = os.environ.get("DATABASE_PASSWORD")
 db_host = os.environ.get("DATABASE_HOST")
 db_port = os.environ.get("DATABASE_PORT")
 db_name = os.environ.get("DATABASE_NAME")
-db_url = f"mysql+pymysql://{db_user}:{db_password}@{db_host}:{db_port}/{db_name}?charset=utf8mb4"
+# 设置了 DATABASE_URL 就直接用（比如 sqlite:///bench.db），否则按上面的参数拼 MySQL
+db_url = os.environ.get("DATABASE_URL") or (
+    f"mysql+pymysql://{db_user}:{db_password}@{db_host}:{db_port}/{db_name}?charset=utf8mb4"
+)
+# 同步和异步驱动的对应关系，只配 DATABASE_URL 时据此推出异步 URL
+ASYNC_DRIVERS = {
+    "mysql+pymysql": "mysql+aiomysql",
+    "mysql": "mysql+aiomysql",
+    "sqlite": "sqlite+aiosqlite",
+    "sqlite+pysqlite": "sqlite+aiosqlite",
+    "postgresql": "postgresql+asyncpg",
+    "postgresql+psycopg2": "postgresql+asyncpg",
+}
+
+
+def to_async_url(url: str) -> str:
+    driver, sep, rest = url.partition("://")
+    return f"{ASYNC_DRIVERS.get(driver, driver)}{sep}{rest}"
+
+
 engine = create_engine(db_url, echo=False, pool_pre_ping=True)
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+# 异步引擎，给聊天这类热路径用，管理员接口暂时还走上面的同步引擎
+async_db_url = os.environ.get("ASYNC_DATABASE_URL") or to_async_url(db_url)
+async_engine = create_async_engine(async_db_url, echo=False, pool_pre_ping=True)
+AsyncSessionLocal = async_sessionmaker(
+    bind=async_engine, class_=AsyncSession, autoflush=False, expire_on_commit=False
+)
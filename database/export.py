@@ -0,0 +1,88 @@
+import json
+import os
+
+from dotenv import load_dotenv
+from sqlalchemy import select, tuple_
+
+from .database_structure import Chat, ArchivedChat, Conversation
+from .engine_creating import AsyncSessionLocal
+from .pagination import decode_cursor, encode_cursor, InvalidCursor
+
+load_dotenv()
+# 服务端游标每次从数据库取多少行，也是每次写进响应的行数；导出占用的内存只和它有关
+export_batch_size = int(os.environ.get("EXPORT_BATCH_SIZE", "1000"))
+EXPORT_MEDIA_TYPE = "application/x-ndjson"
+# 让 nginx 直接转发，不在代理上缓冲整个导出文件
+EXPORT_HEADERS = {
+    "Content-Disposition": 'attachment; filename="chats.ndjson"',
+    "X-Accel-Buffering": "no",
+}
+
+# 先导出 chats，再导出 chats_archive；游标的第一个值是表的序号
+EXPORT_TIERS = (Chat, ArchivedChat)
+
+
+class ChatExport:
+    """
+    聊天记录导出成 NDJSON，一行一条消息，每行带着续传用的 cursor
+    全表导出按主键顺序扫；限定了用户或对话时按 (chat_id, id) 排序，走 chat_id 上的索引，
+    同一个对话的消息挨在一起；已归档的对话在 chats 之后从 chats_archive 里导出
+    """
+
+    def __init__(self, user_id: int | None = None, chat_id: int | None = None, cursor: str | None = None):
+        scoped = user_id is not None or chat_id is not None
+        self.key_names = ("chat_id", "id") if scoped else ("id",)
+        start_tier, values = 0, None
+        if cursor:
+            # 在开始返回之前解析，游标不对时还能正常返回 400；表的序号和主键一样是整数
+            start_tier, *values = decode_cursor(cursor, [Chat.id, *self.key_columns(Chat)])
+            if start_tier not in range(len(EXPORT_TIERS)):
+                raise InvalidCursor("invalid cursor")
+        self.statements = []
+        for tier, model in enumerate(EXPORT_TIERS):
+            if tier < start_tier:
+                continue
+            key_columns = self.key_columns(model)
+            stmt = select(
+                model.id,
+                model.chat_id,
+                Conversation.user_id,
+                model.role,
+                model.content,
+                model.create_at,
+                model.truncated,
+            ).join(Conversation, Conversation.id == model.chat_id)
+            if user_id is not None:
+                stmt = stmt.where(Conversation.user_id == user_id)
+            if chat_id is not None:
+                stmt = stmt.where(model.chat_id == chat_id)
+            if tier == start_tier and values:
+                stmt = stmt.where(tuple_(*key_columns) > tuple(values))
+            self.statements.append((tier, stmt.order_by(*key_columns)))
+
+    def key_columns(self, model) -> list:
+        return [getattr(model, name) for name in self.key_names]
+
+    def encode(self, tier: int, row) -> str:
+        line = {
+            "id": row.id,
+            "chat_id": row.chat_id,
+            "user_id": row.user_id,
+            "role": row.role,
+            "content": row.content,
+            "time": row.create_at.isoformat(),
+            "truncated": bool(row.truncated),
+            "cursor": encode_cursor([tier, *(getattr(row, name) for name in self.key_names)]),
+        }
+        return json.dumps(line, ensure_ascii=False, separators=(",", ":"))
+
+    async def stream(self, session_factory=None, batch_size: int = export_batch_size):
+        """
+        用自己的会话开服务端游标（yield_per），每批行拼成一块返回；
+        请求的会话在开始返回响应之后就可能关了，不能拿来用
+        """
+        async with (session_factory or AsyncSessionLocal)() as db:
+            for tier, stmt in self.statements:
+                result = await db.stream(stmt.execution_options(yield_per=batch_size))
+                async for rows in result.partitions():
+                    yield "".join(f"{self.encode(tier, row)}\n" for row in rows).encode()
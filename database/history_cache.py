@@ -0,0 +1,237 @@
+import json
+import logging
+import os
+from typing import NamedTuple
+
+import redis
+from dotenv import load_dotenv
+
+from .redis_client import get_redis, get_async_redis
+
+load_dotenv()
+Logger = logging.getLogger(__name__)
+
+HISTORY_CACHE_KEY = "chat_history:{}"
+# 每次写入都递增，回源填充时版本变了就放弃，避免把旧数据写回去
+HISTORY_VERSION_KEY = "chat_history:{}:version"
+# 列表头部的哨兵，表示缓存里是从对话第一条开始的完整记录
+HISTORY_START = "start"
+history_cache_size = int(os.environ.get("HISTORY_CACHE_SIZE", "200"))
+history_cache_ttl = int(os.environ.get("HISTORY_CACHE_TTL", "3600"))
+
+# ARGV: 弹出条数, 上限, TTL, 追加的消息...
+# 缓存不存在时只递增版本号，冷对话等下次读的时候再回源
+_APPEND_SCRIPT = """
+redis.call('INCR', KEYS[2])
+redis.call('EXPIRE', KEYS[2], ARGV[3])
+if redis.call('EXISTS', KEYS[1]) == 0 then
+    return 0
+end
+for i = 1, tonumber(ARGV[1]) do
+    local value = redis.call('RPOP', KEYS[1])
+    if not value then
+        break
+    end
+    if value == 'start' then
+        redis.call('RPUSH', KEYS[1], value)
+        break
+    end
+end
+if #ARGV > 3 then
+    redis.call('RPUSH', KEYS[1], unpack(ARGV, 4))
+end
+redis.call('LTRIM', KEYS[1], -tonumber(ARGV[2]), -1)
+redis.call('EXPIRE', KEYS[1], ARGV[3])
+return 1
+"""
+
+# ARGV: 回源前读到的版本号, TTL, 消息...
+_POPULATE_SCRIPT = """
+if (redis.call('GET', KEYS[2]) or '0') ~= ARGV[1] then
+    return 0
+end
+redis.call('DEL', KEYS[1])
+redis.call('RPUSH', KEYS[1], unpack(ARGV, 3))
+redis.call('EXPIRE', KEYS[1], ARGV[2])
+return 1
+"""
+
+
+class CachedMessage(NamedTuple):
+    id: int
+    role: str
+    content: str
+    token_count: int | None
+
+
+def encode_message(message_id, role, content, token_count) -> str:
+    return json.dumps(
+        [message_id, role, content, token_count],
+        ensure_ascii=False,
+        separators=(",", ":"),
+    )
+
+
+def message_from_row(row) -> str:
+    return encode_message(row.id, row.role, row.content, row.token_count)
+
+
+class HistoryCache:
+    """
+    每个对话最近 N 条消息在 Redis 里的副本（从旧到新的 list）
+    写库提交之后再改缓存；Redis 出错一律当没命中，回到 MySQL
+    """
+
+    def __init__(self, size: int, ttl: int):
+        self.size = size
+        self.ttl = ttl
+        self._scripts = {}
+
+    @property
+    def enabled(self) -> bool:
+        # HISTORY_CACHE_SIZE=0 关掉缓存，所有读写直接走数据库（基准测试用）
+        return self.size > 0
+
+    def _script(self, client, source: str):
+        script = self._scripts.get((id(client), source))
+        if script is None:
+            script = client.register_script(source)
+            self._scripts[(id(client), source)] = script
+        return script
+
+    def _keys(self, chat_id: int) -> list:
+        return [HISTORY_CACHE_KEY.format(chat_id), HISTORY_VERSION_KEY.format(chat_id)]
+
+    def _decode(self, values) -> tuple[list, bool] | None:
+        if not values:
+            return None
+        complete = values[0] == HISTORY_START
+        if complete:
+            values = values[1:]
+        return [CachedMessage(*json.loads(value)) for value in values], complete
+
+    def _populate_args(self, version, rows, complete: bool) -> list:
+        values = [HISTORY_START] if complete else []
+        values.extend(message_from_row(row) for row in rows)
+        return [version or "0", self.ttl, *values]
+
+    def get(self, chat_id: int):
+        """
+        返回 (从旧到新的消息列表, 是否完整) 或 None
+        """
+        if not self.enabled:
+            return None
+        try:
+            return self._decode(get_redis().lrange(HISTORY_CACHE_KEY.format(chat_id), 0, -1))
+        except redis.RedisError:
+            return None
+
+    async def get_async(self, chat_id: int):
+        if not self.enabled:
+            return None
+        try:
+            values = await get_async_redis().lrange(
+                HISTORY_CACHE_KEY.format(chat_id), 0, -1
+            )
+        except redis.RedisError:
+            return None
+        return self._decode(values)
+
+    def get_version(self, chat_id: int) -> str | None:
+        try:
+            return get_redis().get(HISTORY_VERSION_KEY.format(chat_id))
+        except redis.RedisError:
+            return None
+
+    async def get_version_async(self, chat_id: int) -> str | None:
+        try:
+            return await get_async_redis().get(HISTORY_VERSION_KEY.format(chat_id))
+        except redis.RedisError:
+            return None
+
+    def populate(self, chat_id: int, version, rows, complete: bool):
+        """
+        rows 从旧到新；期间有别的写入（版本号变了）就不写
+        """
+        if not self.enabled or (not rows and not complete):
+            return
+        client = get_redis()
+        try:
+            self._script(client, _POPULATE_SCRIPT)(
+                keys=self._keys(chat_id),
+                args=self._populate_args(version, rows, complete),
+            )
+        except redis.RedisError as e:
+            Logger.error(f"Populate history cache {chat_id} failed: {e}")
+
+    async def populate_async(self, chat_id: int, version, rows, complete: bool):
+        if not self.enabled or (not rows and not complete):
+            return
+        client = get_async_redis()
+        try:
+            await self._script(client, _POPULATE_SCRIPT)(
+                keys=self._keys(chat_id),
+                args=self._populate_args(version, rows, complete),
+            )
+        except redis.RedisError as e:
+            Logger.error(f"Populate history cache {chat_id} failed: {e}")
+
+    def append(self, chat_id: int, messages: list[str], pop: int = 0):
+        """
+        先从末尾弹出 pop 条（重新生成、撤回），再追加 messages
+        """
+        if not self.enabled:
+            return
+        client = get_redis()
+        try:
+            self._script(client, _APPEND_SCRIPT)(
+                keys=self._keys(chat_id),
+                args=[pop, self.size, self.ttl, *messages],
+            )
+        except redis.RedisError as e:
+            Logger.error(f"Update history cache {chat_id} failed: {e}")
+            self.drop(chat_id)
+
+    async def append_async(self, chat_id: int, messages: list[str], pop: int = 0):
+        if not self.enabled:
+            return
+        client = get_async_redis()
+        try:
+            await self._script(client, _APPEND_SCRIPT)(
+                keys=self._keys(chat_id),
+                args=[pop, self.size, self.ttl, *messages],
+            )
+        except redis.RedisError as e:
+            Logger.error(f"Update history cache {chat_id} failed: {e}")
+            await self.drop_async(chat_id)
+
+    def drop(self, *chat_ids: int):
+        if not self.enabled or not chat_ids:
+            return
+        try:
+            with get_redis().pipeline(transaction=False) as pipe:
+                for chat_id in chat_ids:
+                    cache_key, version_key = self._keys(chat_id)
+                    pipe.delete(cache_key)
+                    pipe.incr(version_key)
+                    pipe.expire(version_key, self.ttl)
+                pipe.execute()
+        except redis.RedisError as e:
+            Logger.error(f"Drop history cache {chat_ids} failed: {e}")
+
+    async def drop_async(self, *chat_ids: int):
+        if not self.enabled or not chat_ids:
+            return
+        try:
+            async with get_async_redis().pipeline(transaction=False) as pipe:
+                for chat_id in chat_ids:
+                    cache_key, version_key = self._keys(chat_id)
+                    pipe.delete(cache_key)
+                    pipe.incr(version_key)
+                    pipe.expire(version_key, self.ttl)
+                await pipe.execute()
+        except redis.RedisError as e:
+            Logger.error(f"Drop history cache {chat_ids} failed: {e}")
+
+
+history_cache = HistoryCache(history_cache_size, history_cache_ttl)
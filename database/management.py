@@ -2,10 +2,297 @@ from typing import Any
 import time
 
 from sqlalchemy.orm import Session, load_only
-from sqlalchemy import select, insert, delete
+from sqlalchemy import select, insert, delete, update, func, tuple_, and_
+from sqlalchemy.dialects.mysql import insert as mysql_insert
+from sqlalchemy.dialects.postgresql import insert as postgresql_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
 from sqlalchemy.orm.attributes import flag_modified
 
-from .database_structure import User, Conversation, Character, Chat, NotAllowedWord
+from .database_structure import (
+    User,
+    Conversation,
+    Character,
+    Chat,
+    NotAllowedWord,
+    ConversationSummary,
+    ArchivedChat,
+)
+from .redis_client import bump_version
+from .pagination import paginate
+from .user_state_cache import user_state_cache
+from .history_cache import history_cache, encode_message
+from .character_registry import character_registry
+from .endpoint_cache import (
+    endpoint_cache,
+    chat_tag,
+    user_conversations_tag,
+    CHARACTERS_TAG,
+)
+from model.tokenizer import count_tokens, count_message_tokens, get_history_token_budget
+
+# 违禁词版本号，增删改后递增，各 worker 据此重建编译好的匹配器
+NOT_ALLOWED_WORDS_VERSION_KEY = "not_allowed_words:version"
+
+
+class NotAllowedWordsUnavailable(Exception):
+    pass
+
+
+def begin_not_allowed_words_change():
+    # 写库之前先确认版本号能递增：Redis 不可用时不写，否则其它 worker 永远看不到这次修改
+    if bump_version(NOT_ALLOWED_WORDS_VERSION_KEY) is None:
+        raise NotAllowedWordsUnavailable("not allowed words version unavailable")
+
+
+def finish_not_allowed_words_change():
+    # 提交之后再递增一次，提交前按旧数据重建过的 worker 会再建一次；这一次失败的话由本进程补上
+    bump_version(NOT_ALLOWED_WORDS_VERSION_KEY, retry=True)
+
+
+# 按 token 预算拼历史记录时，每次从库里往回取多少条
+HISTORY_BATCH_SIZE = 50
+# 对话列表里最后一条消息的预览截取多少个字符，和 Conversation.last_message_preview 的长度一致
+PREVIEW_LENGTH = 100
+# 批量导入违禁词时每多少个词一条 INSERT
+IMPORT_BATCH_SIZE = 1000
+# 批量处置用户：动作 -> (能处置的用户满足的条件, 要改的字段)，和单个处置的方法判断一致
+BULK_USER_ACTIONS = {
+    "ban": (
+        and_(User.is_deleted == False, User.is_banned == False, User.is_admin == False),
+        {"is_banned": True},
+    ),
+    "unban": (and_(User.is_deleted == False, User.is_banned == True), {"is_banned": False}),
+    "soft_delete": (
+        and_(User.is_deleted == False, User.is_admin == False),
+        {"is_deleted": True, "deleted_at": func.now()},
+    ),
+    "undo_soft_delete": (User.is_deleted == True, {"is_deleted": False, "deleted_at": None}),
+}
+# 用户对话列表返回的字段，都在 conversations 一张表里，按最近活跃倒序
+CONVERSATION_LIST_COLUMNS = (
+    Conversation.id,
+    Conversation.title,
+    Conversation.message_count,
+    Conversation.last_message_preview,
+    Conversation.last_role,
+    Conversation.updated_at,
+)
+
+
+def history_batch_query(
+    chat_id: int,
+    before=None,
+    after_id: int | None = None,
+    limit: int = HISTORY_BATCH_SIZE,
+):
+    stmt = (
+        select(Chat.id, Chat.role, Chat.content, Chat.token_count, Chat.create_at)
+        .where(Chat.chat_id == chat_id)
+        .order_by(Chat.create_at.desc(), Chat.id.desc())
+        .limit(limit)
+    )
+    if before is not None:
+        stmt = stmt.where(tuple_(Chat.create_at, Chat.id) < before)
+    if after_id is not None:
+        # 已经折叠进摘要的消息不再取
+        stmt = stmt.where(Chat.id > after_id)
+    return stmt
+
+
+def fill_history_within_budget(rows, history_chat: list, used_tokens: int, token_budget: int):
+    """
+    rows 按从新到旧排列，预算用完返回 (已用 token, True)
+    """
+    for row in rows:
+        tokens = count_message_tokens(row.content, row.token_count)
+        if used_tokens + tokens > token_budget:
+            return used_tokens, True
+        used_tokens += tokens
+        history_chat.append({"role": row.role, "content": row.content})
+    return used_tokens, False
+
+
+def history_from_cache(cached, token_budget: int, after_id: int | None = None):
+    """
+    cached 是 (从旧到新的消息, 是否完整)；缓存里的消息不够拼满预算时返回 None
+    """
+    messages, complete = cached
+    history_chat = []
+    rows = [m for m in reversed(messages) if after_id is None or m.id > after_id]
+    _, exhausted = fill_history_within_budget(rows, history_chat, 0, token_budget)
+    # 缓存已经覆盖到摘要的边界，说明摘要之后的消息都在缓存里
+    covered = after_id is not None and bool(messages) and messages[0].id <= after_id
+    if not (exhausted or complete or covered):
+        return None
+    history_chat.reverse()
+    return history_chat
+
+
+def latest_turn_query(chat_id: int):
+    return (
+        select(Chat.id, Chat.role)
+        .where(Chat.chat_id == chat_id)
+        .order_by(Chat.create_at.desc(), Chat.id.desc())
+        .limit(2)
+    )
+
+
+def cached_turn(rows, turn: list[dict]) -> list[str] | None:
+    """
+    rows 是刚写入后最新的两条 (id, role)，和这一轮对不上（同一对话并发写入）返回 None
+    """
+    if [row.role for row in rows] != ["assistant", "user"]:
+        return None
+    ids = [rows[1].id, rows[0].id]
+    return [
+        encode_message(message_id, row["role"], row["content"], row["token_count"])
+        for message_id, row in zip(ids, turn)
+    ]
+
+
+def turn_rows(
+    chat_id: int, user_content: str, assistant_content: str, truncated: bool = False
+) -> list[dict]:
+    return [
+        {
+            "chat_id": chat_id,
+            "role": role,
+            "content": content,
+            "token_count": count_tokens(content),
+            "truncated": role == "assistant" and truncated,
+        }
+        for role, content in (("user", user_content), ("assistant", assistant_content))
+    ]
+
+
+def bulk_user_outcome(action: str, user) -> str:
+    """
+    批量处置里单个用户的结果：ok 会被修改，not_found 不存在，admin 是管理员，
+    deleted 已被软删除（封禁/解封不处理），unchanged 本来就是目标状态
+    """
+    if user is None:
+        return "not_found"
+    if action in ("ban", "soft_delete") and user.is_admin:
+        return "admin"
+    if action in ("ban", "unban") and user.is_deleted:
+        return "deleted"
+    unchanged = {
+        "ban": user.is_banned,
+        "unban": not user.is_banned,
+        "soft_delete": user.is_deleted,
+        "undo_soft_delete": not user.is_deleted,
+    }[action]
+    return "unchanged" if unchanged else "ok"
+
+
+def insert_ignore(model, dialect_name: str):
+    """
+    唯一键冲突时跳过的 INSERT，各数据库写法不一样
+    """
+    if dialect_name == "mysql":
+        return mysql_insert(model).prefix_with("IGNORE")
+    if dialect_name == "sqlite":
+        return sqlite_insert(model).on_conflict_do_nothing()
+    if dialect_name == "postgresql":
+        return postgresql_insert(model).on_conflict_do_nothing()
+    raise NotImplementedError(f"insert_ignore does not support {dialect_name}")
+
+
+# chats 和 chats_archive 之间来回搬的字段
+ARCHIVE_COLUMNS = ("id", "chat_id", "role", "content", "create_at", "token_count", "truncated")
+
+
+def move_chats_query(source, target, condition):
+    """
+    INSERT INTO target SELECT ... FROM source WHERE condition，用在归档和搬回
+    """
+    return insert(target).from_select(
+        list(ARCHIVE_COLUMNS),
+        select(*(getattr(source, name) for name in ARCHIVE_COLUMNS)).where(condition),
+    )
+
+
+def lock_conversation_query(chat_id: int):
+    # 归档和搬回都先锁住对话这一行再动聊天记录，两边不会同时搬同一个对话
+    return (
+        select(Conversation.archived)
+        .where(Conversation.id == chat_id)
+        .with_for_update()
+    )
+
+
+def set_archived_query(chat_id: int, archived: bool, *conditions):
+    # 显式写回 updated_at，否则 onupdate 会把它改成现在，对话列表的顺序就乱了
+    return (
+        update(Conversation)
+        .where(Conversation.id == chat_id, *conditions)
+        .values(archived=archived, updated_at=Conversation.updated_at)
+    )
+
+
+def rehydrate_queries(chat_id: int) -> list:
+    return [
+        move_chats_query(ArchivedChat, Chat, ArchivedChat.chat_id == chat_id),
+        delete(ArchivedChat).where(ArchivedChat.chat_id == chat_id),
+        set_archived_query(chat_id, False).values(rehydrated_at=func.now()),
+    ]
+
+
+def append_stats_query(chat_id: int, role: str, content: str, added: int, removed: int = 0):
+    """
+    追加消息时增量更新对话列表的冗余字段，和插入 chats 放在同一个事务里
+    """
+    return (
+        update(Conversation)
+        .where(Conversation.id == chat_id)
+        .values(
+            message_count=Conversation.message_count + (added - removed),
+            last_message_preview=content[:PREVIEW_LENGTH],
+            last_role=role,
+            updated_at=func.now(),
+        )
+    )
+
+
+def conversation_stats_values() -> dict:
+    """
+    从 chats 重新算对话列表的冗余字段（删消息之后、迁移回填时用），按 Conversation.id 关联
+    """
+
+    def latest(column):
+        return (
+            select(column)
+            .where(Chat.chat_id == Conversation.id)
+            .order_by(Chat.create_at.desc(), Chat.id.desc())
+            .limit(1)
+            .scalar_subquery()
+        )
+
+    return {
+        "message_count": select(func.count(Chat.id))
+        .where(Chat.chat_id == Conversation.id)
+        .scalar_subquery(),
+        "last_message_preview": func.substr(latest(Chat.content), 1, PREVIEW_LENGTH),
+        "last_role": latest(Chat.role),
+    }
+
+
+def stats_tags(chat_id: int, user_id: int | None) -> list[str]:
+    """
+    消息变了要失效的缓存标签：对话本身，知道主人时再加上他的对话列表
+    """
+    tags = [chat_tag(chat_id)]
+    if user_id is not None:
+        tags.append(user_conversations_tag(user_id))
+    return tags
+
+
+def refresh_stats_query(chat_id: int):
+    return (
+        update(Conversation)
+        .where(Conversation.id == chat_id)
+        .values(**conversation_stats_values(), updated_at=func.now())
+    )
 
 
 class UserManagement:
@@ -22,12 +309,17 @@ class UserManagement:
             select(User).where(User.user_id == user_id)
         ).scalar_one_or_none()
 
-    def show_user(self, page_size, page_number):
+    def show_user(self, page_size, page_number, cursor=None):
         return self.db.execute(
-            select(User.user_id, User.name, User.is_admin, User.is_banned)
-            .where(User.is_deleted == False)
-            .limit(page_size)
-            .offset((page_number - 1) * page_size)
+            paginate(
+                select(User.user_id, User.name, User.is_admin, User.is_banned).where(
+                    User.is_deleted == False
+                ),
+                [User.user_id],
+                page_size,
+                page_number,
+                cursor,
+            )
         )
 
     def create_user(
@@ -66,7 +358,9 @@ class UserManagement:
         if not user or user.is_admin:
             return False
         user.is_deleted = True
+        user.deleted_at = func.now()
         self.db.commit()
+        user_state_cache.invalidate(user_id)
         return True
 
     def undo_soft_user_delete(self, user_id: int):
@@ -74,16 +368,35 @@ class UserManagement:
         if not user or not user.is_deleted:
             return False
         user.is_deleted = False
+        user.deleted_at = None
         self.db.commit()
-        self.db.refresh(user)
+        user_state_cache.invalidate(user_id)
         return True
 
     def true_user_delete(self, user_id: int):
         user = self.get_user_by_id(user_id)
         if not user or not user.is_deleted or user.is_admin:
             return False
+        chat_ids = self.db.execute(
+            select(Conversation.id).where(Conversation.user_id == user_id)
+        ).scalars().all()
+        # ORM 级联会逐个对话加载聊天记录再逐条删（N+1），这里按对话批量删
+        if chat_ids:
+            self.db.execute(delete(Chat).where(Chat.chat_id.in_(chat_ids)))
+            self.db.execute(delete(ArchivedChat).where(ArchivedChat.chat_id.in_(chat_ids)))
+            self.db.execute(
+                delete(ConversationSummary).where(
+                    ConversationSummary.chat_id.in_(chat_ids)
+                )
+            )
+            self.db.execute(delete(Conversation).where(Conversation.user_id == user_id))
         self.db.delete(user)
         self.db.commit()
+        user_state_cache.invalidate(user_id)
+        history_cache.drop(*chat_ids)
+        endpoint_cache.invalidate(
+            user_conversations_tag(user_id), *(chat_tag(chat_id) for chat_id in chat_ids)
+        )
         return True
 
     def ban_user(self, user_id):
@@ -92,7 +405,7 @@ class UserManagement:
             return False
         user.is_banned = True
         self.db.commit()
-        self.db.refresh(user)
+        user_state_cache.invalidate(user_id)
         return True
 
     def unban_user(self, user_id):
@@ -101,15 +414,50 @@ class UserManagement:
             return False
         user.is_banned = False
         self.db.commit()
-        self.db.refresh(user)
+        user_state_cache.invalidate(user_id)
         return True
 
-    def get_soft_deleted_users(self, page_size, page_number):
+    def bulk_update_users(self, action: str, user_ids: list[int]) -> dict[int, str]:
+        """
+        批量封禁/解封/软删除/恢复：一次查出这些用户的状态算出每个 id 的结果，
+        再用一条 UPDATE ... WHERE user_id IN (...) 改掉能改的；
+        UPDATE 里带着同样的条件，并发时状态已经变了的行不会被改错
+        """
+        condition, values = BULK_USER_ACTIONS[action]
+        user_ids = list(dict.fromkeys(user_ids))
+        users = {
+            row.user_id: row
+            for row in self.db.execute(
+                select(
+                    User.user_id, User.is_admin, User.is_banned, User.is_deleted
+                ).where(User.user_id.in_(user_ids))
+            )
+        }
+        outcomes = {
+            user_id: bulk_user_outcome(action, users.get(user_id))
+            for user_id in user_ids
+        }
+        to_update = [user_id for user_id, outcome in outcomes.items() if outcome == "ok"]
+        if to_update:
+            self.db.execute(
+                update(User)
+                .where(User.user_id.in_(to_update), condition)
+                .values(**values)
+                .execution_options(synchronize_session=False)
+            )
+            self.db.commit()
+            user_state_cache.invalidate(*to_update)
+        return outcomes
+
+    def get_soft_deleted_users(self, page_size, page_number, cursor=None):
         return self.db.execute(
-            select(User.name, User.user_id)
-            .where(User.is_deleted == True)
-            .limit(page_size)
-            .offset((page_number - 1) * page_size)
+            paginate(
+                select(User.name, User.user_id).where(User.is_deleted == True),
+                [User.user_id],
+                page_size,
+                page_number,
+                cursor,
+            )
         )
 
 
@@ -121,14 +469,17 @@ class ConversationManagement:
         self,
         user_id: int,
         title: str = "新对话",
+        character_id: int | None = None,
     ):
         new_chat = Conversation(
             user_id=user_id,
             title=title,
+            character_id=character_id,
         )
         self.db.add(new_chat)
         self.db.commit()
         self.db.refresh(new_chat)
+        endpoint_cache.invalidate(user_conversations_tag(user_id))
         return new_chat
 
     def get_conversation(self, chat_id: int):
@@ -136,31 +487,62 @@ class ConversationManagement:
             select(Conversation).where(Conversation.id == chat_id)
         ).scalar_one_or_none()
 
-    def show_all_conversation(self, page_size, page_number):
+    def show_all_conversation(self, page_size, page_number, cursor=None):
         return self.db.execute(
-            select(Conversation.id, Conversation.user_id, User.name, Conversation.title)
-            .join(User)
-            .where(User.is_deleted == 0)
-            .limit(page_size)
-            .offset((page_number - 1) * page_size)
+            paginate(
+                select(
+                    Conversation.id, Conversation.user_id, User.name, Conversation.title
+                )
+                .join(User)
+                .where(User.is_deleted == 0),
+                [Conversation.id],
+                page_size,
+                page_number,
+                cursor,
+            )
         )
 
-    def show_user_conversation(self, user_id, page_size, page_number):
+    def show_user_conversation(self, user_id, page_size, page_number, cursor=None):
         return self.db.execute(
-            select(Conversation.id, Conversation.title)
-            .where(Conversation.user_id == user_id)
-            .limit(page_size)
-            .offset((page_number - 1) * page_size)
+            paginate(
+                select(*CONVERSATION_LIST_COLUMNS).where(
+                    Conversation.user_id == user_id
+                ),
+                [Conversation.updated_at, Conversation.id],
+                page_size,
+                page_number,
+                cursor,
+                descending=True,
+            )
         )
 
-    def get_chat(self, chat_id, page_size, page_number):
+    def rehydrate_conversation(self, chat: Conversation) -> bool:
+        """
+        对话已归档时把聊天记录搬回 chats，没归档时不查库；读写聊天记录之前调用
+        """
+        chat_id = chat.id
+        if not chat.archived:
+            return False
+        if not self.db.execute(lock_conversation_query(chat_id)).scalar():
+            # 别的请求已经搬回去了
+            self.db.commit()
+            return False
+        for statement in rehydrate_queries(chat_id):
+            self.db.execute(statement)
+        self.db.commit()
+        return True
+
+    def get_chat(self, chat_id, page_size, page_number, cursor=None):
         return (
             self.db.execute(
-                select(Chat)
-                .where(Chat.chat_id == chat_id)
-                .order_by(Chat.create_at.desc(), Chat.id)
-                .limit(page_size)
-                .offset((page_number - 1) * page_size)
+                paginate(
+                    select(Chat).where(Chat.chat_id == chat_id),
+                    [Chat.create_at, Chat.id],
+                    page_size,
+                    page_number,
+                    cursor,
+                    descending=True,
+                )
             )
             .scalars()
             .all()
@@ -170,20 +552,26 @@ class ConversationManagement:
         chat = self.get_conversation(chat_id)
         if not chat:
             return False
+        user_id = chat.user_id
         history_chat = history_chat[0]
         data_object = [
             {
                 "chat_id": chat_id,
                 "role": history_chat["role"],
                 "content": history_chat["content"],
+                "token_count": count_tokens(history_chat["content"]),
             }
         ]
         self.db.execute(insert(Chat), data_object)
+        self.db.execute(
+            append_stats_query(chat_id, history_chat["role"], history_chat["content"], 1)
+        )
         self.db.commit()
-        self.db.refresh(chat)
+        history_cache.drop(chat_id)
+        endpoint_cache.invalidate(chat_tag(chat_id), user_conversations_tag(user_id))
         return True
 
-    def remove_user_content(self, chat_id):
+    def remove_user_content(self, chat_id, user_id: int | None = None):
         chat = self.db.execute(
             select(Chat)
             .where(Chat.chat_id == chat_id)
@@ -191,62 +579,162 @@ class ConversationManagement:
             .limit(1)
         ).scalar_one_or_none()
         self.db.delete(chat)
+        self.db.flush()
+        self.db.execute(refresh_stats_query(chat_id))
         self.db.commit()
+        history_cache.drop(chat_id)
+        endpoint_cache.invalidate(*stats_tags(chat_id, user_id))
         return True
 
     def update_history_chat(self, chat_id: int, history_chat: list[dict[str, Any]]):
         chat = self.get_conversation(chat_id)
         if not chat:
             return False
+        user_id = chat.user_id
         history_chat = history_chat[-1]
         data_object = [
             {
                 "chat_id": chat_id,
                 "role": history_chat["role"],
                 "content": history_chat["content"],
+                "token_count": count_tokens(history_chat["content"]),
             }
         ]
         self.db.execute(insert(Chat), data_object)
+        self.db.execute(
+            append_stats_query(chat_id, history_chat["role"], history_chat["content"], 1)
+        )
         self.db.commit()
-        self.db.refresh(chat)
+        history_cache.drop(chat_id)
+        endpoint_cache.invalidate(chat_tag(chat_id), user_conversations_tag(user_id))
         return True
 
-    def get_history_chat(self, chat_id: int):
-        chat = self.get_chat(chat_id, page_size=20, page_number=1)
-        if not chat:
-            return []
+    def persist_turn(
+        self,
+        chat_id: int,
+        user_content: str,
+        assistant_content: str,
+        regenerate: bool = False,
+        truncated: bool = False,
+        user_id: int | None = None,
+    ):
+        """
+        一轮对话的落库：（重新生成时先删掉上一轮）写入用户和助手两条消息、
+        更新对话列表的冗余字段，全部在同一个事务里提交
+        user_id 是对话的主人，传了就顺便让他的对话列表缓存失效
+        """
+        if regenerate:
+            ids_to_delete = (
+                self.db.execute(
+                    select(Chat.id)
+                    .where(Chat.chat_id == chat_id)
+                    .order_by(Chat.create_at.desc(), Chat.id.desc())
+                    .limit(2)
+                )
+                .scalars()
+                .all()
+            )
+            if ids_to_delete:
+                self.db.execute(delete(Chat).where(Chat.id.in_(ids_to_delete)))
+        else:
+            ids_to_delete = []
+        turn = turn_rows(chat_id, user_content, assistant_content, truncated)
+        self.db.execute(insert(Chat), turn)
+        messages = cached_turn(self.db.execute(latest_turn_query(chat_id)).all(), turn)
+        self.db.execute(
+            append_stats_query(
+                chat_id, "assistant", assistant_content, len(turn), len(ids_to_delete)
+            )
+        )
+        self.db.commit()
+        if messages is None:
+            history_cache.drop(chat_id)
+        else:
+            history_cache.append(chat_id, messages, pop=len(ids_to_delete))
+        endpoint_cache.invalidate(*stats_tags(chat_id, user_id))
+        return True
+
+    def get_history_chat(self, chat_id: int, token_budget: int | None = None):
+        if token_budget is None:
+            token_budget = get_history_token_budget(None)
+        cached = history_cache.get(chat_id)
+        if cached is None and history_cache.enabled:
+            # 冷对话：取最近 N 条回填缓存
+            version = history_cache.get_version(chat_id)
+            rows = self.db.execute(
+                history_batch_query(chat_id, limit=history_cache.size)
+            ).all()[::-1]
+            cached = (rows, len(rows) < history_cache.size)
+            history_cache.populate(chat_id, version, *cached)
+        if cached is not None:
+            history_chat = history_from_cache(cached, token_budget)
+            if history_chat is not None:
+                return history_chat
+        # 缓存里的不够预算，从最新的消息往回分批取，直到 token 预算用完
         history_chat = []
-        for row in reversed(chat):
-            history_chat.append({"role": row.role, "content": row.content})
+        used_tokens = 0
+        before = None
+        while True:
+            rows = self.db.execute(history_batch_query(chat_id, before)).all()
+            used_tokens, exhausted = fill_history_within_budget(
+                rows, history_chat, used_tokens, token_budget
+            )
+            if exhausted or len(rows) < HISTORY_BATCH_SIZE:
+                break
+            before = (rows[-1].create_at, rows[-1].id)
+        history_chat.reverse()
         return history_chat
 
-    def get_certain_history_chat(self, chat_id: int, page_size, page_number):
-        chat = self.get_chat(chat_id, page_size=page_size, page_number=page_number)
+    def get_certain_history_chat(
+        self, chat_id: int, page_size, page_number, cursor=None
+    ):
+        chat = self.get_chat(
+            chat_id, page_size=page_size, page_number=page_number, cursor=cursor
+        )
         if not chat:
             return None
         history_chat = []
         for row in reversed(chat):
             history_chat.append(
-                {"role": row.role, "content": row.content, "time": row.create_at}
+                {
+                    "id": row.id,
+                    "role": row.role,
+                    "content": row.content,
+                    "time": row.create_at,
+                    "truncated": row.truncated,
+                }
             )
         return history_chat
 
     def delete_conversation(self, chat_id: int):
-        chat = self.get_conversation(chat_id)
-        if not chat:
+        user_id = self.db.execute(
+            select(Conversation.user_id).where(Conversation.id == chat_id)
+        ).scalar_one_or_none()
+        if user_id is None:
             return False
-        self.db.delete(chat)
+        # 直接批量删，避免 ORM 级联先把整段聊天记录加载进来
+        self.db.execute(delete(Chat).where(Chat.chat_id == chat_id))
+        self.db.execute(delete(ArchivedChat).where(ArchivedChat.chat_id == chat_id))
+        self.db.execute(
+            delete(ConversationSummary).where(ConversationSummary.chat_id == chat_id)
+        )
+        self.db.execute(delete(Conversation).where(Conversation.id == chat_id))
         self.db.commit()
+        history_cache.drop(chat_id)
+        endpoint_cache.invalidate(chat_tag(chat_id), user_conversations_tag(user_id))
         return True
 
-    def remove_recent_message(self, chat_id: int):  # 准备更换该方法
+    def remove_recent_message(self, chat_id: int, user_id: int | None = None):  # 准备更换该方法
         history_chat = self.get_chat(chat_id, page_size=2, page_number=1)
         if not history_chat:
             return False
         if history_chat:
             ids_to_delete = [msg.id for msg in history_chat]
             self.db.execute(delete(Chat).where(Chat.id.in_(ids_to_delete)))
+            self.db.execute(refresh_stats_query(chat_id))
             self.db.commit()
+            history_cache.append(chat_id, [], pop=len(ids_to_delete))
+            endpoint_cache.invalidate(*stats_tags(chat_id, user_id))
         return True
 
 
@@ -254,14 +742,18 @@ class CharacterManagement:
     def __init__(self, db: Session):
         self.db = db
 
-    def create_character(self, name, system_prompt):
+    def create_character(self, name, system_prompt, cacheable=False):
         character = self.get_character_by_name(name)
         if character:
             return False
-        new_character = Character(name=name, system_prompt=system_prompt)
+        new_character = Character(
+            name=name, system_prompt=system_prompt, cacheable=cacheable
+        )
         self.db.add(new_character)
         self.db.commit()
         self.db.refresh(new_character)
+        endpoint_cache.invalidate(CHARACTERS_TAG)
+        character_registry.invalidate(new_character.id)
         return new_character
 
     def get_character_by_name(self, name):
@@ -281,6 +773,8 @@ class CharacterManagement:
         character.system_prompt = system_prompt
         self.db.commit()
         self.db.refresh(character)
+        endpoint_cache.invalidate(CHARACTERS_TAG)
+        character_registry.invalidate(character.id)
         return True
 
     def delete_character(self, id):
@@ -289,13 +783,19 @@ class CharacterManagement:
             return False
         self.db.delete(character)
         self.db.commit()
+        endpoint_cache.invalidate(CHARACTERS_TAG)
+        character_registry.invalidate(id)
         return True
 
-    def get_character(self, page_size, page_number):
+    def get_character(self, page_size, page_number, cursor=None):
         return self.db.execute(
-            select(Character.id, Character.name)
-            .limit(page_size)
-            .offset((page_number - 1) * page_size)
+            paginate(
+                select(Character.id, Character.name),
+                [Character.id],
+                page_size,
+                page_number,
+                cursor,
+            )
         )
 
 
@@ -304,24 +804,66 @@ class NotallowedWordManagement:
         self.db = db
 
     def create_not_allowed_word(self, word):
+        begin_not_allowed_words_change()
         new_not_allowed_word = NotAllowedWord(word=word)
         self.db.add(new_not_allowed_word)
         self.db.commit()
         self.db.refresh(new_not_allowed_word)
+        finish_not_allowed_words_change()
         return new_not_allowed_word
 
-    def get_not_allowed_words(self, page_size, page_number):
+    def import_not_allowed_words(self, words, batch_size: int = IMPORT_BATCH_SIZE) -> dict:
+        """
+        words 可以边读上传文件边产出；每 batch_size 个去重后一条多行 INSERT 并提交，已存在的跳过
+        全部导完只递增一次版本号，各 worker 只重建一次匹配器
+        """
+        statement = insert_ignore(NotAllowedWord, self.db.get_bind().dialect.name)
+        max_length = NotAllowedWord.word.type.length
+        stats = {"received": 0, "inserted": 0, "skipped": 0, "invalid": 0}
+        batch = {}
+        begin_not_allowed_words_change()
+
+        def flush():
+            result = self.db.execute(statement.values([{"word": word} for word in batch]))
+            self.db.commit()
+            stats["inserted"] += result.rowcount
+            batch.clear()
+
+        try:
+            for word in words:
+                stats["received"] += 1
+                word = word.strip()
+                if not word or len(word) > max_length:
+                    stats["invalid"] += 1
+                    continue
+                batch[word] = None
+                if len(batch) >= batch_size:
+                    flush()
+            if batch:
+                flush()
+        finally:
+            # 中途出错时已经提交的批次也要让各 worker 看到
+            if stats["inserted"]:
+                finish_not_allowed_words_change()
+        stats["skipped"] = stats["received"] - stats["invalid"] - stats["inserted"]
+        return stats
+
+    def get_not_allowed_words(self, page_size, page_number, cursor=None):
         return self.db.execute(
-            select(NotAllowedWord.word, NotAllowedWord.id)
-            .limit(page_size)
-            .offset((page_number - 1) * page_size)
+            paginate(
+                select(NotAllowedWord.word, NotAllowedWord.id),
+                [NotAllowedWord.id],
+                page_size,
+                page_number,
+                cursor,
+            )
         )
 
     def get_not_allowed_words_all(self):
-        result = self.db.execute(select(NotAllowedWord)).scalars().all()
+        result = self.db.execute(select(NotAllowedWord.word)).scalars().all()
         if not result:
             return None
-        return [row.word for row in result]
+        return list(result)
 
     def delete_not_allowed_word(self, id):
         not_allowed_word = self.db.execute(
@@ -329,8 +871,10 @@ class NotallowedWordManagement:
         ).scalar_one_or_none()
         if not not_allowed_word:
             return False
+        begin_not_allowed_words_change()
         self.db.delete(not_allowed_word)
         self.db.commit()
+        finish_not_allowed_words_change()
         return True
 
     def update_not_allowed_word(self, id, word):
@@ -339,7 +883,9 @@ class NotallowedWordManagement:
         ).scalar_one_or_none()
         if not not_allowed_word:
             return False
+        begin_not_allowed_words_change()
         not_allowed_word.word = word
         self.db.commit()
         self.db.refresh(not_allowed_word)
+        finish_not_allowed_words_change()
         return True
@@ -0,0 +1,89 @@
+import base64
+import json
+from collections.abc import Mapping
+from datetime import datetime
+
+from sqlalchemy import tuple_
+
+# 游标分页：游标是排序键的最后一行取值，base64 编码后对客户端不透明
+# cursor 为 None 时走老的 LIMIT/OFFSET，传空字符串表示从第一页开始走游标
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+def encode_cursor(values) -> str:
+    values = [v.isoformat() if isinstance(v, datetime) else v for v in values]
+    raw = json.dumps(values, separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str, key_columns) -> list:
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        values = json.loads(raw)
+    except (ValueError, TypeError):
+        raise InvalidCursor("invalid cursor")
+    if not isinstance(values, list) or len(values) != len(key_columns):
+        raise InvalidCursor("invalid cursor")
+    return [decode_value(column, value) for column, value in zip(key_columns, values)]
+
+
+def decode_value(column, value):
+    """
+    游标是客户端传回来的，每个值都按列的类型检查，类型不对的值交给驱动会变成 500
+    """
+    try:
+        python_type = column.type.python_type
+    except NotImplementedError:
+        python_type = None
+    # JSON 的 true/false 在 Python 里也是 int
+    if isinstance(value, bool) or not isinstance(value, (int, float, str)):
+        raise InvalidCursor("invalid cursor")
+    if python_type is datetime:
+        if not isinstance(value, str):
+            raise InvalidCursor("invalid cursor")
+        try:
+            return datetime.fromisoformat(value)
+        except ValueError:
+            raise InvalidCursor("invalid cursor")
+    if python_type is int and not isinstance(value, int):
+        raise InvalidCursor("invalid cursor")
+    if python_type is str and not isinstance(value, str):
+        raise InvalidCursor("invalid cursor")
+    return value
+
+
+def paginate(
+    stmt,
+    key_columns,
+    page_size: int,
+    page_number: int = 1,
+    cursor: str | None = None,
+    descending: bool = False,
+):
+    """
+    给查询加上排序和分页，key_columns 必须能唯一确定一行（最后一列一般是主键）
+    """
+    order_by = [column.desc() if descending else column for column in key_columns]
+    stmt = stmt.order_by(*order_by).limit(page_size)
+    if cursor is None:
+        return stmt.offset((page_number - 1) * page_size)
+    if cursor:
+        values = decode_cursor(cursor, key_columns)
+        key = tuple_(*key_columns)
+        stmt = stmt.where(key < tuple(values) if descending else key > tuple(values))
+    return stmt
+
+
+def next_cursor(rows, page_size: int, *key_names) -> str | None:
+    """
+    根据本页最后一行生成下一页的游标，不满一页说明已经到底
+    """
+    if len(rows) < page_size:
+        return None
+    last = rows[-1]
+    if isinstance(last, Mapping):
+        return encode_cursor([last[name] for name in key_names])
+    return encode_cursor([getattr(last, name) for name in key_names])
@@ -0,0 +1,74 @@
+import os
+
+import redis
+from redis import asyncio as aioredis
+from dotenv import load_dotenv
+
+load_dotenv()
+redis_url = os.environ.get("REDIS_URL", "redis://localhost:6379/0")
+
+# 进程内共享的 Redis 客户端（懒加载），各模块不要再各自 from_url 一份
+_redis_client = None
+_async_redis_client = None
+
+
+def get_redis():
+    global _redis_client
+    if _redis_client is None:
+        _redis_client = redis.from_url(redis_url, decode_responses=True)
+    return _redis_client
+
+
+def get_async_redis():
+    global _async_redis_client
+    if _async_redis_client is None:
+        _async_redis_client = aioredis.from_url(redis_url, decode_responses=True)
+    return _async_redis_client
+
+
+# 提交之后没能递增的版本号，Redis 恢复后下一次读写版本号时补上
+_pending_bumps = set()
+
+
+def _flush_pending():
+    for key in list(_pending_bumps):
+        get_redis().incr(key)
+        _pending_bumps.discard(key)
+
+
+async def _flush_pending_async():
+    for key in list(_pending_bumps):
+        await get_async_redis().incr(key)
+        _pending_bumps.discard(key)
+
+
+def bump_version(key: str, retry: bool = False) -> int | None:
+    """
+    递增一个跨 worker 共享的版本号，Redis 不可用时返回 None
+    retry=True 时失败的递增记下来，之后由本进程补上
+    """
+    try:
+        _flush_pending()
+        return get_redis().incr(key)
+    except redis.RedisError:
+        if retry:
+            _pending_bumps.add(key)
+        return None
+
+
+def get_version(key: str) -> int | None:
+    try:
+        _flush_pending()
+        value = get_redis().get(key)
+    except redis.RedisError:
+        return None
+    return int(value) if value is not None else 0
+
+
+async def get_version_async(key: str) -> int | None:
+    try:
+        await _flush_pending_async()
+        value = await get_async_redis().get(key)
+    except redis.RedisError:
+        return None
+    return int(value) if value is not None else 0
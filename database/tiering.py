@@ -0,0 +1,234 @@
+import asyncio
+import logging
+import os
+from datetime import datetime, timedelta, timezone
+
+import redis
+from dotenv import load_dotenv
+from sqlalchemy import select, delete, or_
+
+from .database_structure import (
+    User,
+    Conversation,
+    ConversationSummary,
+    Chat,
+    ArchivedChat,
+)
+from .engine_creating import AsyncSessionLocal
+from .redis_client import get_async_redis
+from .management import (
+    move_chats_query,
+    lock_conversation_query,
+    set_archived_query,
+)
+from .user_state_cache import user_state_cache
+from .history_cache import history_cache
+from .endpoint_cache import endpoint_cache, user_conversations_tag, chat_tag
+
+load_dotenv()
+Logger = logging.getLogger(__name__)
+
+tiering_enabled = os.environ.get("TIERING_ENABLED", "true").lower() == "true"
+# 多少天没有新消息的对话把聊天记录移到 chats_archive
+archive_idle_days = int(os.environ.get("ARCHIVE_IDLE_DAYS", "90"))
+# 软删除的用户过多少天彻底删除，0 表示不自动删
+retention_grace_days = int(os.environ.get("RETENTION_GRACE_DAYS", "30"))
+# 每批搬/删多少行，每批一个短事务，批之间歇一会儿，不长时间占着 chats
+tiering_batch_size = int(os.environ.get("TIERING_BATCH_SIZE", "1000"))
+tiering_batch_pause = float(os.environ.get("TIERING_BATCH_PAUSE", "0.05"))
+# 多久跑一轮（秒）
+tiering_interval = int(os.environ.get("TIERING_INTERVAL", "3600"))
+
+# 多个 worker 只让一个跑，锁在一轮的间隔内有效，不主动释放
+TIERING_LOCK_KEY = "tiering:lock"
+# 每次从库里取多少个候选对话/用户
+CANDIDATE_BATCH_SIZE = 100
+
+
+def utc_now() -> datetime:
+    # 数据库的 now() 按 UTC 写（容器默认时区），这里用同样的时间比较
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+class ChatTiering:
+    """
+    后台任务：长时间没动的对话整段移到 chats_archive（再打开时由 rehydrate_conversation 搬回），
+    软删除超过保留期的用户连同对话一起彻底删除
+    """
+
+    def __init__(self, idle_days: int, grace_days: int, batch_size: int, batch_pause: float, interval: int):
+        self.idle_days = idle_days
+        self.grace_days = grace_days
+        self.batch_size = batch_size
+        self.batch_pause = batch_pause
+        self.interval = interval
+
+    async def run(self):
+        """
+        在 lifespan 里作为后台任务运行
+        """
+        while True:
+            try:
+                await self.run_once()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                Logger.error(f"Tiering pass failed: {e}")
+            await asyncio.sleep(self.interval)
+
+    async def run_once(self, session_factory=None) -> dict | None:
+        try:
+            if not await get_async_redis().set(TIERING_LOCK_KEY, 1, nx=True, ex=self.interval):
+                return None
+        except redis.RedisError as e:
+            Logger.error(f"Acquire tiering lock failed: {e}")
+            return None
+        async with (session_factory or AsyncSessionLocal)() as db:
+            archived = await self.archive_idle_conversations(db)
+            purged = await self.purge_deleted_users(db)
+        Logger.info(f"Tiering pass: archived {archived} messages, purged {purged} users")
+        return {"archived": archived, "purged": purged}
+
+    async def pause(self):
+        if self.batch_pause:
+            await asyncio.sleep(self.batch_pause)
+
+    async def archive_idle_conversations(self, db) -> int:
+        cutoff = utc_now() - timedelta(days=self.idle_days)
+        # 只是被打开看了看的对话 updated_at 不变，按搬回的时间再等 idle_days 天，免得每轮都来回搬
+        idle = (
+            Conversation.archived == False,
+            Conversation.updated_at < cutoff,
+            or_(Conversation.rehydrated_at.is_(None), Conversation.rehydrated_at < cutoff),
+        )
+        moved = 0
+        while True:
+            chat_ids = (
+                await db.execute(
+                    select(Conversation.id)
+                    .where(*idle)
+                    .order_by(Conversation.updated_at)
+                    .limit(CANDIDATE_BATCH_SIZE)
+                )
+            ).scalars().all()
+            await db.commit()
+            if not chat_ids:
+                return moved
+            for chat_id in chat_ids:
+                # 先打上标记再搬，期间有人打开对话会把标记清掉，下面的循环就停下来
+                result = await db.execute(set_archived_query(chat_id, True, *idle))
+                await db.commit()
+                if result.rowcount:
+                    moved += await self.archive_conversation(db, chat_id)
+
+    async def archive_conversation(self, db, chat_id: int) -> int:
+        moved = 0
+        while True:
+            if not (await db.execute(lock_conversation_query(chat_id))).scalar():
+                await db.commit()
+                return moved
+            ids = (
+                await db.execute(
+                    select(Chat.id)
+                    .where(Chat.chat_id == chat_id)
+                    .order_by(Chat.id)
+                    .limit(self.batch_size)
+                )
+            ).scalars().all()
+            if not ids:
+                await db.commit()
+                return moved
+            await db.execute(move_chats_query(Chat, ArchivedChat, Chat.id.in_(ids)))
+            await db.execute(delete(Chat).where(Chat.id.in_(ids)))
+            await db.commit()
+            moved += len(ids)
+            await self.pause()
+
+    async def purge_deleted_users(self, db) -> int:
+        if self.grace_days <= 0:
+            return 0
+        cutoff = utc_now() - timedelta(days=self.grace_days)
+        purged = 0
+        while True:
+            user_ids = (
+                await db.execute(
+                    select(User.user_id)
+                    .where(
+                        User.is_deleted == True,
+                        User.is_admin == False,
+                        User.deleted_at < cutoff,
+                    )
+                    .limit(CANDIDATE_BATCH_SIZE)
+                )
+            ).scalars().all()
+            await db.commit()
+            if not user_ids:
+                return purged
+            for user_id in user_ids:
+                if await self.purge_user(db, user_id):
+                    purged += 1
+                else:
+                    # 期间被恢复了，这一批里剩下的下一轮再看
+                    return purged
+
+    async def still_deleted(self, db, user_id: int) -> bool:
+        # 每批都锁住用户这一行再确认一次，管理员中途恢复用户时不会继续删
+        return bool(
+            (
+                await db.execute(
+                    select(User.is_deleted)
+                    .where(User.user_id == user_id)
+                    .with_for_update()
+                )
+            ).scalar()
+        )
+
+    async def purge_user(self, db, user_id: int) -> bool:
+        chat_ids = (
+            await db.execute(select(Conversation.id).where(Conversation.user_id == user_id))
+        ).scalars().all()
+        for model in (Chat, ArchivedChat):
+            while chat_ids:
+                if not await self.still_deleted(db, user_id):
+                    await db.commit()
+                    return False
+                ids = (
+                    await db.execute(
+                        select(model.id)
+                        .where(model.chat_id.in_(chat_ids))
+                        .limit(self.batch_size)
+                    )
+                ).scalars().all()
+                if not ids:
+                    break
+                await db.execute(delete(model).where(model.id.in_(ids)))
+                await db.commit()
+                await self.pause()
+        if not await self.still_deleted(db, user_id):
+            await db.commit()
+            return False
+        # 聊天记录删完之后剩下的每个对话只有几行，一个事务删掉
+        if chat_ids:
+            await db.execute(delete(Chat).where(Chat.chat_id.in_(chat_ids)))
+            await db.execute(
+                delete(ConversationSummary).where(ConversationSummary.chat_id.in_(chat_ids))
+            )
+            await db.execute(delete(Conversation).where(Conversation.user_id == user_id))
+        await db.execute(delete(User).where(User.user_id == user_id))
+        await db.commit()
+        await user_state_cache.invalidate_async(user_id)
+        await history_cache.drop_async(*chat_ids)
+        await endpoint_cache.invalidate_async(
+            user_conversations_tag(user_id), *(chat_tag(chat_id) for chat_id in chat_ids)
+        )
+        Logger.info(f"Purged soft-deleted user {user_id} ({len(chat_ids)} conversations)")
+        return True
+
+
+chat_tiering = ChatTiering(
+    archive_idle_days,
+    retention_grace_days,
+    tiering_batch_size,
+    tiering_batch_pause,
+    tiering_interval,
+)
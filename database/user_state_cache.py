@@ -0,0 +1,210 @@
+import asyncio
+import logging
+import os
+import time
+from collections import OrderedDict
+
+import redis
+from dotenv import load_dotenv
+
+from .redis_client import get_redis, get_async_redis
+
+load_dotenv()
+Logger = logging.getLogger(__name__)
+
+USER_STATE_KEY = "user_state:{}"
+# 每次失效都递增；查库回填时版本变了就不写，避免把封禁之前读到的状态写回去
+USER_STATE_VERSION_KEY = "user_state:{}:version"
+# 版本号只要比一次查库的时间长就够了
+VERSION_TTL = 3600
+# 封禁/删除时广播，各 worker 收到后立刻丢掉本地缓存
+USER_STATE_CHANNEL = "user_state:invalidate"
+local_ttl = float(os.environ.get("USER_STATE_LOCAL_TTL", "5"))
+redis_ttl = int(os.environ.get("USER_STATE_REDIS_TTL", "60"))
+local_maxsize = int(os.environ.get("USER_STATE_LOCAL_MAXSIZE", "10000"))
+
+# ARGV: 查库前读到的版本号, TTL, 字段和值...
+_FILL_SCRIPT = """
+if (redis.call('GET', KEYS[2]) or '0') ~= ARGV[1] then
+    return 0
+end
+redis.call('DEL', KEYS[1])
+redis.call('HSET', KEYS[1], unpack(ARGV, 3))
+redis.call('EXPIRE', KEYS[1], ARGV[2])
+return 1
+"""
+
+
+class UserState:
+    """
+    鉴权只需要的几个字段，代替 ORM 的 User 对象作为 current_user
+    """
+
+    __slots__ = ("user_id", "name", "is_admin", "is_banned", "is_deleted")
+
+    def __init__(self, user_id, name, is_admin, is_banned, is_deleted):
+        self.user_id = int(user_id)
+        self.name = name
+        self.is_admin = bool(is_admin)
+        self.is_banned = bool(is_banned)
+        self.is_deleted = bool(is_deleted)
+
+    def to_redis(self) -> dict:
+        return {
+            "name": self.name,
+            "is_admin": int(self.is_admin),
+            "is_banned": int(self.is_banned),
+            "is_deleted": int(self.is_deleted),
+        }
+
+    @classmethod
+    def from_redis(cls, user_id, data: dict):
+        return cls(
+            user_id,
+            data["name"],
+            data["is_admin"] == "1",
+            data["is_banned"] == "1",
+            data["is_deleted"] == "1",
+        )
+
+
+class UserStateCache:
+    """
+    进程内 LRU（短 TTL）在前，Redis 副本在后，都没有才查 MySQL
+    """
+
+    def __init__(self, maxsize: int, local_ttl: float, redis_ttl: int):
+        self.maxsize = maxsize
+        self.local_ttl = local_ttl
+        self.redis_ttl = redis_ttl
+        self._local = OrderedDict()
+        # 本 worker 每收到一次失效加一；查库期间变了就不放进本地缓存
+        self._generation = 0
+        self._scripts = {}
+
+    def _script(self, client):
+        script = self._scripts.get(id(client))
+        if script is None:
+            script = client.register_script(_FILL_SCRIPT)
+            self._scripts[id(client)] = script
+        return script
+
+    def _drop_local(self, user_id: int):
+        self._generation += 1
+        self._local.pop(user_id, None)
+
+    def _get_local(self, user_id: int):
+        entry = self._local.get(user_id)
+        if entry is None:
+            return None
+        state, expires_at = entry
+        if expires_at < time.monotonic():
+            self._local.pop(user_id, None)
+            return None
+        self._local.move_to_end(user_id)
+        return state
+
+    def _set_local(self, state: UserState):
+        self._local[state.user_id] = (state, time.monotonic() + self.local_ttl)
+        self._local.move_to_end(state.user_id)
+        while len(self._local) > self.maxsize:
+            self._local.popitem(last=False)
+
+    async def get(self, user_id: int, loader):
+        """
+        loader(user_id) 在缓存都没命中时查库，返回 UserState 或 None
+        """
+        state = self._get_local(user_id)
+        if state is not None:
+            return state
+        generation = self._generation
+        keys = [USER_STATE_KEY.format(user_id), USER_STATE_VERSION_KEY.format(user_id)]
+        client = get_async_redis()
+        try:
+            async with client.pipeline(transaction=False) as pipe:
+                pipe.hgetall(keys[0])
+                pipe.get(keys[1])
+                data, version = await pipe.execute()
+        except redis.RedisError:
+            client = None
+            data, version = None, None
+        if data:
+            state = UserState.from_redis(user_id, data)
+        else:
+            state = await loader(user_id)
+            if state is None:
+                return None
+            if client is not None:
+                # 版本号和查库前读到的不一样说明期间失效过，不回填
+                fields = [item for pair in state.to_redis().items() for item in pair]
+                try:
+                    await self._script(client)(
+                        keys=keys, args=[version or "0", self.redis_ttl, *fields]
+                    )
+                except redis.RedisError:
+                    pass
+        if generation == self._generation:
+            self._set_local(state)
+        return state
+
+    @staticmethod
+    def _queue_invalidate(pipe, user_ids):
+        for user_id in user_ids:
+            # 先递增版本号再删，正在查库的请求回填时会发现版本变了
+            version_key = USER_STATE_VERSION_KEY.format(user_id)
+            pipe.incr(version_key)
+            pipe.expire(version_key, VERSION_TTL)
+        pipe.delete(*(USER_STATE_KEY.format(user_id) for user_id in user_ids))
+        for user_id in user_ids:
+            pipe.publish(USER_STATE_CHANNEL, user_id)
+
+    def invalidate(self, *user_ids: int):
+        # 管理员接口是同步的，这里用同步客户端；先删 Redis 再广播，批量操作时一次往返
+        if not user_ids:
+            return
+        for user_id in user_ids:
+            self._drop_local(user_id)
+        try:
+            with get_redis().pipeline(transaction=False) as pipe:
+                self._queue_invalidate(pipe, user_ids)
+                pipe.execute()
+        except redis.RedisError as e:
+            Logger.error(f"Invalidate user state {user_ids} failed: {e}")
+
+    async def invalidate_async(self, *user_ids: int):
+        """
+        给后台任务等跑在事件循环里的调用方，不用同步客户端阻塞整个 worker
+        """
+        if not user_ids:
+            return
+        for user_id in user_ids:
+            self._drop_local(user_id)
+        try:
+            async with get_async_redis().pipeline(transaction=False) as pipe:
+                self._queue_invalidate(pipe, user_ids)
+                await pipe.execute()
+        except redis.RedisError as e:
+            Logger.error(f"Invalidate user state {user_ids} failed: {e}")
+
+    async def listen(self):
+        """
+        在 lifespan 里作为后台任务运行，订阅失效广播
+        """
+        while True:
+            try:
+                pubsub = get_async_redis().pubsub()
+                await pubsub.subscribe(USER_STATE_CHANNEL)
+                async for message in pubsub.listen():
+                    if message["type"] == "message":
+                        self._drop_local(int(message["data"]))
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                Logger.error(f"User state subscriber error: {e}")
+                # 断线期间本地缓存靠短 TTL 兜底
+                self._generation += 1
+                self._local.clear()
+                await asyncio.sleep(1)
+
+
+user_state_cache = UserStateCache(local_maxsize, local_ttl, redis_ttl)
@@ -1,5 +1,9 @@
-from .database_structure import Base
-from .engine_creating import SessionLocal
+from sqlalchemy import inspect, text, select, update, insert, func
+from sqlalchemy.schema import CreateColumn, AddConstraint
+
+from .database_structure import Base, User, Conversation, Character, Chat, MigrationMarker
+from .management import conversation_stats_values
+from .engine_creating import SessionLocal, AsyncSessionLocal
 import logging
 import time
 
@@ -16,6 +20,7 @@ def init_db(engine):
     for i in range(max_retries):
         try:
             Base.metadata.create_all(engine)
+            migrate_db(engine)
             return
         except Exception as e:
             Logger.error(
@@ -26,6 +31,112 @@ def init_db(engine):
     raise Exception("Database connection failed after retries")
 
 
+def backfill_conversation_character(conn):
+    """
+    老对话的标题是 "{角色名}_{对话名}"，按标题前缀找角色；角色名本身可能带下划线，
+    所以长名字先匹配，免得 "a_b_x" 被算成角色 "a" 的对话
+    只改 character_id 为空的行；角色被删后置空的对话不能再关联到同名的新角色，所以只跑一次
+    """
+    characters = conn.execute(select(Character.id, Character.name)).all()
+    for character_id, name in sorted(characters, key=lambda row: len(row.name), reverse=True):
+        prefix = f"{name}_"
+        result = conn.execute(
+            update(Conversation)
+            .where(
+                Conversation.character_id.is_(None),
+                func.substr(Conversation.title, 1, len(prefix)) == prefix,
+            )
+            # 回填不算对话有更新，保持 updated_at 不变
+            .values(character_id=character_id, updated_at=Conversation.updated_at)
+        )
+        Logger.info(f"Backfilled character_id={character_id} for {result.rowcount} conversations")
+
+
+def backfill_conversation_stats(conn):
+    """
+    对话列表的冗余字段从 chats 算一遍，updated_at 改成最后一条消息的时间
+    只算 chats 里有消息、计数却还是 0 的对话（加列之后还没回填的），已经维护好的和已归档的不动
+    """
+    last_message_at = (
+        select(func.max(Chat.create_at))
+        .where(Chat.chat_id == Conversation.id)
+        .scalar_subquery()
+    )
+    result = conn.execute(
+        update(Conversation)
+        .where(
+            Conversation.message_count == 0,
+            select(Chat.id).where(Chat.chat_id == Conversation.id).exists(),
+        )
+        .values(
+            **conversation_stats_values(),
+            updated_at=func.coalesce(last_message_at, Conversation.updated_at),
+        )
+    )
+    Logger.info(f"Backfilled message stats for {result.rowcount} conversations")
+
+
+def backfill_user_deleted_at(conn):
+    """
+    已经软删除的老用户不知道是什么时候删的，保留期从迁移这一刻开始算
+    """
+    result = conn.execute(
+        update(User)
+        .where(User.is_deleted == True, User.deleted_at.is_(None))
+        .values(deleted_at=func.now())
+    )
+    Logger.info(f"Backfilled deleted_at for {result.rowcount} soft-deleted users")
+
+
+# 新加的列需要从老数据算出来的，在所有列都加完之后跑一次，按名字在 migration_markers 里记是否跑完：
+# MySQL 的 DDL 会自动提交，不能只在加列的那次启动里回填，否则回填失败后列已经在了，再也补不上；
+# 标记和回填在同一个事务里，回填失败时标记也不会写，下次启动重跑
+REPAIRS = {
+    "users.deleted_at": backfill_user_deleted_at,
+    "conversations.character_id": backfill_conversation_character,
+    "conversations.message_count": backfill_conversation_stats,
+}
+
+
+def run_repairs(conn):
+    done = set(conn.execute(select(MigrationMarker.name)).scalars())
+    for name, repair in REPAIRS.items():
+        if name in done:
+            continue
+        repair(conn)
+        conn.execute(insert(MigrationMarker).values(name=name))
+        Logger.info(f"Repair {name} done")
+
+
+def migrate_db(engine):
+    """
+    create_all 不会给已存在的表加列/索引，这里把模型里新增的补上
+    新增的列必须可为空或带 server_default
+    """
+    inspector = inspect(engine)
+    with engine.begin() as conn:
+        for table in Base.metadata.sorted_tables:
+            if not inspector.has_table(table.name):
+                continue
+            existing_columns = {col["name"] for col in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name in existing_columns:
+                    continue
+                column_ddl = CreateColumn(column).compile(dialect=engine.dialect)
+                Logger.info(f"Adding column {table.name}.{column.name}")
+                conn.execute(text(f"ALTER TABLE {table.name} ADD COLUMN {column_ddl}"))
+                # ADD COLUMN 不带外键；SQLite 不支持单独加约束，本来也不强制外键
+                if engine.dialect.name != "sqlite":
+                    for foreign_key in column.foreign_keys:
+                        conn.execute(AddConstraint(foreign_key.constraint))
+            existing_indexes = {idx["name"] for idx in inspector.get_indexes(table.name)}
+            for index in table.indexes:
+                if index.name not in existing_indexes:
+                    Logger.info(f"Creating index {index.name}")
+                    index.create(conn)
+        run_repairs(conn)
+
+
 def get_db():
     db = SessionLocal()
     try:
@@ -35,3 +146,12 @@ def get_db():
         raise
     finally:
         db.close()
+
+
+async def get_async_db():
+    async with AsyncSessionLocal() as db:
+        try:
+            yield db
+        except Exception:
+            await db.rollback()
+            raise
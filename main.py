@@ -1,25 +1,47 @@
 from contextlib import asynccontextmanager
 from database.utils import init_db
-from database.engine_creating import engine, SessionLocal
+from database.engine_creating import engine, SessionLocal, async_engine
 from database.database_structure import User
+from database.pagination import InvalidCursor
 from security.security import SecurityUtils
+from model.model import llm_client_manager
+from database.user_state_cache import user_state_cache
+from database.character_registry import character_registry
+from database.tiering import chat_tiering, tiering_enabled
+from security.password_pool import password_hash_pool
+from security.captcha import captcha_manager
 
 from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, Response
 from router import user_auth, user_conversation, admin
 from sqlalchemy.orm import Session
 from dotenv import load_dotenv
 import uvicorn
 import os
-from redis import asyncio as aioredis
-from fastapi_cache import FastAPICache
-from fastapi_cache.backends.redis import RedisBackend
-
-from slowapi import _rate_limit_exceeded_handler
-from slowapi.errors import RateLimitExceeded
-from slowapi.middleware import SlowAPIMiddleware
-from security.limit_request import limiter
+import asyncio
+import math
+
+from security.limit_request import limiter, RateLimitExceeded
+from monitoring.metrics import (
+    MetricsMiddleware,
+    instrument_engine,
+    render_metrics,
+    CONTENT_TYPE_LATEST,
+)
+from monitoring.query_profiler import (
+    profile_mode,
+    attach_profiler,
+    QueryProfilerMiddleware,
+)
 
 init_db(engine)
+# SQL 耗时和连接池等待，记录在本进程的指标文件里，不走网络
+instrument_engine(engine, "sync")
+instrument_engine(async_engine.sync_engine, "async")
+# 调试/测试时按请求记录所有 SQL，检查重复查询、N+1 和路由的查询预算
+if profile_mode != "off":
+    attach_profiler(engine)
+    attach_profiler(async_engine.sync_engine)
 
 # 初始化 Admin 用户
 load_dotenv(verbose=True)
@@ -56,22 +78,52 @@ async def lifespan(app: FastAPI):
         db.close()
     except Exception as e:
         print(f"Initialization warning: {e}")
-    # 初始化 Redis 缓存
-    redis_url = os.environ.get("REDIS_URL", "redis://redis:6379/0")
-    redis = aioredis.from_url(redis_url, encoding="utf8", decode_responses=True)
-    FastAPICache.init(RedisBackend(redis), prefix="fastapi-cache")
-    print("FastAPI Cache initialized with Redis backend")
+    # 初始化上游大模型客户端（整个 worker 共用一个连接池）
+    try:
+        llm_client_manager.startup()
+    except Exception as e:
+        print(f"LLM client initialization warning: {e}")
+    # 订阅用户状态失效广播（封禁、删除后各 worker 立即生效）
+    user_state_listener = asyncio.create_task(user_state_cache.listen())
+    # 加载全部角色并订阅角色变更广播，发消息时不再查角色表
+    character_listener = asyncio.create_task(character_registry.listen())
+    # 归档长时间没动的对话、彻底删除过了保留期的软删除用户（多个 worker 里只有一个在跑）
+    tiering_task = asyncio.create_task(chat_tiering.run()) if tiering_enabled else None
+    # 密码哈希进程池
+    password_hash_pool.startup()
+    # 后台预生成验证码，请求路径上只做出队和写 Redis
+    captcha_manager.start()
 
     yield
     # 2. 关闭时的逻辑 (如果是空则留空)
-    await redis.close()
-    print("Redis connection closed")
+    user_state_listener.cancel()
+    character_listener.cancel()
+    if tiering_task is not None:
+        tiering_task.cancel()
+    await captcha_manager.stop()
+    password_hash_pool.shutdown()
+    await llm_client_manager.shutdown()
+    # aiosqlite 的连接线程不是守护线程，不释放的话进程退不出去
+    await async_engine.dispose()
 
 
 app = FastAPI(lifespan=lifespan)
 
-app.state.limiter = limiter
-app.add_exception_handler(RateLimitExceeded, _rate_limit_exceeded_handler)
+
+@app.exception_handler(RateLimitExceeded)
+async def rate_limit_exceeded_handler(request: Request, exc: RateLimitExceeded):
+    return JSONResponse(
+        status_code=429,
+        content={"error": f"Rate limit exceeded: {exc.detail}"},
+        headers={"Retry-After": str(max(1, math.ceil(exc.retry_after)))},
+    )
+
+
+@app.exception_handler(InvalidCursor)
+async def invalid_cursor_handler(request: Request, exc: InvalidCursor):
+    return JSONResponse(status_code=400, content={"detail": "分页游标无效"})
+
+
 from fastapi.middleware.cors import CORSMiddleware
 
 app.add_middleware(
@@ -81,7 +133,10 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
-app.add_middleware(SlowAPIMiddleware)
+# 放在最外层，路由耗时包含其它中间件
+if profile_mode != "off":
+    app.add_middleware(QueryProfilerMiddleware)
+app.add_middleware(MetricsMiddleware)
 app.include_router(user_auth.router, prefix="/user_auth", tags=["用户管理接口"])
 app.include_router(user_conversation.router, tags=["聊天相关"])
 app.include_router(admin.router, prefix="/admin", tags=["管理员操作"])
@@ -93,5 +148,11 @@ def read_root(request: Request):
     return {"status": "OK"}
 
 
+@app.get("/metrics", include_in_schema=False)
+def metrics():
+    # 汇总本机所有 worker 的指标，nginx 只允许内网访问
+    return Response(render_metrics(), media_type=CONTENT_TYPE_LATEST)
+
+
 if __name__ == "__main__":
     uvicorn.run("main:app", host="0.0.0.0", port=8000, reload=True)
@@ -1,5 +1,5 @@
 from model import model
 
-from model.model import (CyreneLLMModel,)
+from model.model import (CyreneLLMModel, LLMClientManager, llm_client_manager,)
 
-__all__ = ['CyreneLLMModel', 'model']
+__all__ = ['CyreneLLMModel', 'LLMClientManager', 'llm_client_manager', 'model']
@@ -0,0 +1,340 @@
+import asyncio
+import logging
+import os
+import time
+import uuid
+
+import redis
+from dotenv import load_dotenv
+
+from database.redis_client import get_async_redis
+from .streaming import StreamAbort
+
+load_dotenv()
+Logger = logging.getLogger(__name__)
+
+# 每个模型同时打到上游的流数上限（所有 worker 合计），单独配置的写在 LLM_MODEL_CONCURRENCY
+default_concurrency = int(os.environ.get("LLM_MAX_CONCURRENCY", "32"))
+model_concurrency = {
+    name.strip(): int(limit)
+    for name, _, limit in (
+        item.partition("=")
+        for item in os.environ.get("LLM_MODEL_CONCURRENCY", "").split(",")
+        if item.strip()
+    )
+}
+queue_max_wait = float(os.environ.get("LLM_QUEUE_MAX_WAIT", "30"))
+queue_max_length = int(os.environ.get("LLM_QUEUE_MAX_LENGTH", "100"))
+# 租约到期没续上（worker 挂了）就自动释放，流式期间每 1/3 TTL 续一次
+lease_ttl = float(os.environ.get("LLM_LEASE_TTL", "60"))
+poll_interval = float(os.environ.get("LLM_QUEUE_POLL_INTERVAL", "0.25"))
+
+LEASES_KEY = "llm_admission:{}:leases"
+QUEUE_KEY = "llm_admission:{}:queue"
+DEADLINES_KEY = "llm_admission:{}:deadlines"
+
+# 排队顺序：某用户在队里的第 k 个请求，优先级是 他正在占用的并发数 + k，
+# 同优先级按入队先后；排在空闲名额以内的才放行。成员格式 user_id:随机串
+# 返回 {1, 0} 放行，{0, 前面还有几个人} 继续等，{-1, 0} 队列已满，{-2, 0} 排队已过期
+_ACQUIRE_SCRIPT = """
+local clock = redis.call('TIME')
+local now = tonumber(clock[1]) + tonumber(clock[2]) / 1000000
+local ticket, cap, ttl = ARGV[1], tonumber(ARGV[2]), tonumber(ARGV[3])
+redis.call('ZREMRANGEBYSCORE', KEYS[1], '-inf', now)
+local leases = redis.call('ZRANGE', KEYS[1], 0, -1)
+local active = {}
+for _, lease in ipairs(leases) do
+    local owner = string.match(lease, '^([^:]+):')
+    active[owner] = (active[owner] or 0) + 1
+end
+if not redis.call('ZSCORE', KEYS[2], ticket) then
+    if tonumber(ARGV[5]) == 0 then
+        return {-2, 0}
+    end
+    if redis.call('ZCARD', KEYS[2]) >= tonumber(ARGV[6]) then
+        return {-1, 0}
+    end
+    redis.call('ZADD', KEYS[2], now, ticket)
+    redis.call('HSET', KEYS[3], ticket, now + tonumber(ARGV[4]))
+end
+local queue = {}
+local queued = {}
+for i, member in ipairs(redis.call('ZRANGE', KEYS[2], 0, -1)) do
+    if tonumber(redis.call('HGET', KEYS[3], member) or '0') < now then
+        redis.call('ZREM', KEYS[2], member)
+        redis.call('HDEL', KEYS[3], member)
+    else
+        local owner = string.match(member, '^([^:]+):')
+        queued[owner] = (queued[owner] or 0) + 1
+        table.insert(queue, {member, (active[owner] or 0) + queued[owner], i})
+    end
+end
+table.sort(queue, function(a, b)
+    if a[2] ~= b[2] then
+        return a[2] < b[2]
+    end
+    return a[3] < b[3]
+end)
+local free = cap - #leases
+for position, entry in ipairs(queue) do
+    if entry[1] == ticket then
+        if position > free then
+            return {0, position - free}
+        end
+        redis.call('ZREM', KEYS[2], ticket)
+        redis.call('HDEL', KEYS[3], ticket)
+        redis.call('ZADD', KEYS[1], now + ttl, ticket)
+        return {1, 0}
+    end
+end
+return {-2, 0}
+"""
+
+_RENEW_SCRIPT = """
+local clock = redis.call('TIME')
+local now = tonumber(clock[1]) + tonumber(clock[2]) / 1000000
+return redis.call('ZADD', KEYS[1], 'XX', 'CH', now + tonumber(ARGV[2]), ARGV[1])
+"""
+
+
+class AdmissionTimeout(StreamAbort):
+    pass
+
+
+class AdmissionRejected(StreamAbort):
+    pass
+
+
+def fair_order(queue: list, active: dict) -> list:
+    """
+    queue 按入队先后排列的 (ticket, user_id)，返回公平排序后的 ticket 列表（和 Lua 脚本一致）
+    """
+    queued = {}
+    ranked = []
+    for index, (ticket, user_id) in enumerate(queue):
+        queued[user_id] = queued.get(user_id, 0) + 1
+        ranked.append((active.get(user_id, 0) + queued[user_id], index, ticket))
+    ranked.sort()
+    return [ticket for _, _, ticket in ranked]
+
+
+class _RedisBackend:
+    def __init__(self):
+        self._scripts = {}
+
+    def _script(self, source: str):
+        client = get_async_redis()
+        script = self._scripts.get((id(client), source))
+        if script is None:
+            script = client.register_script(source)
+            self._scripts[(id(client), source)] = script
+        return script
+
+    def _keys(self, model: str) -> list:
+        return [LEASES_KEY.format(model), QUEUE_KEY.format(model), DEADLINES_KEY.format(model)]
+
+    async def step(self, model, ticket, user_id, cap, enqueue: bool):
+        status, position = await self._script(_ACQUIRE_SCRIPT)(
+            keys=self._keys(model),
+            args=[ticket, cap, lease_ttl, queue_max_wait + 5, int(enqueue), queue_max_length],
+        )
+        return int(status), int(position)
+
+    async def renew(self, model, ticket):
+        await self._script(_RENEW_SCRIPT)(
+            keys=[LEASES_KEY.format(model)], args=[ticket, lease_ttl]
+        )
+
+    async def release(self, model, ticket):
+        await get_async_redis().zrem(LEASES_KEY.format(model), ticket)
+
+    async def cancel(self, model, ticket):
+        async with get_async_redis().pipeline(transaction=True) as pipe:
+            pipe.zrem(QUEUE_KEY.format(model), ticket)
+            pipe.hdel(DEADLINES_KEY.format(model), ticket)
+            await pipe.execute()
+
+
+class _LocalBackend:
+    """
+    Redis 不可用时的兜底：只在本 worker 内按同样的规则限流和排队
+    """
+
+    def __init__(self):
+        self._leases = {}
+        self._queues = {}
+
+    async def step(self, model, ticket, user_id, cap, enqueue: bool):
+        leases = self._leases.setdefault(model, {})
+        queue = self._queues.setdefault(model, {})
+        if ticket not in queue:
+            if not enqueue:
+                return -2, 0
+            if len(queue) >= queue_max_length:
+                return -1, 0
+            queue[ticket] = user_id
+        active = {}
+        for owner in leases.values():
+            active[owner] = active.get(owner, 0) + 1
+        order = fair_order(list(queue.items()), active)
+        free = cap - len(leases)
+        position = order.index(ticket) + 1
+        if position > free:
+            return 0, position - free
+        del queue[ticket]
+        leases[ticket] = user_id
+        return 1, 0
+
+    async def renew(self, model, ticket):
+        pass
+
+    async def release(self, model, ticket):
+        self._leases.get(model, {}).pop(ticket, None)
+
+    async def cancel(self, model, ticket):
+        self._queues.get(model, {}).pop(ticket, None)
+
+
+class AdmissionController:
+    """
+    上游并发准入：每个模型一个全局上限，超出的请求按用户公平排队，最多等 queue_max_wait 秒
+    状态放在 Redis 里各 worker 共享，Redis 出错时退回本地限流
+    """
+
+    def __init__(self):
+        self.redis_backend = _RedisBackend()
+        self.local_backend = _LocalBackend()
+        self._wakeups = {}
+        self.admitted = 0
+        self.queued = 0
+        self.timeouts = 0
+        self.rejected = 0
+        self.waiting = 0
+        self.active = 0
+
+    def capacity(self, model: str) -> int:
+        return model_concurrency.get(model, default_concurrency)
+
+    def wakeup(self, model: str) -> asyncio.Event:
+        event = self._wakeups.get(model)
+        if event is None:
+            event = self._wakeups[model] = asyncio.Event()
+        return event
+
+    def ticket(self, model: str, user_id) -> "AdmissionTicket":
+        return AdmissionTicket(self, model, user_id)
+
+    def stats(self) -> dict:
+        return {
+            "active": self.active,
+            "waiting": self.waiting,
+            "admitted": self.admitted,
+            "queued": self.queued,
+            "timeouts": self.timeouts,
+            "rejected": self.rejected,
+        }
+
+
+class AdmissionTicket:
+    """
+    一次 /send_message 的准入：async for 拿排队位置，循环结束即已放行，用完 release
+    """
+
+    def __init__(self, controller: AdmissionController, model: str, user_id):
+        self.controller = controller
+        self.model = model
+        self.ticket = f"{user_id}:{uuid.uuid4().hex}"
+        self.user_id = str(user_id)
+        self.backend = controller.redis_backend
+        self.granted = False
+        self._renewer = None
+
+    async def _step(self, enqueue: bool):
+        cap = self.controller.capacity(self.model)
+        if self.backend is self.controller.redis_backend:
+            try:
+                return await self.backend.step(
+                    self.model, self.ticket, self.user_id, cap, enqueue
+                )
+            except redis.RedisError as e:
+                Logger.error(f"Admission via Redis failed, using local limits: {e}")
+                self.backend = self.controller.local_backend
+                enqueue = True
+        return await self.backend.step(self.model, self.ticket, self.user_id, cap, enqueue)
+
+    async def positions(self):
+        """
+        放行前每当排队位置变化就 yield 一次（从 1 开始），超时或队列满抛 StreamAbort
+        """
+        controller = self.controller
+        deadline = time.monotonic() + queue_max_wait
+        status, position = await self._step(enqueue=True)
+        if status == 0:
+            controller.queued += 1
+        last_position = None
+        controller.waiting += 1
+        try:
+            while status == 0:
+                if position != last_position:
+                    last_position = position
+                    yield position
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                # 本 worker 有人释放时立即重试，其余 worker 释放的靠轮询发现
+                wakeup = controller.wakeup(self.model)
+                try:
+                    await asyncio.wait_for(
+                        wakeup.wait(), min(poll_interval, remaining)
+                    )
+                except asyncio.TimeoutError:
+                    pass
+                status, position = await self._step(enqueue=False)
+        finally:
+            controller.waiting -= 1
+            if status != 1:
+                await self._cancel()
+        if status == -1:
+            controller.rejected += 1
+            raise AdmissionRejected("当前排队人数已满，请稍后再试")
+        if status != 1:
+            controller.timeouts += 1
+            raise AdmissionTimeout("当前使用人数较多，排队超时，请稍后再试")
+        self.granted = True
+        controller.admitted += 1
+        controller.active += 1
+        self._renewer = asyncio.create_task(self._renew())
+
+    async def _renew(self):
+        while True:
+            await asyncio.sleep(lease_ttl / 3)
+            try:
+                await self.backend.renew(self.model, self.ticket)
+            except redis.RedisError as e:
+                Logger.error(f"Renew admission lease failed: {e}")
+
+    async def _cancel(self):
+        try:
+            await self.backend.cancel(self.model, self.ticket)
+        except redis.RedisError as e:
+            Logger.error(f"Cancel admission ticket failed: {e}")
+
+    async def release(self):
+        if not self.granted:
+            return
+        self.granted = False
+        self.controller.active -= 1
+        if self._renewer is not None:
+            self._renewer.cancel()
+        try:
+            await self.backend.release(self.model, self.ticket)
+        except redis.RedisError as e:
+            # 没删掉的租约等 TTL 到期自动释放
+            Logger.error(f"Release admission lease failed: {e}")
+        # 唤醒本 worker 里排队的请求，各自重新去抢
+        wakeup = self.controller.wakeup(self.model)
+        wakeup.set()
+        wakeup.clear()
+
+
+admission_controller = AdmissionController()
@@ -1,10 +1,113 @@
-from openai import AsyncOpenAI
+import httpx
+from openai import AsyncOpenAI, DefaultAsyncHttpxClient
 from dotenv import load_dotenv
 import os
 
+from .response_cache import response_cache, make_cache_key
+from .registry import model_registry, stream_chat
+
 load_dotenv(verbose=True)
 
 
+class LLMClientManager:
+    """
+    每个 worker 一个长连接的上游客户端，在 main.py 的 lifespan 里创建和关闭
+    连接池参数都可以通过环境变量配置
+    """
+
+    def __init__(self):
+        self.client = None
+        self.http_client = None
+        # 显式指定了上游的对话用的客户端，按 (base_url, api_key) 各建一个，共用同一个连接池
+        self.endpoint_clients = {}
+        self.max_connections = int(os.environ.get("LLM_MAX_CONNECTIONS", "100"))
+        self.max_keepalive_connections = int(
+            os.environ.get("LLM_MAX_KEEPALIVE_CONNECTIONS", "20")
+        )
+        self.keepalive_expiry = float(os.environ.get("LLM_KEEPALIVE_EXPIRY", "30"))
+        self.connect_timeout = float(os.environ.get("LLM_CONNECT_TIMEOUT", "10"))
+        # 流式响应里两个 chunk 之间允许的最长间隔
+        self.read_timeout = float(os.environ.get("LLM_READ_TIMEOUT", "120"))
+        self.max_retries = int(os.environ.get("LLM_MAX_RETRIES", "2"))
+
+    def startup(self):
+        if self.client is not None:
+            return self.client
+        self.http_client = DefaultAsyncHttpxClient(
+            limits=httpx.Limits(
+                max_connections=self.max_connections,
+                max_keepalive_connections=self.max_keepalive_connections,
+                keepalive_expiry=self.keepalive_expiry,
+            ),
+            timeout=httpx.Timeout(self.read_timeout, connect=self.connect_timeout),
+        )
+        self.client = AsyncOpenAI(
+            api_key=os.environ.get("API_KEY"),
+            base_url=os.environ.get("BASE_URL"),
+            http_client=self.http_client,
+            max_retries=self.max_retries,
+        )
+        model_registry.startup(self.http_client, self.client, self.max_retries)
+        return self.client
+
+    async def shutdown(self):
+        for client in self.endpoint_clients.values():
+            await client.close()
+        if self.client is not None:
+            await self.client.close()
+        model_registry.shutdown()
+        self.endpoint_clients = {}
+        self.client = None
+        self.http_client = None
+
+    def get_client(self, api_key=None, base_url=None) -> AsyncOpenAI:
+        # 没走 lifespan（比如脚本里直接调用）时懒加载
+        client = self.client or self.startup()
+        # 和以前一样环境变量优先，参数只在环境变量没配时才用
+        api_key = os.environ.get("API_KEY") or api_key
+        base_url = os.environ.get("BASE_URL") or base_url
+        if (base_url, api_key) == (os.environ.get("BASE_URL"), os.environ.get("API_KEY")):
+            return client
+        key = (base_url, api_key)
+        if key not in self.endpoint_clients:
+            self.endpoint_clients[key] = AsyncOpenAI(
+                api_key=api_key,
+                base_url=base_url,
+                http_client=self.http_client,
+                max_retries=self.max_retries,
+            )
+        return self.endpoint_clients[key]
+
+    def get_registry(self):
+        # 同上，保证各上游的客户端已经建好
+        self.get_client()
+        return model_registry
+
+    def pool_stats(self) -> dict:
+        stats = {
+            "max_connections": self.max_connections,
+            "max_keepalive_connections": self.max_keepalive_connections,
+            "connections": 0,
+            "in_use": 0,
+            "idle": 0,
+        }
+        # httpx 没有公开连接池状态，只能读 transport 内部的 httpcore 连接池
+        pool = getattr(getattr(self.http_client, "_transport", None), "_pool", None)
+        if pool is None:
+            return stats
+        connections = list(pool.connections)
+        idle = sum(1 for connection in connections if connection.is_idle())
+        stats.update(
+            connections=len(connections),
+            in_use=len(connections) - idle,
+            idle=idle,
+        )
+        return stats
+
+
+llm_client_manager = LLMClientManager()
+
+
 class CyreneLLMModel:
     def __init__(
         self, client=None, system_prompt=None, history_chat=None, model=None
@@ -15,25 +118,59 @@ class CyreneLLMModel:
         self.model = model
 
     async def chatting(
-        self, contents: str, model="deepseek-chat", temperature=1.0, max_tokens=8192
+        self,
+        contents: str,
+        model="deepseek-chat",
+        temperature=1.0,
+        max_tokens=8192,
+        cacheable: bool = False,
     ):
+        """
+        temperature 为 0 或 cacheable=True 时走响应缓存，命中就按原分块回放
+        """
         system_prompt = [{"role": "system", "content": self.system_prompt}]
         current_msg = [{"role": "user", "content": contents}]
         message_request_head = system_prompt + self.history_chat + current_msg
-        try:
-            response = await self.client.chat.completions.create(
-                model=model,
-                messages=message_request_head,
-                temperature=temperature,
-                max_tokens=max_tokens,
-                stream=True,
+        cache_key = None
+        if response_cache.enabled and (cacheable or temperature == 0):
+            cache_key = make_cache_key(
+                model, message_request_head, temperature, max_tokens
             )
-
-            full_text = ""
-            async for chunk in response:
-                if chunk.choices[0].delta.content:
-                    full_text += chunk.choices[0].delta.content
-                    yield chunk.choices[0].delta.content
+        try:
+            cached = response_cache.get(cache_key) if cache_key else None
+            if cached is not None:
+                for chunk in cached:
+                    yield chunk
+                full_text = "".join(cached)
+            else:
+                if self.client is not None:
+                    deltas = stream_chat(
+                        self.client,
+                        model,
+                        message_request_head,
+                        temperature=temperature,
+                        max_tokens=max_tokens,
+                    )
+                else:
+                    # 没有指定上游时按模型名路由，首个 token 之前失败会自动换上游
+                    deltas = llm_client_manager.get_registry().stream(
+                        model,
+                        message_request_head,
+                        temperature=temperature,
+                        max_tokens=max_tokens,
+                    )
+                chunks = []
+                try:
+                    async for delta in deltas:
+                        chunks.append(delta)
+                        yield delta
+                finally:
+                    # 客户端断开时这里会被取消，主动关掉上游连接，让上游停止生成
+                    await deltas.aclose()
+                full_text = "".join(chunks)
+                # 只缓存完整生成完的回复
+                if cache_key and full_text:
+                    response_cache.put(cache_key, chunks)
             self.history_chat.append({"role": "user", "content": contents})
             self.history_chat.append({"role": "assistant", "content": full_text})
 
@@ -49,8 +186,10 @@ class CyreneLLMModel:
         model: str = "deepseek-chat",
         history_chat=None,
     ):
-        client = AsyncOpenAI(
-            api_key=os.environ.get("API_KEY") or api_key,
-            base_url=os.environ.get("BASE_URL") or base_url,
-        )
+        if api_key or base_url:
+            # 显式指定了上游时用管理器里按上游缓存的客户端，连接池仍是共享的那一个
+            client = llm_client_manager.get_client(api_key, base_url)
+        else:
+            # 不绑定客户端，chatting 时由 model_registry 挑上游
+            client = None
         return cls(client, system_prompt, history_chat, model)
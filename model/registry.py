@@ -0,0 +1,247 @@
+import json
+import logging
+import os
+import time
+
+import httpx
+import openai
+from openai import AsyncOpenAI
+from dotenv import load_dotenv
+
+load_dotenv()
+Logger = logging.getLogger(__name__)
+
+# 上游列表，JSON 数组，每项：
+# {"name": "a", "base_url": "...", "api_key": "...", "models": ["deepseek-chat"],
+#  "model_map": {"deepseek-chat": "上游那边的模型名"}, "max_retries": 0}
+# models 不写或写 ["*"] 表示接受所有模型；不配置时退回 BASE_URL / API_KEY 单上游
+upstreams_config = os.environ.get("LLM_UPSTREAMS", "")
+# 连续失败多少次熔断，熔断多久后放一个请求试探，试探失败冷却时间翻倍
+circuit_failures = int(os.environ.get("LLM_CIRCUIT_FAILURES", "5"))
+circuit_cooldown = float(os.environ.get("LLM_CIRCUIT_COOLDOWN", "30"))
+circuit_max_cooldown = float(os.environ.get("LLM_CIRCUIT_MAX_COOLDOWN", "300"))
+# 延迟和错误率的指数滑动平均系数
+health_alpha = float(os.environ.get("LLM_HEALTH_ALPHA", "0.2"))
+# 错误率对路由打分的惩罚倍数：分数 = 首 token 延迟 * (1 + 惩罚 * 错误率)
+error_penalty = float(os.environ.get("LLM_ERROR_PENALTY", "4"))
+
+
+class NoUpstreamAvailable(Exception):
+    pass
+
+
+def is_upstream_failure(error: Exception) -> bool:
+    """
+    连接失败、超时、429、5xx 算上游的问题，可以换一个上游；
+    其余 4xx 换了也一样，代码里的异常更不该记到上游头上，都直接抛
+    """
+    if isinstance(error, openai.APIStatusError):
+        return error.status_code == 429 or error.status_code >= 500
+    # APITimeoutError 是 APIConnectionError 的子类；流式读到一半的超时、断连是 httpx 直接抛出来的
+    return isinstance(error, (openai.APIConnectionError, httpx.TransportError))
+
+
+async def stream_chat(client: AsyncOpenAI, model: str, messages: list, **params):
+    """
+    流式调用一个上游，只 yield 非空的增量；结束、出错或被取消时都会关掉上游连接
+    """
+    response = await client.chat.completions.create(
+        model=model, messages=messages, stream=True, **params
+    )
+    try:
+        async for chunk in response:
+            if chunk.choices and chunk.choices[0].delta.content:
+                yield chunk.choices[0].delta.content
+    finally:
+        await response.close()
+
+
+class Upstream:
+    def __init__(
+        self,
+        name: str,
+        base_url: str | None,
+        api_key: str | None,
+        models=None,
+        model_map: dict | None = None,
+        max_retries: int | None = None,
+    ):
+        self.name = name
+        self.base_url = base_url
+        self.api_key = api_key
+        self.models = set(models or ["*"])
+        self.model_map = model_map or {}
+        self.max_retries = max_retries
+        self.client = None
+        self.latency = None
+        self.error_rate = 0.0
+        self.consecutive_failures = 0
+        self.state = "closed"
+        self.opened_at = 0.0
+        self.cooldown = circuit_cooldown
+        self.trial_in_flight = False
+        self.requests = 0
+        self.failures = 0
+
+    def serves(self, model: str) -> bool:
+        return "*" in self.models or model in self.models
+
+    def target(self, model: str) -> str:
+        return self.model_map.get(model, model)
+
+    def available(self, now: float) -> bool:
+        if self.state == "open" and now - self.opened_at >= self.cooldown:
+            self.state = "half_open"
+        if self.state == "half_open":
+            return not self.trial_in_flight
+        return self.state == "closed"
+
+    def score(self) -> float:
+        if self.latency is None:
+            # 还没成功过：没试过的优先试一下，只失败过的排最后
+            return float("inf") if self.failures else 0.0
+        return self.latency * (1 + error_penalty * self.error_rate)
+
+    def record_success(self, latency: float):
+        self.requests += 1
+        if self.latency is None:
+            self.latency = latency
+        else:
+            self.latency += health_alpha * (latency - self.latency)
+        self.error_rate -= health_alpha * self.error_rate
+        self.consecutive_failures = 0
+        self.trial_in_flight = False
+        if self.state != "closed":
+            Logger.info(f"Upstream {self.name} recovered")
+        self.state = "closed"
+        self.cooldown = circuit_cooldown
+
+    def record_failure(self):
+        self.requests += 1
+        self.failures += 1
+        self.error_rate += health_alpha * (1 - self.error_rate)
+        self.consecutive_failures += 1
+        if self.state == "half_open":
+            # 试探失败，重新熔断并加长冷却
+            self.cooldown = min(self.cooldown * 2, circuit_max_cooldown)
+            self._open()
+        elif self.state == "closed" and self.consecutive_failures >= circuit_failures:
+            self._open()
+        self.trial_in_flight = False
+
+    def _open(self):
+        self.state = "open"
+        self.opened_at = time.monotonic()
+        Logger.error(f"Upstream {self.name} circuit opened for {self.cooldown}s")
+
+    def stats(self) -> dict:
+        return {
+            "name": self.name,
+            "state": self.state,
+            "latency_ms": None if self.latency is None else round(self.latency * 1000, 1),
+            "error_rate": round(self.error_rate, 4),
+            "requests": self.requests,
+            "failures": self.failures,
+        }
+
+
+class ModelRegistry:
+    """
+    模型名 -> 一个或多个上游；按首 token 延迟和错误率挑最健康的，
+    首 token 出来之前失败就换下一个上游，之后失败只能报错
+    """
+
+    def __init__(self, upstreams: list[Upstream]):
+        self.upstreams = upstreams
+
+    @classmethod
+    def from_env(cls):
+        if not upstreams_config:
+            return cls(
+                [Upstream("default", os.environ.get("BASE_URL"), os.environ.get("API_KEY"))]
+            )
+        return cls([Upstream(**item) for item in json.loads(upstreams_config)])
+
+    def startup(self, http_client, default_client: AsyncOpenAI, max_retries: int):
+        """
+        所有上游共用 LLMClientManager 的 httpx 连接池；多上游时由故障转移代替 SDK 重试
+        """
+        if not upstreams_config:
+            self.upstreams[0].client = default_client
+            return
+        multiple = len(self.upstreams) > 1
+        for upstream in self.upstreams:
+            retries = upstream.max_retries
+            if retries is None:
+                retries = 0 if multiple else max_retries
+            upstream.client = AsyncOpenAI(
+                api_key=upstream.api_key or os.environ.get("API_KEY"),
+                base_url=upstream.base_url,
+                http_client=http_client,
+                max_retries=retries,
+            )
+
+    def shutdown(self):
+        for upstream in self.upstreams:
+            upstream.client = None
+
+    def supports(self, model: str) -> bool:
+        return any(upstream.serves(model) for upstream in self.upstreams)
+
+    def candidates(self, model: str) -> list[Upstream]:
+        now = time.monotonic()
+        return sorted(
+            (u for u in self.upstreams if u.serves(model) and u.available(now)),
+            key=Upstream.score,
+        )
+
+    async def stream(self, model: str, messages: list, **params):
+        """
+        按健康度依次尝试各上游，拿到第一个增量才算选定，之后的增量原样往外 yield
+        """
+        last_error = None
+        for upstream in self.candidates(model):
+            if upstream.state == "half_open":
+                if upstream.trial_in_flight:
+                    continue
+                upstream.trial_in_flight = True
+            started = time.monotonic()
+            deltas = stream_chat(upstream.client, upstream.target(model), messages, **params)
+            try:
+                first = await deltas.__anext__()
+            except StopAsyncIteration:
+                # 上游正常结束但没有内容，也算成功
+                upstream.record_success(time.monotonic() - started)
+                return
+            except Exception as e:
+                await deltas.aclose()
+                if not is_upstream_failure(e):
+                    upstream.trial_in_flight = False
+                    raise
+                upstream.record_failure()
+                Logger.error(f"Upstream {upstream.name} failed before first token: {e}")
+                last_error = e
+                continue
+            except BaseException:
+                upstream.trial_in_flight = False
+                await deltas.aclose()
+                raise
+            upstream.record_success(time.monotonic() - started)
+            try:
+                yield first
+                async for delta in deltas:
+                    yield delta
+            except Exception as e:
+                if is_upstream_failure(e):
+                    upstream.record_failure()
+                raise
+            finally:
+                await deltas.aclose()
+            return
+        raise last_error or NoUpstreamAvailable(f"no healthy upstream for {model}")
+
+    def stats(self) -> list[dict]:
+        return [upstream.stats() for upstream in self.upstreams]
+
+
+model_registry = ModelRegistry.from_env()
@@ -0,0 +1,95 @@
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# 完全相同的确定性请求（temperature=0 或角色标记了 cacheable）直接回放上次的输出
+response_cache_size = int(os.environ.get("RESPONSE_CACHE_SIZE", "1000"))
+response_cache_ttl = float(os.environ.get("RESPONSE_CACHE_TTL", "3600"))
+# 所有条目加起来最多缓存多少字符，超了按 LRU 淘汰
+response_cache_max_chars = int(os.environ.get("RESPONSE_CACHE_MAX_CHARS", "20000000"))
+
+
+def make_cache_key(model, messages: list[dict], temperature, max_tokens) -> str:
+    raw = json.dumps(
+        [model, messages, temperature, max_tokens],
+        ensure_ascii=False,
+        separators=(",", ":"),
+    )
+    return hashlib.sha256(raw.encode()).hexdigest()
+
+
+class ResponseCache:
+    """
+    进程内 LRU，值是上游返回的分块列表，命中时按原来的分块逐个吐出
+    """
+
+    def __init__(self, maxsize: int, ttl: float, max_chars: int):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.max_chars = max_chars
+        self.hits = 0
+        self.misses = 0
+        self._chars = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return self.maxsize > 0
+
+    def get(self, key: str):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[1] < time.monotonic():
+                self._pop(key)
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key: str, chunks: list[str]):
+        size = sum(len(chunk) for chunk in chunks)
+        if size > self.max_chars:
+            return
+        with self._lock:
+            self._pop(key)
+            self._entries[key] = (tuple(chunks), time.monotonic() + self.ttl, size)
+            self._chars += size
+            while len(self._entries) > self.maxsize or self._chars > self.max_chars:
+                self._pop(next(iter(self._entries)))
+
+    def _pop(self, key: str):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._chars -= entry[2]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._chars = 0
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": self.hits / total if total else 0.0,
+            "entries": len(self._entries),
+            "chars": self._chars,
+            "maxsize": self.maxsize,
+        }
+
+
+response_cache = ResponseCache(
+    response_cache_size, response_cache_ttl, response_cache_max_chars
+)
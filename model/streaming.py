@@ -0,0 +1,199 @@
+import asyncio
+import logging
+import os
+from collections import deque
+from typing import NamedTuple
+
+from dotenv import load_dotenv
+
+load_dotenv()
+Logger = logging.getLogger(__name__)
+
+# 攒够这么多字节或者等够这么久就发一帧，避免每个 token 一次 send
+coalesce_bytes = int(os.environ.get("STREAM_COALESCE_BYTES", "32"))
+coalesce_delay = float(os.environ.get("STREAM_COALESCE_MS", "20")) / 1000
+# 长时间没有输出时发注释帧，防止代理把连接当成空闲断掉
+heartbeat_interval = float(os.environ.get("SSE_HEARTBEAT_INTERVAL", "15"))
+# 客户端中途断开时已生成的部分怎么处理：discard 丢弃，truncated 标记为不完整后保存
+partial_output_policy = os.environ.get("STREAM_PARTIAL_POLICY", "discard").lower()
+if partial_output_policy not in ("discard", "truncated"):
+    raise ValueError("STREAM_PARTIAL_POLICY 只能是 discard 或 truncated")
+
+STREAM_ERROR_MESSAGE = "[系统错误：生成过程中断，请重试]"
+SSE_HEADERS = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+HEARTBEAT_FRAME = ": ping\n\n"
+DONE_FRAME = "event: done\ndata: [DONE]\n\n"
+
+
+class StreamEvent(NamedTuple):
+    """
+    上游生成器里 yield 这个表示一条具名事件（比如排队位置），不参与合并，立即发出
+    """
+
+    event: str
+    data: str
+
+
+class StreamAbort(Exception):
+    """
+    带给用户看的提示的中断，sse_stream 会把 user_message 放进 error 事件
+    """
+
+    def __init__(self, user_message: str):
+        super().__init__(user_message)
+        self.user_message = user_message
+
+
+class StreamStats:
+    """
+    流式回复的结局统计；省下的 token 按已完成回复的平均长度减去断开时已生成的估算
+    """
+
+    def __init__(self):
+        self.completed = 0
+        self.cancelled = 0
+        self.errors = 0
+        self.completed_tokens = 0
+        self.cancelled_tokens = 0
+        self.tokens_saved = 0
+
+    def record_completed(self, tokens: int):
+        self.completed += 1
+        self.completed_tokens += tokens
+
+    def record_cancelled(self, tokens: int):
+        self.cancelled += 1
+        self.cancelled_tokens += tokens
+        if self.completed:
+            average = self.completed_tokens / self.completed
+            self.tokens_saved += max(0, round(average) - tokens)
+
+    def record_error(self):
+        self.errors += 1
+
+    def stats(self) -> dict:
+        return {
+            "completed": self.completed,
+            "cancelled": self.cancelled,
+            "errors": self.errors,
+            "cancelled_tokens": self.cancelled_tokens,
+            "tokens_saved_estimate": self.tokens_saved,
+            "partial_output_policy": partial_output_policy,
+        }
+
+
+stream_stats = StreamStats()
+
+
+def sse_frame(data: str, event: str | None = None) -> str:
+    """
+    按 SSE 规范组帧：多行内容每行一个 data: 前缀，客户端按换行拼回去
+    """
+    lines = [f"event: {event}"] if event else []
+    lines.extend(f"data: {line}" for line in data.split("\n"))
+    return "\n".join(lines) + "\n\n"
+
+
+async def sse_stream(
+    chunks,
+    max_bytes: int = coalesce_bytes,
+    max_delay: float = coalesce_delay,
+    heartbeat: float = heartbeat_interval,
+    receive=None,
+):
+    """
+    把上游的增量合并成 SSE 帧：缓冲区满 max_bytes 或第一段等了 max_delay 秒就发出，
+    空闲超过 heartbeat 秒发心跳；上游抛异常时先把已有内容发完再发 error 事件
+    传入 ASGI 的 receive 时会监听 http.disconnect，客户端一断开就取消上游
+    """
+    loop = asyncio.get_running_loop()
+    # 上游由单独的任务读进缓冲区，每个 token 只是 append，每帧才唤醒一次发送端
+    ready = asyncio.Event()
+    buffer = []
+    events = deque()
+    size = 0
+    timer = None
+    finished = False
+    disconnected = False
+    error = None
+
+    async def produce():
+        nonlocal size, timer, finished, error
+        try:
+            async for chunk in chunks:
+                if isinstance(chunk, StreamEvent):
+                    events.append(sse_frame(chunk.data, event=chunk.event))
+                    ready.set()
+                    continue
+                if not buffer:
+                    timer = loop.call_later(max_delay, ready.set)
+                buffer.append(chunk)
+                size += len(chunk.encode())
+                if size >= max_bytes:
+                    ready.set()
+        except Exception as e:
+            error = e
+        finally:
+            finished = True
+            ready.set()
+
+    async def watch_disconnect():
+        nonlocal disconnected
+        while (await receive())["type"] != "http.disconnect":
+            pass
+        disconnected = True
+        producer.cancel()
+        ready.set()
+
+    producer = asyncio.create_task(produce())
+    watcher = asyncio.create_task(watch_disconnect()) if receive else None
+    heartbeat_timer = None
+    try:
+        while True:
+            # 心跳也用定时器唤醒，不用每帧 wait_for 建一个任务
+            heartbeat_timer = loop.call_later(heartbeat, ready.set)
+            await ready.wait()
+            ready.clear()
+            heartbeat_timer.cancel()
+            if disconnected:
+                return
+            if timer is not None:
+                timer.cancel()
+                timer = None
+            done = finished
+            idle = not buffer and not events
+            if buffer:
+                data = "".join(buffer)
+                buffer.clear()
+                size = 0
+                yield sse_frame(data)
+            while events:
+                yield events.popleft()
+            if idle and not done:
+                yield HEARTBEAT_FRAME
+            if done:
+                break
+        if error is not None:
+            Logger.error(f"Stream Error: {error}")
+            message = (
+                error.user_message
+                if isinstance(error, StreamAbort)
+                else STREAM_ERROR_MESSAGE
+            )
+            yield sse_frame(message, event="error")
+            return
+        yield DONE_FRAME
+    finally:
+        for handle in (timer, heartbeat_timer):
+            if handle is not None:
+                handle.cancel()
+        # 客户端断开时 watch_disconnect 已经取消过上游，不再重复取消
+        if not producer.done() and not disconnected:
+            producer.cancel()
+        tasks = [producer]
+        if watcher is not None:
+            if not watcher.done():
+                watcher.cancel()
+            tasks.append(watcher)
+        # 等上游的清理（关连接、落库等）跑完再结束响应
+        await asyncio.gather(*tasks, return_exceptions=True)
@@ -0,0 +1,122 @@
+import os
+import logging
+
+from dotenv import load_dotenv
+
+from database.engine_creating import AsyncSessionLocal
+from database.async_management import AsyncConversationManagement
+from database.redis_client import get_async_redis
+from model.model import llm_client_manager
+
+load_dotenv()
+Logger = logging.getLogger(__name__)
+
+# 滚动摘要默认关闭，打开后消息数或 token 数超过阈值就把老消息折叠进摘要
+summary_enabled = os.environ.get("SUMMARY_ENABLED", "false").lower() == "true"
+summary_trigger_messages = int(os.environ.get("SUMMARY_TRIGGER_MESSAGES", "40"))
+summary_trigger_tokens = int(os.environ.get("SUMMARY_TRIGGER_TOKENS", "6000"))
+# 压缩后保留的原始消息条数，至少保留一轮（重新生成要删最后两条）
+summary_keep_recent = max(2, int(os.environ.get("SUMMARY_KEEP_RECENT", "10")))
+summary_model = os.environ.get("SUMMARY_MODEL", "deepseek-chat")
+
+SUMMARY_PROMPT = (
+    "你是对话摘要助手。请把下面的对话内容与已有摘要合并成一段新的摘要，"
+    "保留人物设定、用户偏好、关键事件和未完成的话题，不要编造，不超过500字。"
+)
+
+
+class LLMSummarizer:
+    """
+    默认的摘要器，复用共享的上游客户端；测试时可以用 set_summarizer 换成本地桩
+    只要实现 async summarize(previous_summary, messages) -> str 即可
+    """
+
+    def __init__(self, model: str = summary_model, max_tokens: int = 1024):
+        self.model = model
+        self.max_tokens = max_tokens
+
+    async def summarize(self, previous_summary: str | None, messages: list[dict]) -> str:
+        transcript = "\n".join(f"{m['role']}: {m['content']}" for m in messages)
+        if previous_summary:
+            transcript = f"已有摘要：{previous_summary}\n\n新的对话：\n{transcript}"
+        # 走 model_registry，摘要请求也能在上游故障时换一个
+        deltas = llm_client_manager.get_registry().stream(
+            self.model,
+            [
+                {"role": "system", "content": SUMMARY_PROMPT},
+                {"role": "user", "content": transcript},
+            ],
+            temperature=0.3,
+            max_tokens=self.max_tokens,
+        )
+        return "".join([delta async for delta in deltas])
+
+
+summarizer = LLMSummarizer()
+
+
+def set_summarizer(new_summarizer):
+    global summarizer
+    summarizer = new_summarizer
+
+
+def summary_message(summary) -> dict:
+    return {"role": "system", "content": f"以下是之前对话的摘要：{summary.content}"}
+
+
+async def _acquire_lock(chat_id: int) -> bool:
+    # 同一个对话同时只让一个 worker 压缩，Redis 不可用时直接放行
+    try:
+        return bool(
+            await get_async_redis().set(f"summary_lock:{chat_id}", 1, nx=True, ex=300)
+        )
+    except Exception:
+        return True
+
+
+async def _release_lock(chat_id: int):
+    try:
+        await get_async_redis().delete(f"summary_lock:{chat_id}")
+    except Exception:
+        pass
+
+
+async def maybe_compact_conversation(chat_id: int):
+    """
+    在响应发送完之后作为后台任务运行，不占用请求路径
+    读库和写库分两个会话，调用上游生成摘要时不占着数据库连接
+    """
+    if not summary_enabled:
+        return
+    async with AsyncSessionLocal() as db:
+        conversation_management = AsyncConversationManagement(db)
+        summary = await conversation_management.get_summary(chat_id)
+        after_id = summary.covered_until_id if summary else None
+        message_count, token_count = await conversation_management.get_uncompacted_stats(
+            chat_id, after_id
+        )
+        if message_count <= summary_keep_recent or (
+            message_count < summary_trigger_messages
+            and token_count < summary_trigger_tokens
+        ):
+            return
+        if not await _acquire_lock(chat_id):
+            return
+        rows = await conversation_management.get_uncompacted_messages(chat_id, after_id)
+        previous_summary = summary.content if summary else None
+    try:
+        to_fold = rows[:-summary_keep_recent]
+        if not to_fold:
+            return
+        content = await summarizer.summarize(
+            previous_summary,
+            [{"role": row.role, "content": row.content} for row in to_fold],
+        )
+        async with AsyncSessionLocal() as db:
+            await AsyncConversationManagement(db).save_summary(
+                chat_id, content, covered_until_id=to_fold[-1].id
+            )
+    except Exception as e:
+        Logger.error(f"Summarize chat {chat_id} failed: {e}")
+    finally:
+        await _release_lock(chat_id)
@@ -0,0 +1,53 @@
+import os
+import re
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# 各模型的上下文窗口（token），没列出来的用 DEFAULT_CONTEXT_WINDOW
+MODEL_CONTEXT_WINDOWS = {
+    "deepseek-chat": 65536,
+    "deepseek-reasoner": 65536,
+}
+default_context_window = int(os.environ.get("DEFAULT_CONTEXT_WINDOW", "32768"))
+# 历史记录最多占用的 token 数，避免长对话每条消息都把窗口塞满
+history_token_budget = int(os.environ.get("HISTORY_TOKEN_BUDGET", "8000"))
+# 每条消息的角色、分隔符等固定开销
+MESSAGE_OVERHEAD = 4
+
+# 中日韩字符大致一个字一个 token，其余按单词/符号切分后每 4 个字符算一个 token
+_token_pattern = re.compile(
+    r"[\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uac00-\ud7af\uf900-\ufaff]"
+    r"|[A-Za-z0-9_]+"
+    r"|[^\sA-Za-z0-9_]"
+)
+
+
+def count_tokens(text: str | None) -> int:
+    """
+    本地近似分词，不依赖具体模型的 tokenizer，偏差在可接受范围内
+    """
+    if not text:
+        return 0
+    tokens = 0
+    for piece in _token_pattern.findall(text):
+        if len(piece) > 1:
+            tokens += (len(piece) + 3) // 4
+        else:
+            tokens += 1
+    return tokens
+
+
+def count_message_tokens(content: str | None, token_count: int | None = None) -> int:
+    """
+    一条历史消息占用的 token：有落库时算好的 token_count 就直接用，再加上固定开销
+    """
+    if token_count is None:
+        token_count = count_tokens(content)
+    return token_count + MESSAGE_OVERHEAD
+
+
+def get_history_token_budget(model: str | None, max_tokens: int = 8192) -> int:
+    context_window = MODEL_CONTEXT_WINDOWS.get(model, default_context_window)
+    return max(0, min(context_window - max_tokens, history_token_budget))
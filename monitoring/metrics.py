@@ -0,0 +1,193 @@
+import os
+import time
+
+from dotenv import load_dotenv
+
+load_dotenv()
+# 多 worker 时每个进程把指标写进这个目录下的 mmap 文件，/metrics 读的时候再汇总
+# 必须在导入 prometheus_client 之前设置，目录在启动 uvicorn 之前清空（见 Dockerfile）
+multiproc_dir = os.environ.get("PROMETHEUS_MULTIPROC_DIR")
+if multiproc_dir:
+    os.makedirs(multiproc_dir, exist_ok=True)
+
+from prometheus_client import (
+    CollectorRegistry,
+    Counter,
+    Histogram,
+    REGISTRY,
+    CONTENT_TYPE_LATEST,
+    generate_latest,
+)
+from prometheus_client import multiprocess
+from sqlalchemy import event
+
+# 同一进程里最多给多少个模型名单独打标签，其余算 other，防止标签无限增长
+MAX_MODEL_LABELS = 20
+
+REQUEST_LATENCY = Histogram(
+    "http_request_duration_seconds",
+    "按路由统计的请求耗时（流式接口是整个流的时长）",
+    ["method", "route", "status"],
+)
+ENDPOINT_CACHE_REQUESTS = Counter(
+    "endpoint_cache_requests_total",
+    "按用户/对话缓存的接口响应：hit 命中，stale 过期后先返回旧值再后台刷新，miss 回源，error Redis 出错",
+    ["endpoint", "result"],
+)
+DB_QUERY_LATENCY = Histogram(
+    "db_query_duration_seconds",
+    "SQL 语句耗时",
+    ["engine", "operation"],
+    buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5),
+)
+DB_POOL_CHECKOUT_WAIT = Histogram(
+    "db_pool_checkout_wait_seconds",
+    "从连接池拿连接的等待时间",
+    ["engine"],
+    buckets=(0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5, 30),
+)
+LLM_TTFT = Histogram(
+    "llm_time_to_first_token_seconds",
+    "放行后到收到第一个增量的时间",
+    ["model"],
+    buckets=(0.05, 0.1, 0.25, 0.5, 1, 2, 4, 8, 15, 30, 60),
+)
+LLM_TOKENS_PER_SECOND = Histogram(
+    "llm_tokens_per_second",
+    "首个增量之后的生成速度",
+    ["model"],
+    buckets=(1, 5, 10, 20, 30, 50, 80, 120, 200, 400),
+)
+LLM_STREAM_DURATION = Histogram(
+    "llm_stream_duration_seconds",
+    "一次流式回复从放行到结束的时长",
+    ["model", "outcome"],
+    buckets=(0.5, 1, 2, 5, 10, 20, 30, 60, 120, 300),
+)
+
+_model_labels = set()
+
+
+def model_label(model: str) -> str:
+    if model in _model_labels:
+        return model
+    if len(_model_labels) < MAX_MODEL_LABELS:
+        _model_labels.add(model)
+        return model
+    return "other"
+
+
+def render_metrics() -> bytes:
+    if not multiproc_dir:
+        return generate_latest(REGISTRY)
+    registry = CollectorRegistry()
+    multiprocess.MultiProcessCollector(registry)
+    return generate_latest(registry)
+
+
+class MetricsMiddleware:
+    """
+    纯 ASGI 中间件，只在 send 上包一层取状态码，不缓冲响应体，流式接口照常工作
+    路由标签用路由模板（/admin/xxx），没匹配上的请求统一记成 unmatched
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        started = time.perf_counter()
+        status_code = 500
+
+        async def send_wrapper(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            route = scope.get("route")
+            path = getattr(route, "path", "unmatched")
+            REQUEST_LATENCY.labels(scope["method"], path, str(status_code)).observe(
+                time.perf_counter() - started
+            )
+
+
+def _operation(statement: str) -> str:
+    operation = statement.lstrip().split(None, 1)[0].upper() if statement.strip() else ""
+    if operation in ("SELECT", "INSERT", "UPDATE", "DELETE"):
+        return operation
+    return "OTHER"
+
+
+def instrument_engine(engine, name: str):
+    """
+    给同步引擎（异步引擎传 .sync_engine）挂上语句耗时和连接池等待的统计
+    """
+    query_latency = {
+        operation: DB_QUERY_LATENCY.labels(name, operation)
+        for operation in ("SELECT", "INSERT", "UPDATE", "DELETE", "OTHER")
+    }
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("query_started", []).append(time.perf_counter())
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        started = conn.info["query_started"].pop()
+        query_latency[_operation(statement)].observe(time.perf_counter() - started)
+
+    @event.listens_for(engine, "handle_error")
+    def handle_error(exception_context):
+        conn = exception_context.connection
+        if conn is not None and conn.info.get("query_started"):
+            conn.info["query_started"].pop()
+
+    # 连接池没有“开始等待”的事件，只能包一层 _do_get（QueuePool 在这里排队等连接）
+    pool = engine.pool
+    checkout_wait = DB_POOL_CHECKOUT_WAIT.labels(name)
+    do_get = pool._do_get
+
+    def timed_do_get():
+        started = time.perf_counter()
+        try:
+            return do_get()
+        finally:
+            checkout_wait.observe(time.perf_counter() - started)
+
+    pool._do_get = timed_do_get
+
+
+class StreamTimer:
+    """
+    一次流式回复的计时：start() 在放行后调用，每个增量调用 token()，结束时 finish()
+    """
+
+    def __init__(self, model: str):
+        self.model = model_label(model)
+        self.started = None
+        self.first_token_at = None
+
+    def start(self):
+        self.started = time.perf_counter()
+
+    def token(self):
+        if self.first_token_at is None and self.started is not None:
+            self.first_token_at = time.perf_counter()
+            LLM_TTFT.labels(self.model).observe(self.first_token_at - self.started)
+
+    def finish(self, outcome: str, tokens: int = 0):
+        if self.started is None:
+            return
+        now = time.perf_counter()
+        LLM_STREAM_DURATION.labels(self.model, outcome).observe(now - self.started)
+        if outcome == "completed" and tokens and self.first_token_at is not None:
+            elapsed = now - self.first_token_at
+            if elapsed > 0:
+                LLM_TOKENS_PER_SECOND.labels(self.model).observe(tokens / elapsed)
+
@@ -0,0 +1,178 @@
+import contextvars
+import logging
+import os
+import time
+from collections import Counter
+from contextlib import contextmanager
+
+from dotenv import load_dotenv
+from sqlalchemy import event
+
+load_dotenv()
+Logger = logging.getLogger(__name__)
+
+# off 不记录；log 每个请求记下所有 SQL，重复查询、N+1、超出预算时打日志；
+# strict 在 log 的基础上，超出预算直接抛 QueryBudgetExceeded（测试里用，请求会报错）
+profile_mode = os.environ.get("QUERY_PROFILE", "off").lower()
+if profile_mode not in ("off", "log", "strict"):
+    raise ValueError("QUERY_PROFILE 只能是 off、log 或 strict")
+# 同一条语句换着参数执行这么多次就当成 N+1
+n_plus_one_threshold = int(os.environ.get("QUERY_PROFILE_N_PLUS_ONE", "5"))
+
+_current_profile = contextvars.ContextVar("query_profile", default=None)
+
+
+class QueryBudgetExceeded(Exception):
+    pass
+
+
+def query_budget(limit: int):
+    """
+    声明路由一次请求最多执行几条 SQL（按缓存全部未命中的最坏情况算），
+    写在 @router.xxx 的正下方，只给函数打个标记，不包装
+    """
+
+    def decorator(func):
+        func.query_budget = limit
+        return func
+
+    return decorator
+
+
+def no_query_budget(reason: str):
+    """
+    SQL 条数随输入增长、没法给出上限的路由（比如批量导入），同样写在 @router.xxx 的正下方；
+    不检查预算，也不把按批重复的语句当成 N+1
+    """
+
+    def decorator(func):
+        func.query_budget = None
+        func.query_budget_exempt = reason
+        return func
+
+    return decorator
+
+
+class QueryProfile:
+    def __init__(self):
+        # (语句, 参数, 耗时秒)
+        self.queries = []
+
+    @property
+    def count(self) -> int:
+        return len(self.queries)
+
+    @property
+    def total_time(self) -> float:
+        return sum(duration for _, _, duration in self.queries)
+
+    def duplicates(self) -> list[tuple[str, int]]:
+        """
+        语句和参数都一样、执行了不止一次的
+        """
+        counts = Counter((statement, parameters) for statement, parameters, _ in self.queries)
+        return [(statement, n) for (statement, _), n in counts.items() if n > 1]
+
+    def repeated(self, threshold: int = n_plus_one_threshold) -> list[tuple[str, int]]:
+        """
+        同一条语句换着参数执行了 threshold 次以上的（典型的 N+1）
+        """
+        counts = Counter(statement for statement, _, _ in self.queries)
+        return [(statement, n) for statement, n in counts.items() if n >= threshold]
+
+    def summary(self) -> str:
+        lines = [f"{self.count} queries, {self.total_time * 1000:.1f} ms"]
+        for statement, parameters, duration in self.queries:
+            lines.append(f"  {duration * 1000:7.2f} ms  {statement[:200]}  {parameters[:100]}")
+        return "\n".join(lines)
+
+
+@contextmanager
+def profile_queries():
+    """
+    在当前上下文里记录所有 SQL，脚本或测试里直接用：
+    with profile_queries() as profile: ...; assert profile.count <= 3
+    """
+    profile = QueryProfile()
+    token = _current_profile.set(profile)
+    try:
+        yield profile
+    finally:
+        _current_profile.reset(token)
+
+
+def attach_profiler(engine):
+    """
+    给同步引擎（异步引擎传 .sync_engine）挂上按请求记录 SQL 的事件，没开 profile 时什么都不做
+    """
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        if _current_profile.get() is not None:
+            conn.info.setdefault("profile_started", []).append(time.perf_counter())
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        profile = _current_profile.get()
+        if profile is None or not conn.info.get("profile_started"):
+            return
+        started = conn.info["profile_started"].pop()
+        profile.queries.append(
+            (" ".join(statement.split()), repr(parameters), time.perf_counter() - started)
+        )
+
+    @event.listens_for(engine, "handle_error")
+    def handle_error(exception_context):
+        conn = exception_context.connection
+        if conn is not None and conn.info.get("profile_started"):
+            conn.info["profile_started"].pop()
+
+
+class QueryProfilerMiddleware:
+    """
+    每个请求一个 QueryProfile；响应头带上到目前为止的 X-Query-Count / X-Query-Time-Ms，
+    请求结束（包括流式响应和后台任务）后检查重复查询、N+1 和路由声明的预算
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        profile = QueryProfile()
+        token = _current_profile.set(profile)
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                headers = list(message.get("headers", []))
+                headers.append((b"x-query-count", str(profile.count).encode()))
+                headers.append(
+                    (b"x-query-time-ms", f"{profile.total_time * 1000:.1f}".encode())
+                )
+                message = {**message, "headers": headers}
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            _current_profile.reset(token)
+        self.check(scope, profile)
+
+    def check(self, scope, profile: QueryProfile):
+        route = scope.get("route")
+        path = getattr(route, "path", scope["path"])
+        endpoint = getattr(route, "endpoint", None)
+        for statement, n in profile.duplicates():
+            Logger.warning(f"[query profile] {path} ran the same query {n} times: {statement[:200]}")
+        if getattr(endpoint, "query_budget_exempt", None):
+            return
+        for statement, n in profile.repeated():
+            Logger.warning(f"[query profile] {path} possible N+1 ({n} times): {statement[:200]}")
+        budget = getattr(endpoint, "query_budget", None)
+        if budget is not None and profile.count > budget:
+            message = f"{path} ran {profile.count} queries, budget is {budget}\n{profile.summary()}"
+            Logger.error(f"[query profile] {message}")
+            if profile_mode == "strict":
+                raise QueryBudgetExceeded(message)
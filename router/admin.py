@@ -1,10 +1,15 @@
-from fastapi import APIRouter, HTTPException, status, Depends, Request
+from contextlib import contextmanager
+
+from fastapi import APIRouter, HTTPException, status, Depends, Request, UploadFile, File
+from fastapi.responses import StreamingResponse
 from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 
 from schemas.admin_schemas import (
     AdminCreateUserRequest,
     AdminDeleteUserRequest,
     AdminBanUserRequest,
+    AdminBulkUserRequest,
     AdminGetSoftDeletedUserRequest,
     AdminListAllUserRequest,
     AdminCreateCharacterRequest,
@@ -13,36 +18,65 @@ from schemas.admin_schemas import (
     AdminGetChatHistoryRequest,
     AdminNotAllowedWordRequestByID,
     AdminGetNotAllowedWordRequest,
+    AdminExportChatsRequest,
 )
 from schemas.admin_schemas import AdminDeleteConversationRequest
 from security.verification import get_current_admin
-from security.security import SecurityUtils
-from database.utils import get_db
+from security.password_pool import password_hash_pool
+from database.utils import get_db, get_async_db
+from database.async_management import AsyncUserManagement
 from database.management import (
     UserManagement,
     ConversationManagement,
     CharacterManagement,
     NotallowedWordManagement,
+    NotAllowedWordsUnavailable,
 )
 from security.limit_request import limiter
+from security.not_allowed_words import read_uploaded_words, compiled_matcher
+from monitoring.query_profiler import query_budget, no_query_budget
+from database.pagination import next_cursor
+from database.export import ChatExport, EXPORT_MEDIA_TYPE, EXPORT_HEADERS
+from model.model import llm_client_manager
+from model.registry import model_registry
+from model.response_cache import response_cache
+from model.streaming import stream_stats
+from model.admission import admission_controller
 
 router = APIRouter()
 
 
+@contextmanager
+def not_allowed_words_change():
+    """
+    包住违禁词的增删改：版本号没法递增时不写库、返回 503；
+    本 worker 的匹配器不等轮询，写完直接作废，下次检查按库里的重建
+    """
+    try:
+        yield
+    except NotAllowedWordsUnavailable:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="违禁词暂时无法同步到各服务，没有保存，请稍后再试",
+        )
+    finally:
+        compiled_matcher.invalidate()
+
+
 @router.post("/create_user")
+@query_budget(3)
 @limiter.limit("10/second")
-def create_user(
+async def create_user(
     request: Request,
     body: AdminCreateUserRequest,
     current_user=Depends(get_current_admin),
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
 ):
-    user_mananger = UserManagement(db)
-    password = SecurityUtils.get_password_hash(body.user_password)
+    user_mananger = AsyncUserManagement(db)
+    password = await password_hash_pool.hash(body.user_password)
     try:
-        success = user_mananger.create_user(name=body.user_name, password=password)
-        if success:
-            user = user_mananger.get_user_by_name(body.user_name)
+        user = await user_mananger.create_user(name=body.user_name, password=password)
+        if user:
             return {
                 "status": "ok",
                 "msg": "注册成功",
@@ -60,6 +94,7 @@ def create_user(
 
 
 @router.post("/soft_delete")
+@query_budget(4)
 @limiter.limit("10/second")
 def soft_delete_user(
     request: Request,
@@ -86,6 +121,7 @@ def soft_delete_user(
 
 
 @router.post("/undo_soft_delete")
+@query_budget(3)
 @limiter.limit("10/second")
 def undo_soft_delete_user(
     request: Request,
@@ -103,6 +139,7 @@ def undo_soft_delete_user(
 
 
 @router.delete("/true_delete", description="谨慎操作！！！！")
+@query_budget(8)
 @limiter.limit("10/second")
 def true_delete_user(
     request: Request,
@@ -120,6 +157,7 @@ def true_delete_user(
 
 
 @router.post("/ban")
+@query_budget(4)
 @limiter.limit("100/second")
 def ban_user(
     request: Request,
@@ -147,6 +185,7 @@ def ban_user(
 
 
 @router.post("/unban")
+@query_budget(3)
 @limiter.limit("100/second")
 def unban_user(
     request: Request,
@@ -164,7 +203,68 @@ def unban_user(
         return {"msg": "该用户已解封", "user_id": body.user_id}
 
 
+def bulk_update_users(db: Session, action: str, user_ids: list[int], msg: str):
+    outcomes = UserManagement(db).bulk_update_users(action, user_ids)
+    return {
+        "msg": msg,
+        "updated": sum(outcome == "ok" for outcome in outcomes.values()),
+        "results": [
+            {"user_id": user_id, "result": outcome}
+            for user_id, outcome in outcomes.items()
+        ],
+    }
+
+
+@router.post("/bulk_ban")
+@query_budget(3)
+@limiter.limit("10/second")
+def bulk_ban_users(
+    request: Request,
+    body: AdminBulkUserRequest,
+    current_user=Depends(get_current_admin),
+    db: Session = Depends(get_db),
+):
+    return bulk_update_users(db, "ban", body.user_ids, "批量封禁完成")
+
+
+@router.post("/bulk_unban")
+@query_budget(3)
+@limiter.limit("10/second")
+def bulk_unban_users(
+    request: Request,
+    body: AdminBulkUserRequest,
+    current_user=Depends(get_current_admin),
+    db: Session = Depends(get_db),
+):
+    return bulk_update_users(db, "unban", body.user_ids, "批量解封完成")
+
+
+@router.post("/bulk_soft_delete")
+@query_budget(3)
+@limiter.limit("10/second")
+def bulk_soft_delete_users(
+    request: Request,
+    body: AdminBulkUserRequest,
+    current_user=Depends(get_current_admin),
+    db: Session = Depends(get_db),
+):
+    return bulk_update_users(db, "soft_delete", body.user_ids, "批量软删除完成")
+
+
+@router.post("/bulk_undo_soft_delete")
+@query_budget(3)
+@limiter.limit("10/second")
+def bulk_undo_soft_delete_users(
+    request: Request,
+    body: AdminBulkUserRequest,
+    current_user=Depends(get_current_admin),
+    db: Session = Depends(get_db),
+):
+    return bulk_update_users(db, "undo_soft_delete", body.user_ids, "批量取消软删除完成")
+
+
 @router.post("/all_user")
+@query_budget(2)
 @limiter.limit("100/second")
 def list_all_user(
     request: Request,
@@ -174,13 +274,19 @@ def list_all_user(
 ):
     user_management = UserManagement(db)
     result_table = user_management.show_user(
-        page_size=body.page_size, page_number=body.page_number
+        page_size=body.page_size, page_number=body.page_number, cursor=body.cursor
     )
     data_list = [row._mapping for row in result_table]
+    if body.cursor is not None:
+        return {
+            "items": data_list,
+            "next_cursor": next_cursor(data_list, body.page_size, "user_id"),
+        }
     return data_list
 
 
 @router.post("/all_user_conversation")
+@query_budget(2)
 @limiter.limit("100/second")
 def list_all_users_conversation(
     request: Request,
@@ -190,13 +296,19 @@ def list_all_users_conversation(
 ):
     conversation_management = ConversationManagement(db)
     result_table = conversation_management.show_all_conversation(
-        page_size=body.page_size, page_number=body.page_number
+        page_size=body.page_size, page_number=body.page_number, cursor=body.cursor
     )
     data_list = [row._mapping for row in result_table]
+    if body.cursor is not None:
+        return {
+            "items": data_list,
+            "next_cursor": next_cursor(data_list, body.page_size, "id"),
+        }
     return data_list
 
 
 @router.post("/create_character")
+@query_budget(4)
 @limiter.limit("100/second")
 def create_character(
     request: Request,
@@ -206,7 +318,7 @@ def create_character(
 ):
     character_management = CharacterManagement(db)
     character = character_management.create_character(
-        body.character_name, body.system_prompt
+        body.character_name, body.system_prompt, cacheable=body.cacheable
     )
     if not character:
         raise HTTPException(
@@ -221,6 +333,7 @@ def create_character(
 
 
 @router.post("/delete_character")
+@query_budget(3)
 @limiter.limit("100/second")
 def delete_character(
     request: Request,
@@ -238,6 +351,8 @@ def delete_character(
 
 
 @router.post("/get_chat_history")
+# 对话已归档时多 5 条（锁对话、搬回、删归档、清标记，再查一次这一页）
+@query_budget(8)
 @limiter.limit("100/second")
 def admin_get_chat_history(
     request: Request,
@@ -246,16 +361,52 @@ def admin_get_chat_history(
     db: Session = Depends(get_db),
 ):
     conversation_management = ConversationManagement(db)
-    if not conversation_management.get_conversation(body.chat_id):
-        raise HTTPException(
-            status_code=status.HTTP_400_BAD_REQUEST, detail="对话不存在！"
+
+    def get_page():
+        return conversation_management.get_certain_history_chat(
+            body.chat_id,
+            page_size=body.page_size,
+            page_number=body.page_number,
+            cursor=body.cursor,
         )
-    return conversation_management.get_certain_history_chat(
-        body.chat_id, page_size=body.page_size, page_number=body.page_number
+
+    history_chat = get_page()
+    # 这一页有记录就说明对话存在，只有空页才再查一次；归档了的先搬回来再查
+    if not history_chat:
+        chat = conversation_management.get_conversation(body.chat_id)
+        if not chat:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST, detail="对话不存在！"
+            )
+        if conversation_management.rehydrate_conversation(chat):
+            history_chat = get_page()
+    if body.cursor is not None:
+        history_chat = history_chat or []
+        return {
+            "items": history_chat,
+            "next_cursor": next_cursor(
+                history_chat[::-1], body.page_size, "time", "id"
+            ),
+        }
+    return history_chat
+
+
+@router.post("/export_chats")
+@query_budget(3)
+@limiter.limit("5/minute")
+async def admin_export_chats(
+    request: Request,
+    body: AdminExportChatsRequest,
+    current_user=Depends(get_current_admin),
+):
+    export = ChatExport(user_id=body.user_id, chat_id=body.chat_id, cursor=body.cursor)
+    return StreamingResponse(
+        export.stream(), media_type=EXPORT_MEDIA_TYPE, headers=EXPORT_HEADERS
     )
 
 
 @router.post("/delete_conversation")
+@query_budget(6)
 @limiter.limit("100/second")
 def admin_delete_conversation(
     request: Request,
@@ -264,15 +415,15 @@ def admin_delete_conversation(
     db: Session = Depends(get_db),
 ):
     conversation_management = ConversationManagement(db)
-    if not conversation_management.get_conversation(body.chat_id):
+    if not conversation_management.delete_conversation(body.chat_id):
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST, detail="对话不存在！"
         )
-    conversation_management.delete_conversation(body.chat_id)
     return {"msg": "删除成功！"}
 
 
 @router.post("/get_softed_deleted_user")
+@query_budget(2)
 @limiter.limit("100/second")
 def get_softed_deleted_user(
     request: Request,
@@ -282,13 +433,19 @@ def get_softed_deleted_user(
 ):
     user_management = UserManagement(db)
     result_table = user_management.get_soft_deleted_users(
-        page_size=body.page_size, page_number=body.page_number
+        page_size=body.page_size, page_number=body.page_number, cursor=body.cursor
     )
     data_list = [row._mapping for row in result_table]
+    if body.cursor is not None:
+        return {
+            "items": data_list,
+            "next_cursor": next_cursor(data_list, body.page_size, "user_id"),
+        }
     return data_list
 
 
 @router.post("/get_not_allowed_words")
+@query_budget(2)
 @limiter.limit("100/second")
 def get_not_allowed_words(
     request: Request,
@@ -298,13 +455,19 @@ def get_not_allowed_words(
 ):
     not_allowed_word_management = NotallowedWordManagement(db)
     result_table = not_allowed_word_management.get_not_allowed_words(
-        page_size=body.page_size, page_number=body.page_number
+        page_size=body.page_size, page_number=body.page_number, cursor=body.cursor
     )
     data_list = [row._mapping for row in result_table]
+    if body.cursor is not None:
+        return {
+            "items": data_list,
+            "next_cursor": next_cursor(data_list, body.page_size, "id"),
+        }
     return data_list
 
 
 @router.post("/add_not_allowed_word")
+@query_budget(3)
 @limiter.limit("100/second")
 def add_not_allowed_word(
     request: Request,
@@ -313,7 +476,9 @@ def add_not_allowed_word(
     db: Session = Depends(get_db),
 ):
     not_allowed_word_management = NotallowedWordManagement(db)
-    if not not_allowed_word_management.create_not_allowed_word(body.word):
+    with not_allowed_words_change():
+        created = not_allowed_word_management.create_not_allowed_word(body.word)
+    if not created:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST, detail="该单词已存在！"
         )
@@ -322,6 +487,7 @@ def add_not_allowed_word(
 
 
 @router.post("/delete_not_allowed_word")
+@query_budget(3)
 @limiter.limit("100/second")
 def delete_not_allowed_word(
     request: Request,
@@ -330,11 +496,52 @@ def delete_not_allowed_word(
     db: Session = Depends(get_db),
 ):
     not_allowed_word_management = NotallowedWordManagement(db)
-    if not not_allowed_word_management.delete_not_allowed_word(
-        body.not_allowed_word_id
-    ):
+    with not_allowed_words_change():
+        deleted = not_allowed_word_management.delete_not_allowed_word(
+            body.not_allowed_word_id
+        )
+    if not deleted:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST, detail="该单词不存在！"
         )
     else:
         return {"msg": "该单词已删除！"}
+
+
+@router.get("/llm_status")
+@query_budget(1)
+@limiter.limit("100/second")
+def get_llm_status(
+    request: Request,
+    create_user=Depends(get_current_admin),
+):
+    return {
+        "pool": llm_client_manager.pool_stats(),
+        "response_cache": response_cache.stats(),
+        "streams": stream_stats.stats(),
+        "admission": admission_controller.stats(),
+        "upstreams": model_registry.stats(),
+    }
+
+
+@router.post("/import_not_allowed_words")
+@no_query_budget("每 1000 个词一条 INSERT，条数随上传文件的大小增长")
+@limiter.limit("1/second")
+def import_not_allowed_words(
+    request: Request,
+    file: UploadFile = File(..., description=".csv 取第一列，其他按一行一个词，UTF-8 编码"),
+    create_user=Depends(get_current_admin),
+    db: Session = Depends(get_db),
+):
+    not_allowed_word_management = NotallowedWordManagement(db)
+    try:
+        with not_allowed_words_change():
+            stats = not_allowed_word_management.import_not_allowed_words(
+                read_uploaded_words(file.file, file.filename or "")
+            )
+    except UnicodeDecodeError:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="文件不是 UTF-8 编码，解码失败之前的词已经导入",
+        )
+    return {"msg": "违禁词导入完成", **stats}
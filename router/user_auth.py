@@ -1,25 +1,27 @@
 from fastapi import APIRouter, Depends, HTTPException, status, Request
 from fastapi.security import OAuth2PasswordRequestForm
-from sqlalchemy.orm import Session
-from database.utils import get_db
-from database.management import UserManagement
+from sqlalchemy.ext.asyncio import AsyncSession
+from database.utils import get_async_db
+from database.async_management import AsyncUserManagement
 from schemas.user_schemas import UserRegisterRequest, UserLoginRequest
 from security.security import SecurityUtils
+from security.password_pool import password_hash_pool
 from security.limit_request import limiter
+from monitoring.query_profiler import query_budget
 from security.captcha import captcha_manager
-from fastapi.responses import StreamingResponse
-import io
+from fastapi.responses import Response
 
 router = APIRouter()
 
 
 @router.get("/captcha")
+@query_budget(0)
 @limiter.limit("60/minute")
-def get_captcha(request: Request):
+async def get_captcha(request: Request):
     """获取图形验证码"""
-    data = captcha_manager.generate_captcha()
-    # 返回图片流
-    return StreamingResponse(
+    data = await captcha_manager.generate_captcha()
+    # 图片是预先生成好的 PNG 字节，直接返回
+    return Response(
         data["image_data"],
         media_type="image/png",
         headers={"X-Captcha-ID": data["captcha_id"]},
@@ -27,22 +29,26 @@ def get_captcha(request: Request):
 
 
 @router.post("/register")
+@query_budget(2)
 @limiter.limit("40/second")
-def register_user(
-    request: Request, user_data: UserRegisterRequest, db: Session = Depends(get_db)
+async def register_user(
+    request: Request,
+    user_data: UserRegisterRequest,
+    db: AsyncSession = Depends(get_async_db),
 ):
     # 验证图形验证码
-    if not captcha_manager.verify_captcha(user_data.captcha_id, user_data.captcha_code):
+    if not await captcha_manager.verify_captcha(user_data.captcha_id, user_data.captcha_code):
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST, detail="验证码错误或已过期"
         )
 
-    user_mananger = UserManagement(db)
-    password = SecurityUtils.get_password_hash(user_data.user_password)
+    user_mananger = AsyncUserManagement(db)
+    password = await password_hash_pool.hash(user_data.user_password)
     try:
-        success = user_mananger.create_user(name=user_data.user_name, password=password)
-        if success:
-            user = user_mananger.get_user_by_name(user_data.user_name)
+        user = await user_mananger.create_user(
+            name=user_data.user_name, password=password
+        )
+        if user:
             return {
                 "status": "ok",
                 "msg": "注册成功",
@@ -60,19 +66,20 @@ def register_user(
 
 
 @router.post("/login")
+@query_budget(1)
 @limiter.limit("80/second")
-def login(
+async def login(
     request: Request,
     form_data: OAuth2PasswordRequestForm = Depends(),
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
 ):
-    user_mananger = UserManagement(db)
-    user = user_mananger.get_user_by_name(form_data.username)
+    user_mananger = AsyncUserManagement(db)
+    user = await user_mananger.get_user_by_name(form_data.username)
     user_password = form_data.password
     if (
         not user
         or user.is_deleted
-        or not SecurityUtils.verify_password(
+        or not await password_hash_pool.verify(
             user_password, hashed_password=user.password
         )
     ):
@@ -1,12 +1,27 @@
+import asyncio
+import logging
+
 from fastapi import APIRouter, Depends, HTTPException, status, Request
-from fastapi.responses import StreamingResponse
-from fastapi_cache.decorator import cache
-from fastapi.concurrency import run_in_threadpool
-from sqlalchemy.orm import Session
+from fastapi.responses import StreamingResponse, Response
+from starlette.background import BackgroundTask
+from sqlalchemy.ext.asyncio import AsyncSession
 
 from security.verification import get_current_user
-from database.management import ConversationManagement, CharacterManagement
-from database.utils import get_db
+from database.async_management import (
+    AsyncConversationManagement,
+    AsyncCharacterManagement,
+)
+from database.utils import get_async_db
+from database.character_registry import character_registry
+from database.engine_creating import AsyncSessionLocal
+from database.pagination import next_cursor
+from database.export import ChatExport, EXPORT_MEDIA_TYPE, EXPORT_HEADERS
+from database.endpoint_cache import (
+    endpoint_cache,
+    CHARACTERS_TAG,
+    user_conversations_tag,
+    chat_tag,
+)
 from schemas.user_conversation_schemas import (
     NewConversationCreateRequest,
     MessageRequest,
@@ -14,32 +29,68 @@ from schemas.user_conversation_schemas import (
     GetCurrentUserRequest,
     GetChatHistoryRequest,
     DeleteConversationRequest,
+    ExportChatsRequest,
 )
 from model.model import CyreneLLMModel
+from model.tokenizer import count_tokens, get_history_token_budget
+from model.streaming import (
+    sse_stream,
+    stream_stats,
+    partial_output_policy,
+    StreamEvent,
+    SSE_HEADERS,
+)
+from model.admission import admission_controller
+from model.registry import model_registry
+from monitoring.metrics import StreamTimer
+from monitoring.query_profiler import query_budget
+from model.summarizer import (
+    summary_enabled,
+    summary_message,
+    maybe_compact_conversation,
+)
 from security.limit_request import limiter
 from security.not_allowed_words import not_allowed_word
 
 router = APIRouter()
+Logger = logging.getLogger(__name__)
+# 正在落库的任务，保留引用防止被回收
+_pending_writes = set()
+
+
+async def persist_turn_shielded(**kwargs):
+    """
+    落库放到独立任务和独立会话里，客户端断开取消生成器时也会写完
+    """
+
+    async def persist():
+        async with AsyncSessionLocal() as session:
+            await AsyncConversationManagement(session).persist_turn(**kwargs)
+
+    task = asyncio.ensure_future(persist())
+    _pending_writes.add(task)
+    task.add_done_callback(_pending_writes.discard)
+    await asyncio.shield(task)
 
 
 @router.post("/create_chat")
+@query_budget(3)
 @limiter.limit("10/second")
-def new_conversation(
+async def new_conversation(
     request: Request,
     body: NewConversationCreateRequest,
     current_user=Depends(get_current_user),
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
 ):
-    character_management = CharacterManagement(db)
-    character_name_out = character_management.get_character_by_name(body.character_name)
-    if not character_name_out:
+    character = await character_registry.get_by_name(body.character_name, db)
+    if not character:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND, detail="该角色不存在！"
         )
-    conversation_management = ConversationManagement(db)
+    conversation_management = AsyncConversationManagement(db)
     chat_name = f"{body.character_name}_{body.chat_name}"
-    new_chat = conversation_management.create_conversation(
-        current_user.user_id, chat_name
+    new_chat = await conversation_management.create_conversation(
+        current_user.user_id, chat_name, character_id=character.id
     )
     return {
         "msg": "创建成功！",
@@ -51,164 +102,322 @@ def new_conversation(
 
 
 @router.post("/send_message")
+# 对话已归档时多 4 条（锁对话、搬回、删归档、清标记）
+@query_budget(18)
 @limiter.limit("15/minute")
 async def send_message_stream(
     request: Request,
     body: MessageRequest,
     current_user=Depends(get_current_user),
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
 ):
-    try:
-        found_word = await run_in_threadpool(
-            not_allowed_word.check_message, body.message, db
+    if not model_registry.supports(body.model):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST, detail="不支持的模型"
         )
-        if found_word:
-            raise HTTPException(
-                status_code=status.HTTP_400_BAD_REQUEST,
-                detail=f"对不起，存在违禁词！打回！",
-            )
+    try:
+        found_word = await not_allowed_word.check_message_async(body.message, db)
     except Exception as e:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail="抱歉，违禁词还没更新，稍后再试",
         )
-    conversation_management = ConversationManagement(db)
-    character_management = CharacterManagement(db)
-    chat = await run_in_threadpool(
-        conversation_management.get_conversation, body.chat_id
-    )
-    if chat.user_id != current_user.user_id:
+    if found_word:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"对不起，存在违禁词！打回！",
+        )
+    conversation_management = AsyncConversationManagement(db)
+    chat = await conversation_management.get_conversation(body.chat_id)
+    if not chat or chat.user_id != current_user.user_id:
         raise HTTPException(
             status_code=status.HTTP_403_FORBIDDEN, detail="无权访问此对话"
         )
-    if body.whether_regenerate:
-        await run_in_threadpool(
-            conversation_management.remove_recent_message, body.chat_id
+    # 归档了的对话先把聊天记录搬回来
+    await conversation_management.rehydrate_conversation(chat)
+    # 角色从进程内注册表取，不查库；角色被删了的对话不能再聊
+    character = None
+    if chat.character_id is not None:
+        character = await character_registry.get(chat.character_id, db)
+    if not character:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND, detail="该角色不存在！"
         )
-    await run_in_threadpool(
-        conversation_management.send_user_content,
-        body.chat_id,
-        history_chat=[{"role": "user", "content": body.message}],
-    )
-    system_prompt = character_management.get_character_by_name(
-        chat.title.split("_")[0]
-    ).system_prompt
-    history_chat = await run_in_threadpool(
-        conversation_management.get_history_chat, body.chat_id
+    system_prompt = character.system_prompt
+    token_budget = (
+        get_history_token_budget(body.model)
+        - count_tokens(system_prompt)
+        - count_tokens(body.message)
     )
+    summary = None
+    if summary_enabled:
+        summary = await conversation_management.get_summary(body.chat_id)
+    if summary:
+        # 有摘要时只发摘要 + 摘要之后的消息
+        token_budget -= summary.token_count
+        history_chat = await conversation_management.get_history_chat(
+            body.chat_id, token_budget=token_budget, after_id=summary.covered_until_id
+        )
+    else:
+        history_chat = await conversation_management.get_history_chat(
+            body.chat_id, token_budget=token_budget
+        )
+    if body.whether_regenerate:
+        # 重新生成：上一轮在落库时才删，这里先从上下文里去掉
+        history_chat = history_chat[:-2]
+    if summary:
+        history_chat.insert(0, summary_message(summary))
+    # 结束只读事务，流式输出期间不占着数据库连接
+    await db.commit()
     try:
         dialog = await CyreneLLMModel.create_dialog(
             system_prompt, history_chat=history_chat, model=body.model
         )
-        stream_response = dialog.chatting(contents=body.message, model=body.model)
-    except Exception as e:
-        await run_in_threadpool(
-            conversation_management.remove_recent_message, body.chat_id
+        stream_response = dialog.chatting(
+            contents=body.message,
+            model=body.model,
+            temperature=1.0 if body.temperature is None else body.temperature,
+            # 重新生成就是想要不一样的回复，不回放 cacheable 角色的缓存
+            cacheable=character.cacheable and not body.whether_regenerate,
         )
+    except Exception as e:
         raise HTTPException(
             status_code=status.HTTP_451_UNAVAILABLE_FOR_LEGAL_REASONS, detail="内部错误"
         )
 
+    admission = admission_controller.ticket(body.model, current_user.user_id)
+    timer = StreamTimer(body.model)
+
     async def router_generator():
+        received = []
         try:
+            # 上游并发满了就排队，排队期间把位置推给前端
+            async for position in admission.positions():
+                yield StreamEvent("queue", str(position))
+            timer.start()
             async for chunk in stream_response:
+                timer.token()
+                received.append(chunk)
                 yield chunk
-            final_history = dialog.history_chat
-            await run_in_threadpool(
-                conversation_management.update_history_chat, body.chat_id, final_history
-            )
-            print(f"Chat {body.chat_id} history saved.")
-        except Exception as e:
-            print(f"Stream Error: {e}")
-            yield "\n\n[系统错误：生成过程中断，请重试]"
-            await run_in_threadpool(
-                conversation_management.remove_recent_message, body.chat_id
-            )
+        except asyncio.CancelledError:
+            # 客户端断开：上游连接已在 chatting 里关掉，按策略处理已生成的部分
+            partial = "".join(received)
+            stream_stats.record_cancelled(count_tokens(partial))
+            timer.finish("cancelled")
+            Logger.info(f"Chat {body.chat_id} stream cancelled by client.")
+            if partial and partial_output_policy == "truncated":
+                await persist_turn_shielded(
+                    chat_id=body.chat_id,
+                    user_content=body.message,
+                    assistant_content=partial,
+                    regenerate=body.whether_regenerate,
+                    truncated=True,
+                    user_id=current_user.user_id,
+                )
+            raise
+        except Exception:
+            stream_stats.record_error()
+            timer.finish("error")
+            raise
+        finally:
+            await admission.release()
+        # 用户消息和回复在生成成功后一次性落库，失败时什么都不用回滚
+        content = dialog.history_chat[-1]["content"]
+        tokens = count_tokens(content)
+        stream_stats.record_completed(tokens)
+        timer.finish("completed", tokens)
+        await persist_turn_shielded(
+            chat_id=body.chat_id,
+            user_content=body.message,
+            assistant_content=content,
+            regenerate=body.whether_regenerate,
+            user_id=current_user.user_id,
+        )
+        Logger.info(f"Chat {body.chat_id} history saved.")
 
-    return StreamingResponse(router_generator(), media_type="text/event-stream")
+    # 合并增量并按 SSE 组帧，出错时由 sse_stream 发 error 事件，客户端断开时取消上游
+    return StreamingResponse(
+        sse_stream(router_generator(), receive=request.receive),
+        media_type="text/event-stream",
+        headers=SSE_HEADERS,
+        background=BackgroundTask(maybe_compact_conversation, body.chat_id),
+    )
 
 
 @router.post("/get_character_name")
+@query_budget(2)
 @limiter.limit("30/second")
-@cache(expire=300)  # 缓存5分钟
 async def list_all_character(
     request: Request,
+    response: Response,
     body: GetCharacterRequest,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
     current_user=Depends(get_current_user),
 ):
-    current_user = current_user  # 水了个代码
-    charater_management = CharacterManagement(db)
-    result_table = charater_management.get_character(
-        page_size=body.page_size, page_number=body.page_number
+    async def compute(session: AsyncSession):
+        result_table = await AsyncCharacterManagement(session).get_character(
+            page_size=body.page_size, page_number=body.page_number, cursor=body.cursor
+        )
+        data_list = [dict(row._mapping) for row in result_table]
+        if body.cursor is not None:
+            return {
+                "items": data_list,
+                "next_cursor": next_cursor(data_list, body.page_size, "id"),
+            }
+        return data_list
+
+    # 角色列表所有人都一样，键里不带用户
+    return await endpoint_cache.fetch(
+        "get_character_name",
+        [body.page_size, body.page_number, body.cursor],
+        [CHARACTERS_TAG],
+        300,
+        compute,
+        db,
+        response,
     )
-    data_list = [row._mapping for row in result_table]
-    return data_list
 
 
 @router.post("/get_current_user_conversation")
+@query_budget(2)
 @limiter.limit("15/second")
-@cache(expire=30)  # 缓存30秒
 async def list_current_conversation(
     request: Request,
+    response: Response,
     body: GetCurrentUserRequest,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
     current_user=Depends(get_current_user),
 ):
     user_id = current_user.user_id
-    conversation_management = ConversationManagement(db)
-    result_table = conversation_management.show_user_conversation(
-        user_id, page_size=body.page_size, page_number=body.page_number
+
+    async def compute(session: AsyncSession):
+        result_table = await AsyncConversationManagement(
+            session
+        ).show_user_conversation(
+            user_id,
+            page_size=body.page_size,
+            page_number=body.page_number,
+            cursor=body.cursor,
+        )
+        data_list = [dict(row._mapping) for row in result_table]
+        if body.cursor is not None:
+            return {
+                "items": data_list,
+                "next_cursor": next_cursor(
+                    data_list, body.page_size, "updated_at", "id"
+                ),
+            }
+        return [data_list]
+
+    return await endpoint_cache.fetch(
+        "get_current_user_conversation",
+        [user_id, body.page_size, body.page_number, body.cursor],
+        [user_conversations_tag(user_id)],
+        30,
+        compute,
+        db,
+        response,
     )
-    data_list = [row._mapping for row in result_table]
-    return [data_list]
 
 
 @router.post("/get_chat_history")
+# 对话已归档时多 4 条（锁对话、搬回、删归档、清标记）
+@query_budget(7)
 @limiter.limit("100/second")
-@cache(expire=10)  # 缓存10秒
 async def get_chat_history(
     request: Request,
+    response: Response,
     body: GetChatHistoryRequest,
     current_user=Depends(get_current_user),
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
 ):
-    conversation_management = ConversationManagement(db)
-    if not conversation_management.get_conversation(body.chat_id):
-        raise HTTPException(
-            status_code=status.HTTP_400_BAD_REQUEST, detail="对话不存在！"
-        )
-    if (
-        conversation_management.get_conversation(body.chat_id).user_id
-        != current_user.user_id
-    ):
-        raise HTTPException(
-            status_code=status.HTTP_400_BAD_REQUEST, detail="你偷看别人聊天记录干嘛？"
+    user_id = current_user.user_id
+
+    async def compute(session: AsyncSession):
+        conversation_management = AsyncConversationManagement(session)
+        chat = await conversation_management.get_conversation(body.chat_id)
+        if not chat:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST, detail="对话不存在！"
+            )
+        if chat.user_id != user_id:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="你偷看别人聊天记录干嘛？",
+            )
+        await conversation_management.rehydrate_conversation(chat)
+        history_chat = await conversation_management.get_certain_history_chat(
+            body.chat_id,
+            page_size=body.page_size,
+            page_number=body.page_number,
+            cursor=body.cursor,
         )
-    return conversation_management.get_certain_history_chat(
-        body.chat_id, page_size=body.page_size, page_number=body.page_number
+        if body.cursor is not None:
+            # 每页内部是从旧到新，下一页从本页最早的一条继续往前翻
+            history_chat = history_chat or []
+            return {
+                "items": history_chat,
+                "next_cursor": next_cursor(
+                    history_chat[::-1], body.page_size, "time", "id"
+                ),
+            }
+        return history_chat
+
+    # 键里带着用户，只有对话主人能命中；归属检查在回源里做，没权限的请求不会被缓存
+    return await endpoint_cache.fetch(
+        "get_chat_history",
+        [user_id, body.chat_id, body.page_size, body.page_number, body.cursor],
+        [chat_tag(body.chat_id)],
+        10,
+        compute,
+        db,
+        response,
+    )
+
+
+@router.post("/export_chats")
+@query_budget(4)
+@limiter.limit("5/minute")
+async def export_chats(
+    request: Request,
+    body: ExportChatsRequest,
+    current_user=Depends(get_current_user),
+    db: AsyncSession = Depends(get_async_db),
+):
+    if body.chat_id is not None:
+        chat = await AsyncConversationManagement(db).get_conversation(body.chat_id)
+        if not chat or chat.user_id != current_user.user_id:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST, detail="对话不存在！"
+            )
+    export = ChatExport(
+        user_id=current_user.user_id, chat_id=body.chat_id, cursor=body.cursor
+    )
+    return StreamingResponse(
+        export.stream(), media_type=EXPORT_MEDIA_TYPE, headers=EXPORT_HEADERS
     )
 
 
 @router.post("/delete_conversation")
+@query_budget(6)
 @limiter.limit("10/second")
-def delete_conversation(
+async def delete_conversation(
     request: Request,
     body: DeleteConversationRequest,
     current_user=Depends(get_current_user),
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
 ):
-    conversation_management = ConversationManagement(db)
-    if not conversation_management.get_conversation(body.chat_id):
+    conversation_management = AsyncConversationManagement(db)
+    chat = await conversation_management.get_conversation(body.chat_id)
+    if not chat:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST, detail="对话不存在！"
         )
-    if (
-        conversation_management.get_conversation(body.chat_id).user_id
-        != current_user.user_id
-    ):
+    if chat.user_id != current_user.user_id:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST, detail="你偷看别人聊天记录干嘛？"
         )
-    conversation_management.delete_conversation(body.chat_id)
+    await conversation_management.delete_conversation(
+        body.chat_id, user_id=current_user.user_id
+    )
     return {"msg": "删除成功！"}
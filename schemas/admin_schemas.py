@@ -1,5 +1,9 @@
+from typing import Optional
+
 from pydantic import BaseModel, Field
 
+from .pagination import CursorField, ExportCursorField
+
 
 class AdminCreateUserRequest(BaseModel):
     user_name: str
@@ -14,14 +18,22 @@ class AdminBanUserRequest(BaseModel):
     user_id: int
 
 
+class AdminBulkUserRequest(BaseModel):
+    user_ids: list[int] = Field(..., min_length=1, max_length=1000, description="一次最多 1000 个")
+
+
 class AdminListAllUserRequest(BaseModel):
     page_size: int = Field(default=10, ge=1, le=100, description="每页条数")
     page_number: int = Field(default=1, ge=1, description="当前页码")
+    cursor: CursorField = None
 
 
 class AdminCreateCharacterRequest(BaseModel):
     character_name: str
     system_prompt: str
+    cacheable: bool = Field(
+        default=False, description="固定开场白之类的确定性角色，相同请求复用缓存的回复"
+    )
 
 
 class AdminDeleteCharacterRequest(BaseModel):
@@ -32,11 +44,13 @@ class AdminGetChatHistoryRequest(BaseModel):
     chat_id: int
     page_size: int = Field(default=10, ge=1, le=100, description="每页条数")
     page_number: int = Field(default=1, ge=1, description="当前页码")
+    cursor: CursorField = None
 
 
 class AdminGetSoftDeletedUserRequest(BaseModel):
     page_size: int = Field(default=10, ge=1, le=100, description="每页条数")
     page_number: int = Field(default=1, ge=1, description="当前页码")
+    cursor: CursorField = None
 
 
 class AdminNotAllowedWordRequest(BaseModel):
@@ -50,7 +64,14 @@ class AdminNotAllowedWordRequestByID(BaseModel):
 class AdminGetNotAllowedWordRequest(BaseModel):
     page_size: int = Field(default=10, ge=1, le=100, description="每页条数")
     page_number: int = Field(default=1, ge=1, description="当前页码")
+    cursor: CursorField = None
 
 
 class AdminDeleteConversationRequest(BaseModel):
     chat_id: int
+
+
+class AdminExportChatsRequest(BaseModel):
+    user_id: Optional[int] = Field(default=None, description="只导出这个用户的，不传导出全部")
+    chat_id: Optional[int] = Field(default=None, description="只导出这个对话")
+    cursor: ExportCursorField = None
@@ -0,0 +1,14 @@
+from typing import Annotated, Optional
+
+from pydantic import Field
+
+# 列表接口的游标参数，用法：cursor: CursorField = None
+CursorField = Annotated[
+    Optional[str],
+    Field(description="游标分页：首页传空字符串，之后传上一页返回的 next_cursor；不传则按页码分页"),
+]
+# 导出接口的断点续传游标
+ExportCursorField = Annotated[
+    Optional[str],
+    Field(description="断点续传：传上次收到的最后一行里的 cursor，不传从头导出"),
+]
@@ -1,5 +1,9 @@
+from typing import Optional
+
 from pydantic import BaseModel, Field
 
+from .pagination import CursorField, ExportCursorField
+
 
 class NewConversationCreateRequest(BaseModel):
     chat_name: str
@@ -11,23 +15,34 @@ class MessageRequest(BaseModel):
     chat_id: int
     model: str
     whether_regenerate: bool
+    temperature: Optional[float] = Field(
+        default=None, ge=0, le=2, description="采样温度，不传用模型默认值；为 0 时相同请求会复用缓存的回复"
+    )
 
 
 class GetCharacterRequest(BaseModel):
     page_size: int = Field(default=10, ge=1, le=100, description="每页条数")
     page_number: int = Field(default=1, ge=1, description="当前页码")
+    cursor: CursorField = None
 
 
 class GetCurrentUserRequest(BaseModel):
     page_size: int = Field(default=10, ge=1, le=100, description="每页条数")
     page_number: int = Field(default=1, ge=1, description="当前页码")
+    cursor: CursorField = None
 
 
 class GetChatHistoryRequest(BaseModel):
     chat_id: int
     page_size: int = Field(default=10, ge=1, le=100, description="每页条数")
     page_number: int = Field(default=1, ge=1, description="当前页码")
+    cursor: CursorField = None
 
 
 class DeleteConversationRequest(BaseModel):
     chat_id: int
+
+
+class ExportChatsRequest(BaseModel):
+    chat_id: Optional[int] = Field(default=None, description="只导出这个对话，不传导出自己的全部对话")
+    cursor: ExportCursorField = None
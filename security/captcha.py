@@ -1,65 +1,103 @@
+import asyncio
+import logging
+import os
 import random
 import string
 import uuid
-import os
-import redis
+
 from captcha.image import ImageCaptcha
 from dotenv import load_dotenv
+from fastapi.concurrency import run_in_threadpool
+
+from database.redis_client import get_async_redis
 
 load_dotenv()
+Logger = logging.getLogger(__name__)
+# 预先生成好的验证码个数（每个 worker）
+captcha_pool_size = int(os.environ.get("CAPTCHA_POOL_SIZE", "200"))
 
 
 class CaptchaManager:
-    def __init__(self):
+    def __init__(self, pool_size: int = 200):
         self.image = ImageCaptcha(width=160, height=60)
-        self.redis_client = redis.from_url(
-            os.environ.get("REDIS_URL", "redis://localhost:6379/0"),
-            decode_responses=True,
-        )
         self.ttl = 300  # 5 minutes
+        self.pool_size = pool_size
+        self._pool = None
+        self._producer = None
 
-    def generate_captcha(self) -> dict:
+    def render(self) -> tuple[str, bytes]:
         """
-        生成验证码
-        :return: {"captcha_id": str, "image_base64": bytes}
+        生成 4 位随机字符和对应的 PNG，纯 CPU 活，不要在事件循环里直接调
         """
-        # 1. 生成 4 位随机字符
         characters = string.digits + string.ascii_uppercase
         code = "".join(random.choices(characters, k=4))
-
-        # 2. 生成图片
         image_data = self.image.generate(code)
-        image_data.seek(0)
+        return code, image_data.getvalue()
+
+    async def _produce(self):
+        while True:
+            try:
+                code, image = await run_in_threadpool(self.render)
+            except Exception as e:
+                Logger.error(f"Captcha render failed: {e}")
+                await asyncio.sleep(1)
+                continue
+            # 池子满了就在这里等，有人取走才继续生成
+            await self._pool.put((code, image))
+
+    def start(self):
+        """
+        在 lifespan 里启动后台生产者，把验证码池补满
+        """
+        if self._producer is None:
+            self._pool = asyncio.Queue(maxsize=self.pool_size)
+            self._producer = asyncio.create_task(self._produce())
+
+    async def stop(self):
+        if self._producer is not None:
+            self._producer.cancel()
+            try:
+                await self._producer
+            except asyncio.CancelledError:
+                pass
+        self._producer = None
+        self._pool = None
+
+    async def generate_captcha(self) -> dict:
+        """
+        从池子里取一个验证码，池子空了（或者没启动）才现场生成
+        :return: {"captcha_id": str, "image_data": bytes}
+        """
+        try:
+            code, image = self._pool.get_nowait()
+        except (asyncio.QueueEmpty, AttributeError):
+            code, image = await run_in_threadpool(self.render)
 
-        # 3. 生成 ID 并存入 Redis
         captcha_id = str(uuid.uuid4())
         key = f"captcha:{captcha_id}"
 
         # 存入 Redis (忽略大小写，存大写)
-        self.redis_client.setex(key, self.ttl, code.upper())
+        await get_async_redis().setex(key, self.ttl, code.upper())
 
         return {
             "captcha_id": captcha_id,
-            "image_data": image_data,  # Returns BytesIO object
+            "image_data": image,
         }
 
-    def verify_captcha(self, captcha_id: str, code: str) -> bool:
+    async def verify_captcha(self, captcha_id: str, code: str) -> bool:
         """
         验证验证码
         """
         if not captcha_id or not code:
             return False
 
-        key = f"captcha:{captcha_id}"
-        stored_code = self.redis_client.get(key)
+        # GETDEL 原子地取出并删除，验证一次即销毁 (防重放)
+        stored_code = await get_async_redis().getdel(f"captcha:{captcha_id}")
 
         if not stored_code:
             return False
 
-        # 验证一次即销毁 (防重放)
-        self.redis_client.delete(key)
-
         return stored_code == code.upper()
 
 
-captcha_manager = CaptchaManager()
+captcha_manager = CaptchaManager(pool_size=captcha_pool_size)
@@ -1,41 +1,236 @@
-import jwt
-from slowapi import Limiter
-from slowapi.util import get_remote_address
-from fastapi import Request
-from dotenv import load_dotenv
+import asyncio
+import functools
+import logging
 import os
+import re
+import threading
+import time
+from collections import OrderedDict
+
+import redis
+from dotenv import load_dotenv
+from fastapi import Request
+
+from database.redis_client import get_redis, get_async_redis
+
+load_dotenv()
+Logger = logging.getLogger(__name__)
+# 本地预检的桶个数上限（按 限流 key + 路由 计）
+local_maxsize = int(os.environ.get("RATE_LIMIT_LOCAL_MAXSIZE", "100000"))
+
+_UNITS = {"second": 1, "minute": 60, "hour": 3600, "day": 86400}
+_limit_pattern = re.compile(
+    r"^\s*(\d+)\s*(?:/|per)\s*(\d+)?\s*(second|minute|hour|day)s?\s*$"
+)
+
+# 一个路由上的所有限制在一次 EVALSHA 里判断：有一个超了就都不计数
+# ARGV 依次是每个限制的 次数、窗口毫秒数
+_LIMIT_SCRIPT = """
+for i = 1, #KEYS do
+    local current = tonumber(redis.call('GET', KEYS[i]) or '0')
+    if current >= tonumber(ARGV[2 * i - 1]) then
+        return {i, redis.call('PTTL', KEYS[i])}
+    end
+end
+for i = 1, #KEYS do
+    if redis.call('INCR', KEYS[i]) == 1 then
+        redis.call('PEXPIRE', KEYS[i], ARGV[2 * i])
+    end
+end
+return {0, 0}
+"""
+
+
+class RateLimitExceeded(Exception):
+    def __init__(self, limit, retry_after: float):
+        self.limit = limit
+        self.detail = str(limit)
+        self.retry_after = retry_after
+
+
+class RateLimit:
+    def __init__(self, spec: str):
+        match = _limit_pattern.match(spec)
+        if match is None:
+            raise ValueError(f"invalid rate limit: {spec}")
+        self.amount = int(match.group(1))
+        self.multiples = int(match.group(2) or 1)
+        self.unit = match.group(3)
+        self.window = self.multiples * _UNITS[self.unit]
+
+    def __str__(self):
+        if self.multiples == 1:
+            return f"{self.amount} per 1 {self.unit}"
+        return f"{self.amount} per {self.multiples} {self.unit}s"
+
+
+class _LocalState:
+    """
+    单个 限流 key + 路由 的本地状态：每个限制一个令牌桶，外加 Redis 告知的封禁截止时间
+    令牌桶容量是限额的两倍、速率等于限额，固定窗口在边界上最多放行两倍限额，
+    所以本地桶不会拒绝 Redis 会放行的请求，只挡住明显的洪水
+    """
+
+    __slots__ = ("tokens", "updated_at", "blocked_until", "blocked_limit")
+
+    def __init__(self, limits, now):
+        self.tokens = [limit.amount * 2.0 for limit in limits]
+        self.updated_at = now
+        self.blocked_until = 0.0
+        self.blocked_limit = None
 
 
-# 1. 你的自定义 Key 函数
-def get_rate_limit_key(request: Request):
-    # 优先获取真实 IP
+def get_rate_limit_key(request: Request) -> str:
+    # 登录后的接口用 get_current_user 已经验签过的 user_id，其余按真实 IP
+    user_id = getattr(request.state, "user_id", None)
+    if user_id is not None:
+        return str(user_id)
     forwarded = request.headers.get("X-Forwarded-For")
-    print(
-        f"DEBUG LIMITER: remote={request.client.host}, x-forwarded-for={forwarded}",
-        flush=True,
-    )
     if forwarded:
-        real_ip = forwarded.split(",")[0]
-    else:
-        real_ip = get_remote_address(request)
+        return forwarded.split(",")[0].strip()
+    if request.client is not None:
+        return request.client.host
+    return "127.0.0.1"
 
-    auth_header = request.headers.get("Authorization")
-    if auth_header and auth_header.startswith("Bearer "):
+
+class Limiter:
+    """
+    用法和 slowapi 一样：@limiter.limit("10/second")，被装饰的路由要有 request 参数
+    先过本地令牌桶，再用一次 Redis 脚本判断该路由的全部限制
+    """
+
+    def __init__(self, key_func, maxsize: int = 100000):
+        self.key_func = key_func
+        self.maxsize = maxsize
+        self._route_limits = {}
+        self._local = OrderedDict()
+        self._lock = threading.Lock()
+        self._script = None
+        self._async_script = None
+
+    def limit(self, spec: str):
+        rate_limit = RateLimit(spec)
+
+        def decorator(func):
+            route = f"{func.__module__}.{func.__name__}"
+            self._route_limits.setdefault(route, []).insert(0, rate_limit)
+            # 同一个路由叠了多个 limit 时只包一层
+            if getattr(func, "_rate_limit_route", None) == route:
+                return func
+
+            if asyncio.iscoroutinefunction(func):
+
+                @functools.wraps(func)
+                async def async_wrapper(*args, **kwargs):
+                    await self.check_async(_find_request(args, kwargs), route)
+                    return await func(*args, **kwargs)
+
+                wrapper = async_wrapper
+            else:
+
+                @functools.wraps(func)
+                def sync_wrapper(*args, **kwargs):
+                    self.check(_find_request(args, kwargs), route)
+                    return func(*args, **kwargs)
+
+                wrapper = sync_wrapper
+            wrapper._rate_limit_route = route
+            return wrapper
+
+        return decorator
+
+    def _redis_keys(self, key: str, route: str, limits) -> tuple[list, list]:
+        keys = [
+            f"LIMITER/{key}/{route}/{limit.amount}/{limit.multiples}/{limit.unit}"
+            for limit in limits
+        ]
+        args = []
+        for limit in limits:
+            args.extend((limit.amount, limit.window * 1000))
+        return keys, args
+
+    def _local_check(self, key: str, route: str, limits):
+        now = time.monotonic()
+        with self._lock:
+            state = self._local.get((key, route))
+            if state is None:
+                state = _LocalState(limits, now)
+                self._local[(key, route)] = state
+                while len(self._local) > self.maxsize:
+                    self._local.popitem(last=False)
+            else:
+                self._local.move_to_end((key, route))
+            if state.blocked_until > now:
+                raise RateLimitExceeded(
+                    state.blocked_limit, state.blocked_until - now
+                )
+            elapsed = now - state.updated_at
+            state.updated_at = now
+            for i, limit in enumerate(limits):
+                capacity = limit.amount * 2.0
+                state.tokens[i] = min(
+                    capacity, state.tokens[i] + elapsed * limit.amount / limit.window
+                )
+            for i, limit in enumerate(limits):
+                if state.tokens[i] < 1:
+                    raise RateLimitExceeded(
+                        limit, (1 - state.tokens[i]) * limit.window / limit.amount
+                    )
+            for i in range(len(limits)):
+                state.tokens[i] -= 1
+            return state
+
+    def _apply_result(self, state: _LocalState, limits, result):
+        index, ttl_ms = int(result[0]), int(result[1])
+        if index == 0:
+            return
+        limit = limits[index - 1]
+        retry_after = max(ttl_ms, 0) / 1000
+        # 窗口重置前这个 key 在本 worker 上直接拒绝，不再访问 Redis
+        with self._lock:
+            state.blocked_until = time.monotonic() + retry_after
+            state.blocked_limit = limit
+        raise RateLimitExceeded(limit, retry_after)
+
+    def check(self, request: Request, route: str):
+        limits = self._route_limits[route]
+        key = self.key_func(request)
+        state = self._local_check(key, route, limits)
+        keys, args = self._redis_keys(key, route, limits)
+        try:
+            if self._script is None:
+                self._script = get_redis().register_script(_LIMIT_SCRIPT)
+            result = self._script(keys=keys, args=args)
+        except redis.RedisError as e:
+            # Redis 挂了就只靠本地令牌桶，不把整个服务拖下去
+            Logger.error(f"Rate limit check failed: {e}")
+            return
+        self._apply_result(state, limits, result)
+
+    async def check_async(self, request: Request, route: str):
+        limits = self._route_limits[route]
+        key = self.key_func(request)
+        state = self._local_check(key, route, limits)
+        keys, args = self._redis_keys(key, route, limits)
         try:
-            token = auth_header.split(" ")[1]
-            # 仅解码，不验证签名，追求速度
-            payload = jwt.decode(token, options={"verify_signature": False})
-            return str(payload.get("user_id", real_ip))
-        except:
-            pass
-    return real_ip
+            if self._async_script is None:
+                self._async_script = get_async_redis().register_script(_LIMIT_SCRIPT)
+            result = await self._async_script(keys=keys, args=args)
+        except redis.RedisError as e:
+            Logger.error(f"Rate limit check failed: {e}")
+            return
+        self._apply_result(state, limits, result)
+
+
+def _find_request(args, kwargs) -> Request:
+    request = kwargs.get("request")
+    if isinstance(request, Request):
+        return request
+    for value in list(args) + list(kwargs.values()):
+        if isinstance(value, Request):
+            return value
+    raise RuntimeError("rate limited endpoint must accept a `request: Request` argument")
 
 
-# 2. 初始化 Limiter 实例
 # 这个实例会被 main.py 和各个 router 引用
-load_dotenv()
-redis_url = os.environ.get("REDIS_URL", "redis://localhost:6379/0")
-# swallow_errors=False 方便调试连接问题，生产环境可改为 True
-limiter = Limiter(
-    key_func=get_rate_limit_key, storage_uri=redis_url, swallow_errors=False
-)
+limiter = Limiter(key_func=get_rate_limit_key, maxsize=local_maxsize)
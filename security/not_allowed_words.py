@@ -1,25 +1,140 @@
+import csv
+import io
+import os
+import threading
+import time
+
 from flashtext import KeywordProcessor
 from sqlalchemy.orm import Session
-from database.management import NotallowedWordManagement
+from sqlalchemy.ext.asyncio import AsyncSession
+from dotenv import load_dotenv
+from database.management import NotallowedWordManagement, NOT_ALLOWED_WORDS_VERSION_KEY
+from database.async_management import AsyncNotallowedWordManagement
+from database.redis_client import get_version, get_version_async
 
+load_dotenv()
+# 多久去 Redis 看一次版本号（秒），即其他 worker 感知违禁词变更的最大延迟
+refresh_interval = float(os.environ.get("NOT_ALLOWED_WORDS_REFRESH_INTERVAL", "1"))
+
+
+class CompiledMatcher:
+    """
+    进程内编译好的违禁词匹配器，只有版本号变化时才重新查库重建
+    """
+
+    def __init__(self, refresh_interval: float = 1.0):
+        self.refresh_interval = refresh_interval
+        self.keyword_processor = None
+        self.version = None
+        self._checked_at = 0.0
+        self._lock = threading.Lock()
 
-class not_allowed_word:
     @staticmethod
-    def check_message(content, db: Session):
-        not_allowed_word_management = NotallowedWordManagement(db)
+    def compile(words) -> KeywordProcessor:
         keyword_processor = KeywordProcessor()
-        db_words = not_allowed_word_management.get_not_allowed_words_all()
-        keyword_processor.add_keywords_from_list(db_words)
-        found_words = keyword_processor.extract_keywords(content)
+        if words:
+            keyword_processor.add_keywords_from_list(list(words))
+        return keyword_processor
+
+    def _should_poll(self) -> bool:
+        now = time.monotonic()
+        if (
+            self.keyword_processor is not None
+            and now - self._checked_at < self.refresh_interval
+        ):
+            return False
+        self._checked_at = now
+        return True
+
+    def _current_version(self):
+        # Redis 挂了返回 None，此时继续用手上已编译好的版本
+        if not self._should_poll():
+            return self.version
+        return get_version(NOT_ALLOWED_WORDS_VERSION_KEY)
+
+    async def _current_version_async(self):
+        if not self._should_poll():
+            return self.version
+        return await get_version_async(NOT_ALLOWED_WORDS_VERSION_KEY)
+
+    def _is_fresh(self, version) -> bool:
+        return self.keyword_processor is not None and (
+            version is None or version == self.version
+        )
+
+    def get_processor(self, db: Session) -> KeywordProcessor:
+        version = self._current_version()
+        if self._is_fresh(version):
+            return self.keyword_processor
+        with self._lock:
+            if not self._is_fresh(version):
+                words = NotallowedWordManagement(db).get_not_allowed_words_all()
+                self.keyword_processor = self.compile(words)
+                self.version = version
+        return self.keyword_processor
+
+    async def get_processor_async(self, db: AsyncSession) -> KeywordProcessor:
+        version = await self._current_version_async()
+        if self._is_fresh(version):
+            return self.keyword_processor
+        words = await AsyncNotallowedWordManagement(db).get_not_allowed_words_all()
+        self.keyword_processor = self.compile(words)
+        self.version = version
+        return self.keyword_processor
+
+    def invalidate(self):
+        self.keyword_processor = None
+        self.version = None
+
+    def check(self, content, db: Session):
+        found_words = self.get_processor(db).extract_keywords(content)
+        if found_words:
+            return found_words[0]
+        return None
 
+    async def check_async(self, content, db: AsyncSession):
+        found_words = (await self.get_processor_async(db)).extract_keywords(content)
         if found_words:
             return found_words[0]
         return None
 
 
+compiled_matcher = CompiledMatcher(refresh_interval=refresh_interval)
+
+
+def read_uploaded_words(file, filename: str = ""):
+    """
+    边读上传文件边产出违禁词，不把整个文件读进内存
+    .csv 取第一列（表头是 word 的话跳过），其他按一行一个词；编码不对时迭代中抛 UnicodeDecodeError
+    """
+    text = io.TextIOWrapper(file, encoding="utf-8-sig", newline="")
+    try:
+        if filename.lower().endswith(".csv"):
+            for index, row in enumerate(csv.reader(text)):
+                if not row or (index == 0 and row[0].strip().lower() == "word"):
+                    continue
+                yield row[0]
+        else:
+            for line in text:
+                yield line
+    finally:
+        # 上传文件由 FastAPI 关闭，这里只把它从包装里拿出来
+        text.detach()
+
+
+class not_allowed_word:
+    @staticmethod
+    def check_message(content, db: Session):
+        return compiled_matcher.check(content, db)
+
+    @staticmethod
+    async def check_message_async(content, db: AsyncSession):
+        return await compiled_matcher.check_async(content, db)
+
+
 # 测试
 if __name__ == "__main__":
     msg = "我想去赌博赚钱"
-    result = not_allowed_word.check_message(msg)
-    if result:
+    keyword_processor = CompiledMatcher.compile(["赌博"])
+    if keyword_processor.extract_keywords(msg):
         raise ValueError("对不起，存在违禁词！打回！")
@@ -0,0 +1,72 @@
+import asyncio
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+from fastapi import HTTPException, status
+from dotenv import load_dotenv
+
+from .security import SecurityUtils
+
+load_dotenv()
+# 每个 uvicorn worker 独立的哈希进程数和最多排队的任务数
+password_hash_workers = int(os.environ.get("PASSWORD_HASH_WORKERS", "2"))
+password_hash_queue_limit = int(os.environ.get("PASSWORD_HASH_QUEUE_LIMIT", "64"))
+
+
+class PasswordHashPool:
+    """
+    Argon2 放到独立的进程池里算，不占 AnyIO 的线程池，也不和事件循环抢 GIL
+    排队超过上限直接返回 503，避免登录洪峰拖垮其他接口
+    """
+
+    def __init__(self, workers: int, queue_limit: int):
+        self.workers = workers
+        self.queue_limit = queue_limit
+        self._executor = None
+        self._pending = 0
+
+    def startup(self):
+        if self._executor is None:
+            # 用 spawn 避免 fork 一个带着事件循环和线程的进程
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.workers,
+                mp_context=multiprocessing.get_context("spawn"),
+            )
+        return self._executor
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+        self._executor = None
+
+    @property
+    def pending(self) -> int:
+        return self._pending
+
+    async def _run(self, func, *args):
+        if self._pending >= self.queue_limit:
+            raise HTTPException(
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                detail="服务繁忙，请稍后再试",
+                headers={"Retry-After": "1"},
+            )
+        executor = self._executor or self.startup()
+        self._pending += 1
+        try:
+            return await asyncio.get_running_loop().run_in_executor(
+                executor, func, *args
+            )
+        finally:
+            self._pending -= 1
+
+    async def hash(self, password: str) -> str:
+        return await self._run(SecurityUtils.get_password_hash, password)
+
+    async def verify(self, plain_password: str, hashed_password: str) -> bool:
+        return await self._run(
+            SecurityUtils.verify_password, plain_password, hashed_password
+        )
+
+
+password_hash_pool = PasswordHashPool(password_hash_workers, password_hash_queue_limit)
@@ -15,7 +15,18 @@ ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 30
 
 
-pwd_context = CryptContext(schemes=["argon2"], deprecated="auto")
+# Argon2 代价参数，调大更安全但登录/注册更慢
+argon2_time_cost = int(os.environ.get("ARGON2_TIME_COST", "3"))
+argon2_memory_cost = int(os.environ.get("ARGON2_MEMORY_COST", "65536"))  # KiB
+argon2_parallelism = int(os.environ.get("ARGON2_PARALLELISM", "4"))
+
+pwd_context = CryptContext(
+    schemes=["argon2"],
+    deprecated="auto",
+    argon2__time_cost=argon2_time_cost,
+    argon2__memory_cost=argon2_memory_cost,
+    argon2__parallelism=argon2_parallelism,
+)
 
 
 class SecurityUtils:
@@ -23,6 +34,7 @@ class SecurityUtils:
     def verify_password(plain_password: str, hashed_password: str) -> bool:
         return pwd_context.verify(plain_password, hashed_password)
 
+    @staticmethod
     def get_password_hash(password: str) -> str:
         return pwd_context.hash(password)
 
@@ -1,16 +1,19 @@
-from fastapi import Depends, HTTPException, status
+from fastapi import Depends, HTTPException, Request, status
 from fastapi.security import OAuth2PasswordBearer
-from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 from jose import JWTError, jwt
-from database.utils import get_db
+from database.utils import get_async_db
 from .security import SecurityUtils, SECRET_KEY, ALGORITHM
-from database.management import UserManagement
+from database.async_management import AsyncUserManagement
+from database.user_state_cache import user_state_cache
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="user_auth/login")
 
 
 async def get_current_user(
-    token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)
+    request: Request,
+    token: str = Depends(oauth2_scheme),
+    db: AsyncSession = Depends(get_async_db),
 ):
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
@@ -24,8 +27,11 @@ async def get_current_user(
             raise credentials_exception
     except JWTError:
         raise credentials_exception
-    user_manager = UserManagement(db)
-    user = user_manager.get_user_by_id(user_id)
+    # 限流的 key 直接用这里验签过的 user_id，不再重复解码 JWT
+    request.state.user_id = user_id
+    # 先查进程内缓存和 Redis，常见情况下不用访问 MySQL
+    user_manager = AsyncUserManagement(db)
+    user = await user_state_cache.get(user_id, user_manager.get_user_state)
     if user is None:
         raise credentials_exception
     if user.is_deleted or user.is_banned:
@@ -0,0 +1,122 @@
+"""
+测试用 fakeredis 代替 Redis、临时 SQLite 文件代替 MySQL；
+环境变量要在导入任何业务模块之前设好，业务模块在导入时就会读配置、建引擎
+"""
+
+import os
+import shutil
+import tempfile
+from collections import OrderedDict
+
+_tmp_dir = tempfile.mkdtemp(prefix="cyrene-test-")
+os.environ["DATABASE_URL"] = f"sqlite:///{_tmp_dir}/test.db"
+os.environ.pop("ASYNC_DATABASE_URL", None)
+os.environ["REDIS_URL"] = "redis://fake"
+os.environ.setdefault("SECRET_KEY", "test-secret")
+os.environ.setdefault("ADMIN_NAME", "admin")
+os.environ.setdefault("ADMIN_PASSWORD", "admin-password")
+os.environ.setdefault("ENDPOINT_CACHE_ENABLED", "false")
+os.environ.setdefault("TIERING_ENABLED", "false")
+
+import fakeredis
+import pytest
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker, AsyncSession
+
+from database import redis_client
+from database.database_structure import Base
+from database.engine_creating import engine, async_db_url
+from model.admission import admission_controller
+from security.limit_request import limiter
+from tests.fake_openai import FakeUpstream
+
+
+def pytest_addoption(parser):
+    parser.addoption("--runslow", action="store_true", help="也跑标了 slow 的测试")
+
+
+def pytest_configure(config):
+    config.addinivalue_line("markers", "slow: 耗时很长的测试，加 --runslow 才跑")
+
+
+def pytest_unconfigure(config):
+    shutil.rmtree(_tmp_dir, ignore_errors=True)
+
+
+def pytest_collection_modifyitems(config, items):
+    if config.getoption("--runslow"):
+        return
+    skip_slow = pytest.mark.skip(reason="需要 --runslow")
+    for item in items:
+        if "slow" in item.keywords:
+            item.add_marker(skip_slow)
+
+
+@pytest.fixture
+def anyio_backend():
+    return "asyncio"
+
+
+@pytest.fixture(autouse=True)
+def fake_redis(monkeypatch):
+    """
+    每个测试一个空的 fakeredis，同步和异步客户端共用同一份数据
+    """
+    server = fakeredis.FakeServer()
+    monkeypatch.setattr(
+        redis_client, "_redis_client", fakeredis.FakeRedis(server=server, decode_responses=True)
+    )
+    monkeypatch.setattr(
+        redis_client,
+        "_async_redis_client",
+        fakeredis.FakeAsyncRedis(server=server, decode_responses=True),
+    )
+    monkeypatch.setattr(redis_client, "_pending_bumps", set())
+    # 限流器缓存了注册在旧客户端上的脚本，本地令牌桶也不能带到下一个测试
+    monkeypatch.setattr(limiter, "_script", None)
+    monkeypatch.setattr(limiter, "_async_script", None)
+    monkeypatch.setattr(limiter, "_local", OrderedDict())
+    # 准入控制同理：脚本按客户端缓存，唤醒用的 Event 绑在上一个测试的事件循环上
+    monkeypatch.setattr(admission_controller.redis_backend, "_scripts", {})
+    monkeypatch.setattr(admission_controller, "_wakeups", {})
+    return server
+
+
+@pytest.fixture
+def tables():
+    """
+    每个测试重建所有表
+    """
+    Base.metadata.drop_all(engine)
+    Base.metadata.create_all(engine)
+    yield engine
+    Base.metadata.drop_all(engine)
+
+
+@pytest.fixture
+async def session_factory(tables):
+    """
+    每个测试的事件循环不一样，异步引擎在测试里建、测试结束时关
+    """
+    async_engine = create_async_engine(async_db_url)
+    yield async_sessionmaker(
+        bind=async_engine, class_=AsyncSession, autoflush=False, expire_on_commit=False
+    )
+    await async_engine.dispose()
+
+
+@pytest.fixture
+def fake_upstream():
+    """
+    工厂：fake_upstream(**kwargs) 起一个本地假上游，测试结束时关掉
+    """
+    started = []
+
+    def start(**kwargs) -> FakeUpstream:
+        upstream = FakeUpstream(**kwargs)
+        upstream.start()
+        started.append(upstream)
+        return upstream
+
+    yield start
+    for upstream in started:
+        upstream.stop()
@@ -0,0 +1,82 @@
+"""
+本地假的 OpenAI 兼容上游，只实现流式的 /v1/chat/completions，跑在后台线程里的 uvicorn 上
+mode 随时可以改："ok" 正常吐字，"error" 返回 500，"bad_request" 返回 400，"hang" 一直不响应
+prefill_per_token 模拟上游处理 prompt 的耗时：首个 token 前按 prompt 的 token 数多等一会
+"""
+
+import asyncio
+import json
+import threading
+import time
+
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+from model.tokenizer import count_tokens
+
+
+class FakeUpstream:
+    def __init__(
+        self,
+        chunks=("你好", "呀，", "我是", "昔涟"),
+        first_delay: float = 0.0,
+        mode: str = "ok",
+        prefill_per_token: float = 0.0,
+    ):
+        self.chunks = list(chunks)
+        self.first_delay = first_delay
+        self.mode = mode
+        self.prefill_per_token = prefill_per_token
+        self.requests = []
+        self.server = None
+        self.base_url = None
+        self.app = FastAPI()
+        self.app.post("/v1/chat/completions")(self.completions)
+
+    async def completions(self, request: Request):
+        body = await request.json()
+        self.requests.append(body)
+        if self.mode == "error":
+            return JSONResponse({"error": {"message": "upstream down"}}, status_code=500)
+        if self.mode == "bad_request":
+            return JSONResponse({"error": {"message": "bad request"}}, status_code=400)
+        if self.mode == "hang":
+            while not await request.is_disconnected():
+                await asyncio.sleep(0.05)
+            return JSONResponse({}, status_code=504)
+        delay = self.first_delay
+        if self.prefill_per_token:
+            prompt_tokens = sum(count_tokens(m["content"]) for m in body["messages"])
+            delay += prompt_tokens * self.prefill_per_token
+        return StreamingResponse(self.stream(body["model"], delay), media_type="text/event-stream")
+
+    async def stream(self, model: str, delay: float):
+        if delay:
+            await asyncio.sleep(delay)
+        for chunk in self.chunks:
+            data = {
+                "id": "fake",
+                "object": "chat.completion.chunk",
+                "created": 0,
+                "model": model,
+                "choices": [{"index": 0, "delta": {"content": chunk}, "finish_reason": None}],
+            }
+            yield f"data: {json.dumps(data, ensure_ascii=False)}\n\n"
+        yield "data: [DONE]\n\n"
+
+    def start(self) -> str:
+        config = uvicorn.Config(
+            self.app, host="127.0.0.1", port=0, log_level="warning", timeout_graceful_shutdown=1
+        )
+        self.server = uvicorn.Server(config)
+        threading.Thread(target=self.server.run, daemon=True).start()
+        while not self.server.started:
+            time.sleep(0.01)
+        port = self.server.servers[0].sockets[0].getsockname()[1]
+        self.base_url = f"http://127.0.0.1:{port}/v1"
+        return self.base_url
+
+    def stop(self):
+        if self.server is not None:
+            self.server.should_exit = True
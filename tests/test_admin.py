@@ -0,0 +1,157 @@
+import io
+
+import httpx
+import pytest
+from fastapi import FastAPI
+from sqlalchemy import insert, select
+
+from database.database_structure import User, NotAllowedWord
+from database.user_state_cache import UserState
+from router import admin
+from security.not_allowed_words import read_uploaded_words
+from security.verification import get_current_admin
+
+pytestmark = pytest.mark.anyio
+
+USERS = [
+    # user_id, is_admin, is_banned, is_deleted
+    (1, False, False, False),
+    (2, True, False, False),
+    (3, False, True, False),
+    (4, False, False, True),
+    (5, False, True, True),
+]
+
+
+@pytest.fixture
+def users(tables):
+    with tables.begin() as conn:
+        conn.execute(
+            insert(User),
+            [
+                {
+                    "user_id": user_id,
+                    "name": f"u{user_id}",
+                    "password": "x",
+                    "is_admin": is_admin,
+                    "is_banned": is_banned,
+                    "is_deleted": is_deleted,
+                }
+                for user_id, is_admin, is_banned, is_deleted in USERS
+            ],
+        )
+    return tables
+
+
+@pytest.fixture
+async def client(tables):
+    # 管理员路由都是同步的，直接用测试库的同步引擎
+    app = FastAPI()
+    app.include_router(admin.router, prefix="/admin")
+    app.dependency_overrides[get_current_admin] = lambda: UserState(2, "u2", True, False, False)
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+        yield client
+
+
+def user_flags(engine) -> dict:
+    with engine.connect() as conn:
+        rows = conn.execute(select(User.user_id, User.is_banned, User.is_deleted))
+        return {row.user_id: (row.is_banned, row.is_deleted) for row in rows}
+
+
+@pytest.mark.parametrize(
+    "action, outcomes, changed",
+    [
+        (
+            "bulk_ban",
+            {1: "ok", 2: "admin", 3: "unchanged", 4: "deleted", 404: "not_found"},
+            {1: (True, False)},
+        ),
+        (
+            "bulk_unban",
+            {1: "unchanged", 3: "ok", 5: "deleted", 404: "not_found"},
+            {3: (False, False)},
+        ),
+        (
+            "bulk_soft_delete",
+            {1: "ok", 2: "admin", 4: "unchanged", 404: "not_found"},
+            {1: (False, True)},
+        ),
+        (
+            "bulk_undo_soft_delete",
+            {1: "unchanged", 4: "ok", 5: "ok", 404: "not_found"},
+            {4: (False, False), 5: (True, False)},
+        ),
+    ],
+)
+async def test_bulk_outcome_per_id(users, client, action, outcomes, changed):
+    before = user_flags(users)
+    # 重复的 id 只处理一次
+    user_ids = list(outcomes) + list(outcomes)
+    response = await client.post(f"/admin/{action}", json={"user_ids": user_ids})
+    assert response.status_code == 200, response.text
+    body = response.json()
+    assert body["results"] == [
+        {"user_id": user_id, "result": result} for user_id, result in outcomes.items()
+    ]
+    assert body["updated"] == len(changed)
+    assert user_flags(users) == {**before, **changed}
+
+
+async def test_bulk_rejects_too_many_ids(client):
+    response = await client.post("/admin/bulk_ban", json={"user_ids": list(range(1001))})
+    assert response.status_code == 422
+
+
+def read(content: str, filename: str) -> list[str]:
+    return list(read_uploaded_words(io.BytesIO(content.encode("utf-8-sig")), filename))
+
+
+def test_csv_takes_first_column_and_skips_header():
+    content = 'word,note\n赌博,x\n"逗,号",y\n\n 毒品 \nword\n'
+    # 只有第一行的 word 是表头
+    assert read(content, "words.CSV") == ["赌博", "逗,号", " 毒品 ", "word"]
+
+
+def test_text_is_one_word_per_line():
+    content = "word\n赌博,x\n\n毒品"
+    assert read(content, "words.txt") == ["word\n", "赌博,x\n", "\n", "毒品"]
+    assert read(content, "") == read(content, "words.txt")
+
+
+@pytest.mark.parametrize(
+    "filename, content",
+    [
+        ("words.csv", "word\n赌博\n赌博\n毒品,x\n\n" + "长" * 51 + "\n"),
+        ("words.txt", "赌博\n赌博\r\n 毒品 \n\n" + "长" * 51),
+    ],
+)
+async def test_import_route(tables, client, filename, content):
+    with tables.begin() as conn:
+        conn.execute(insert(NotAllowedWord).values(word="毒品"))
+    response = await client.post(
+        "/admin/import_not_allowed_words",
+        files={"file": (filename, content.encode())},
+    )
+    assert response.status_code == 200, response.text
+    body = response.json()
+    # 空行在 csv 里直接跳过，不算收到
+    received = 5 if filename.endswith(".txt") else 4
+    assert body == {
+        "msg": "违禁词导入完成",
+        "received": received,
+        "inserted": 1,
+        "skipped": 2,
+        "invalid": received - 3,
+    }
+    with tables.connect() as conn:
+        assert sorted(conn.execute(select(NotAllowedWord.word)).scalars()) == ["毒品", "赌博"]
+
+
+async def test_import_rejects_non_utf8(tables, client):
+    response = await client.post(
+        "/admin/import_not_allowed_words",
+        files={"file": ("words.txt", "赌博\n".encode("gbk"))},
+    )
+    assert response.status_code == 400
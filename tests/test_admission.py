@@ -0,0 +1,184 @@
+import asyncio
+import random
+
+import pytest
+
+from model import admission as admission_module
+from model.admission import (
+    AdmissionController,
+    AdmissionRejected,
+    AdmissionTimeout,
+    LEASES_KEY,
+    QUEUE_KEY,
+    fair_order,
+)
+from database.redis_client import get_redis
+
+pytestmark = pytest.mark.anyio
+
+MODEL = "deepseek-chat"
+
+
+@pytest.fixture
+def controller(monkeypatch):
+    monkeypatch.setattr(admission_module, "default_concurrency", 1)
+    monkeypatch.setattr(admission_module, "poll_interval", 0.01)
+    monkeypatch.setattr(admission_module, "queue_max_wait", 2.0)
+    return AdmissionController()
+
+
+async def admit(controller, user_id):
+    """
+    排队直到放行，返回 ticket 和排队期间看到的位置
+    """
+    ticket = controller.ticket(MODEL, user_id)
+    positions = [position async for position in ticket.positions()]
+    return ticket, positions
+
+
+async def wait_until(condition, timeout=2.0):
+    deadline = asyncio.get_running_loop().time() + timeout
+    while not condition():
+        assert asyncio.get_running_loop().time() < deadline
+        await asyncio.sleep(0.01)
+
+
+async def test_cap_is_enforced(controller, monkeypatch):
+    monkeypatch.setattr(admission_module, "default_concurrency", 2)
+    first, positions = await admit(controller, 1)
+    second, _ = await admit(controller, 2)
+    assert positions == []
+    waiting = asyncio.create_task(admit(controller, 3))
+    await wait_until(lambda: controller.waiting == 1)
+    assert get_redis().zcard(LEASES_KEY.format(MODEL)) == 2
+    await first.release()
+    third, positions = await waiting
+    assert positions == [1]
+    assert controller.stats()["active"] == 2
+    for ticket in (second, third):
+        await ticket.release()
+    assert get_redis().zcard(LEASES_KEY.format(MODEL)) == 0
+
+
+async def test_users_are_served_fairly(controller, monkeypatch):
+    monkeypatch.setattr(admission_module, "default_concurrency", 2)
+    holders = [(await admit(controller, "c"))[0] for _ in range(2)]
+    admitted = []
+
+    async def queued(user_id):
+        ticket, _ = await admit(controller, user_id)
+        admitted.append(ticket)
+
+    tasks = []
+    for user_id in ("a", "a", "a", "b"):
+        tasks.append(asyncio.create_task(queued(user_id)))
+        await wait_until(lambda: controller.waiting == len(tasks))
+    # 空出一个名额先给 a；a 占着一个时，后到的 b 排到 a 的第二个请求前面
+    for released, ticket in enumerate(holders, 1):
+        await ticket.release()
+        await wait_until(lambda: len(admitted) == released)
+    await admitted[0].release()
+    await wait_until(lambda: len(admitted) == 3)
+    await admitted[1].release()
+    await asyncio.gather(*tasks)
+    assert [ticket.user_id for ticket in admitted] == ["a", "b", "a", "a"]
+    for ticket in admitted[2:]:
+        await ticket.release()
+
+
+@pytest.mark.parametrize("seed", range(20))
+async def test_lua_script_agrees_with_fair_order(controller, seed):
+    rng = random.Random(seed)
+    users = [str(user_id) for user_id in range(1, 5)]
+    backend = controller.redis_backend
+    client = get_redis()
+    active = {}
+    for _ in range(rng.randint(0, 6)):
+        user_id = rng.choice(users)
+        active[user_id] = active.get(user_id, 0) + 1
+        client.zadd(LEASES_KEY.format(MODEL), {f"{user_id}:{rng.random()}": 1e12})
+    # 名额正好占满，谁都不放行，返回的位置就是排序
+    cap = sum(active.values())
+    for i in range(rng.randint(1, 12)):
+        user_id = rng.choice(users)
+        status, _ = await backend.step(MODEL, f"{user_id}:{i:02d}", user_id, cap, True)
+        assert status == 0
+    # 同一微秒入队的按成员字典序，以 Redis 里实际的顺序为准
+    members = client.zrange(QUEUE_KEY.format(MODEL), 0, -1)
+    queue = [(member, member.split(":")[0]) for member in members]
+    positions = {}
+    for ticket, user_id in queue:
+        status, position = await backend.step(MODEL, ticket, user_id, cap, False)
+        assert status == 0
+        positions[ticket] = position
+    assert sorted(positions, key=positions.get) == fair_order(queue, active)
+    assert sorted(positions.values()) == list(range(1, len(queue) + 1))
+
+    # 本地兜底按同样的规则排
+    local = controller.local_backend
+    for lease in client.zrange(LEASES_KEY.format(MODEL), 0, -1):
+        local._leases.setdefault(MODEL, {})[lease] = lease.split(":")[0]
+    for ticket, user_id in queue:
+        await local.step(MODEL, ticket, user_id, cap, True)
+    local_positions = {
+        ticket: (await local.step(MODEL, ticket, user_id, cap, False))[1]
+        for ticket, user_id in queue
+    }
+    assert local_positions == positions
+
+
+async def test_full_queue_is_rejected(controller, monkeypatch):
+    monkeypatch.setattr(admission_module, "queue_max_length", 2)
+    holder, _ = await admit(controller, 1)
+    waiting = [asyncio.create_task(admit(controller, user_id)) for user_id in (2, 3)]
+    await wait_until(lambda: controller.waiting == 2)
+    status, _ = await controller.redis_backend.step(MODEL, "4:x", "4", 1, True)
+    assert status == -1
+    with pytest.raises(AdmissionRejected):
+        await admit(controller, 4)
+    assert controller.stats()["rejected"] == 1
+    await holder.release()
+    for task in waiting:
+        ticket, _ = await task
+        await ticket.release()
+
+
+async def test_wait_times_out_and_leaves_queue(controller, monkeypatch):
+    monkeypatch.setattr(admission_module, "queue_max_wait", 0.1)
+    holder, _ = await admit(controller, 1)
+    ticket = controller.ticket(MODEL, 2)
+    positions = []
+    with pytest.raises(AdmissionTimeout):
+        async for position in ticket.positions():
+            positions.append(position)
+    assert positions == [1]
+    assert controller.stats()["timeouts"] == 1
+    assert get_redis().zcard(QUEUE_KEY.format(MODEL)) == 0
+    await holder.release()
+
+
+async def test_lease_expires_after_worker_crash(controller, monkeypatch):
+    monkeypatch.setattr(admission_module, "lease_ttl", 0.2)
+    crashed, _ = await admit(controller, 1)
+    # 进程没了：不续约也不释放
+    crashed._renewer.cancel()
+    ticket, positions = await admit(controller, 2)
+    assert positions == [1]
+    assert get_redis().zrange(LEASES_KEY.format(MODEL), 0, -1) == [ticket.ticket]
+    await ticket.release()
+
+
+async def test_redis_error_falls_back_to_local_backend(controller, fake_redis):
+    fake_redis.connected = False
+    first, _ = await admit(controller, 1)
+    assert first.backend is controller.local_backend
+    waiting = asyncio.create_task(admit(controller, 2))
+    await wait_until(lambda: controller.waiting == 1)
+    # 本地兜底也按上限排队
+    assert not waiting.done()
+    await first.release()
+    second, positions = await waiting
+    assert positions == [1]
+    assert second.backend is controller.local_backend
+    await second.release()
+    assert controller.local_backend._leases[MODEL] == {}
@@ -0,0 +1,113 @@
+import asyncio
+import json
+import time
+
+import pytest
+from fastapi import HTTPException, Response
+
+from database.endpoint_cache import EndpointCache, CACHE_STATUS_HEADER, chat_tag
+from database.redis_client import get_redis
+
+pytestmark = pytest.mark.anyio
+
+TAG = chat_tag(1)
+
+
+@pytest.fixture
+def cache():
+    # conftest 关掉了全局的接口缓存，这里单独建一个开着的
+    return EndpointCache(enabled=True, stale_ttl=60)
+
+
+class Source:
+    """
+    记下回源次数，每次回源返回的数据不一样，能看出拿到的是哪一次的
+    """
+
+    def __init__(self):
+        self.calls = 0
+
+    async def __call__(self, db):
+        self.calls += 1
+        return {"items": [self.calls]}
+
+
+async def fetch(cache: EndpointCache, compute, response=None):
+    return await cache.fetch("history", [1, 10], [TAG], 30, compute, None, response)
+
+
+def expire_all():
+    # 把缓存条目改成已经过期、但还在 stale 窗口里
+    client = get_redis()
+    for key in client.scan_iter("endpoint_cache:history:*"):
+        if key.endswith(":refresh"):
+            continue
+        entry = json.loads(client.get(key))
+        entry["expires_at"] = time.time() - 1
+        client.set(key, json.dumps(entry))
+
+
+async def test_miss_then_hit(cache):
+    source = Source()
+    first, second = Response(), Response()
+    assert await fetch(cache, source, first) == {"items": [1]}
+    assert await fetch(cache, source, second) == {"items": [1]}
+    assert source.calls == 1
+    assert first.headers[CACHE_STATUS_HEADER] == "MISS"
+    assert second.headers[CACHE_STATUS_HEADER] == "HIT"
+
+
+async def test_stale_entry_is_served_and_refreshed_once(cache):
+    source = Source()
+    await fetch(cache, source)
+    expire_all()
+    responses = [Response() for _ in range(5)]
+    results = await asyncio.gather(*(fetch(cache, source, r) for r in responses))
+    # 旧值照常返回，后台只刷新一次
+    assert results == [{"items": [1]}] * 5
+    assert {r.headers[CACHE_STATUS_HEADER] for r in responses} == {"STALE"}
+    await asyncio.gather(*cache._tasks)
+    assert source.calls == 2
+    assert await fetch(cache, source) == {"items": [2]}
+    assert source.calls == 2
+
+
+@pytest.mark.parametrize("stale", [False, True])
+async def test_write_bumps_tag_so_old_entry_is_not_served(cache, stale):
+    source = Source()
+    await fetch(cache, source)
+    if stale:
+        expire_all()
+    await cache.invalidate_async(TAG)
+    response = Response()
+    assert await fetch(cache, source, response) == {"items": [2]}
+    assert response.headers[CACHE_STATUS_HEADER] == "MISS"
+    assert not cache._tasks
+    # 同步版本（管理员路由用）也一样
+    cache.invalidate(TAG)
+    assert await fetch(cache, source) == {"items": [3]}
+
+
+async def test_http_exception_from_compute_is_not_cached(cache):
+    calls = []
+
+    async def forbidden(db):
+        calls.append(True)
+        raise HTTPException(status_code=400, detail="你偷看别人聊天记录干嘛？")
+
+    for _ in range(2):
+        with pytest.raises(HTTPException):
+            await fetch(cache, forbidden)
+    assert len(calls) == 2
+    assert not list(get_redis().scan_iter("endpoint_cache:history:*"))
+    # 之后有权限的请求正常回源
+    assert await fetch(cache, Source()) == {"items": [1]}
+
+
+async def test_redis_down_falls_back_to_compute(cache, fake_redis):
+    source = Source()
+    fake_redis.connected = False
+    response = Response()
+    assert await fetch(cache, source, response) == {"items": [1]}
+    assert await fetch(cache, source) == {"items": [2]}
+    assert response.headers[CACHE_STATUS_HEADER] == "ERROR"
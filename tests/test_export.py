@@ -0,0 +1,179 @@
+import json
+import os
+from datetime import datetime, timedelta
+
+import httpx
+import pytest
+from fastapi import FastAPI
+from sqlalchemy import insert
+
+from benchmark.utils import run_export
+from database.database_structure import User, Conversation, Chat, ArchivedChat
+from database.export import ChatExport
+from database.pagination import encode_cursor, InvalidCursor
+from database.utils import get_async_db
+from database.user_state_cache import UserState
+from router import user_conversation
+from security.verification import get_current_user
+
+pytestmark = pytest.mark.anyio
+
+# 导出吞吐的下限（行/秒）
+EXPORT_FLOOR = 10_000
+
+
+@pytest.fixture
+def history(tables):
+    """
+    用户 1：对话 1 在 chats 里，对话 2 已归档；用户 2：对话 3 在 chats 里
+    """
+    start = datetime(2026, 1, 1)
+    with tables.begin() as conn:
+        conn.execute(
+            insert(User),
+            [
+                {"user_id": 1, "name": "u1", "password": "x"},
+                {"user_id": 2, "name": "u2", "password": "x"},
+            ],
+        )
+        conn.execute(
+            insert(Conversation),
+            [
+                {"id": 1, "user_id": 1, "title": "c1"},
+                {"id": 2, "user_id": 1, "title": "c2", "archived": True},
+                {"id": 3, "user_id": 2, "title": "c3"},
+            ],
+        )
+        conn.execute(
+            insert(Chat),
+            [
+                {"id": 1, "chat_id": 1, "role": "user", "content": "a"},
+                {"id": 2, "chat_id": 3, "role": "user", "content": "b"},
+                {"id": 3, "chat_id": 1, "role": "assistant", "content": "c"},
+                {"id": 4, "chat_id": 1, "role": "user", "content": "d"},
+            ],
+        )
+        conn.execute(
+            insert(ArchivedChat),
+            [
+                {
+                    "id": i,
+                    "chat_id": 2,
+                    "role": "user",
+                    "content": f"archived {i}",
+                    "create_at": start + timedelta(seconds=i),
+                }
+                for i in (10, 11, 12)
+            ],
+        )
+
+
+async def export_lines(session_factory, **kwargs) -> list[dict]:
+    chunks = [chunk async for chunk in ChatExport(**kwargs).stream(session_factory, batch_size=2)]
+    return [json.loads(line) for line in b"".join(chunks).decode().splitlines()]
+
+
+async def test_full_export_covers_both_tiers(history, session_factory):
+    lines = await export_lines(session_factory)
+    assert [line["id"] for line in lines] == [1, 2, 3, 4, 10, 11, 12]
+    assert lines[-1]["user_id"] == 1
+
+
+@pytest.mark.parametrize("scope", [{}, {"user_id": 1}, {"chat_id": 2}])
+async def test_resume_from_every_cursor(history, session_factory, scope):
+    lines = await export_lines(session_factory, **scope)
+    assert lines
+    for i, line in enumerate(lines):
+        resumed = await export_lines(session_factory, cursor=line["cursor"], **scope)
+        assert resumed == lines[i + 1 :]
+
+
+async def test_user_scope_orders_by_conversation(history, session_factory):
+    lines = await export_lines(session_factory, user_id=1)
+    assert [(line["chat_id"], line["id"]) for line in lines] == [
+        (1, 1), (1, 3), (1, 4), (2, 10), (2, 11), (2, 12)
+    ]
+
+
+@pytest.mark.parametrize(
+    "cursor",
+    [
+        "not a cursor!",
+        encode_cursor([5, 1, 1]),
+        encode_cursor([0]),
+        encode_cursor({"id": 1}),
+        encode_cursor([0, {"a": 1}]),
+        encode_cursor([0, [1, 2]]),
+        encode_cursor([0, None]),
+        encode_cursor([0, True]),
+        encode_cursor([0, "1"]),
+        encode_cursor([{"a": 1}, 1]),
+    ],
+)
+async def test_bad_cursor_returns_400(session_factory, cursor):
+    from main import invalid_cursor_handler
+
+    async def get_db():
+        async with session_factory() as db:
+            yield db
+
+    # 只挂用户路由和 main 里的 InvalidCursor 处理，不跑 main.app 的 lifespan 和中间件
+    app = FastAPI()
+    app.include_router(user_conversation.router)
+    app.add_exception_handler(InvalidCursor, invalid_cursor_handler)
+    app.dependency_overrides[get_current_user] = lambda: UserState(1, "u1", False, False, False)
+    app.dependency_overrides[get_async_db] = get_db
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+        response = await client.post("/export_chats", json={"cursor": cursor})
+    assert response.status_code == 400
+    assert response.json() == {"detail": "分页游标无效"}
+
+
+def seed_messages(engine, rows: int, content_size: int):
+    conversations = 100
+    content = "字" * content_size
+    with engine.begin() as conn:
+        conn.execute(insert(User).values(user_id=1, name="u1", password="x"))
+        conn.execute(
+            insert(Conversation),
+            [{"id": i, "user_id": 1, "title": f"c{i}"} for i in range(1, conversations + 1)],
+        )
+    batch = 10000
+    for start in range(0, rows, batch):
+        with engine.begin() as conn:
+            conn.execute(
+                insert(Chat),
+                [
+                    {"chat_id": i % conversations + 1, "role": "user", "content": content}
+                    for i in range(start, min(start + batch, rows))
+                ],
+            )
+
+
+@pytest.mark.skipif(not os.path.exists("/proc/self/statm"), reason="需要 /proc 读 RSS")
+@pytest.mark.parametrize(
+    "rows, content_size",
+    [
+        (50_000, 300),
+        pytest.param(10_000_000, 20, marks=pytest.mark.slow),
+    ],
+)
+async def test_export_memory_is_bounded(
+    tables, session_factory, record_property, rows, content_size
+):
+    seed_messages(tables, rows, content_size)
+    # 和 benchmark.bench_export 用同一个函数，吞吐和内存出自同一次导出
+    result = await run_export(ChatExport(), session_factory)
+    for name in ("rows_per_second", "mb_per_second", "rss_growth_mb"):
+        record_property(name, round(result[name], 1))
+    print(
+        f"exported {result['rows']} rows at {result['rows_per_second']:.0f} rows/s, "
+        f"RSS +{result['rss_growth_mb']:.1f} MB"
+    )
+    assert result["rows"] == rows
+    # 导出的总量远大于这个上限，内存只跟一批的大小有关
+    assert result["bytes"] > 40 * 1024 * 1024
+    assert result["rss_growth_mb"] < 32, f"RSS grew {result['rss_growth_mb']:.1f} MB"
+    # 本机 SQLite 上约 6-7 万行/秒，下限留足余量，只拦住退化成逐行查询这种量级的回归
+    assert result["rows_per_second"] > EXPORT_FLOOR
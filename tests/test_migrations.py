@@ -0,0 +1,122 @@
+from sqlalchemy import insert, select, delete
+
+from database.database_structure import User, Character, Conversation, Chat, MigrationMarker
+from database.utils import migrate_db
+
+
+def character_ids(engine) -> dict:
+    with engine.connect() as conn:
+        return dict(conn.execute(select(Conversation.title, Conversation.character_id)).all())
+
+
+def test_character_backfill_runs_once(tables):
+    engine = tables
+    with engine.begin() as conn:
+        conn.execute(insert(User).values(user_id=1, name="u", password="x"))
+        conn.execute(
+            insert(Character),
+            [
+                {"id": 1, "name": "a", "system_prompt": "p"},
+                {"id": 2, "name": "a_b", "system_prompt": "p"},
+            ],
+        )
+        # 列已经在了（上一次加列成功、回填失败），character_id 还是空的，也没有完成标记
+        conn.execute(
+            insert(Conversation),
+            [
+                {"user_id": 1, "title": "a_b_x"},
+                {"user_id": 1, "title": "a_y"},
+                {"user_id": 1, "title": "ab_z"},
+                {"user_id": 1, "title": "c_w"},
+            ],
+        )
+
+    migrate_db(engine)
+    assert character_ids(engine) == {"a_b_x": 2, "a_y": 1, "ab_z": None, "c_w": None}
+
+    # 角色 c 被删（对话的 character_id 置空）之后又建了同名角色，不能把老对话关联过去
+    with engine.begin() as conn:
+        conn.execute(insert(Character).values(id=3, name="c", system_prompt="p"))
+    migrate_db(engine)
+    assert character_ids(engine) == {"a_b_x": 2, "a_y": 1, "ab_z": None, "c_w": None}
+
+
+def test_repair_reruns_until_marked_done(tables):
+    engine = tables
+    with engine.begin() as conn:
+        conn.execute(insert(User).values(user_id=1, name="u", password="x"))
+        conn.execute(insert(Conversation).values(user_id=1, title="c_w"))
+    migrate_db(engine)
+    # 模拟回填失败、标记没写上：下次启动还会再跑
+    with engine.begin() as conn:
+        conn.execute(delete(MigrationMarker))
+        conn.execute(insert(Character).values(id=3, name="c", system_prompt="p"))
+    migrate_db(engine)
+    assert character_ids(engine) == {"c_w": 3}
+
+
+def test_stats_backfill_only_fills_uncounted_conversations(tables):
+    engine = tables
+    with engine.begin() as conn:
+        conn.execute(insert(User).values(user_id=1, name="u", password="x"))
+        # 1：加列之后回填失败，有消息但计数是 0；
+        # 2、3：已经维护好的、已归档的（消息在 chats_archive 里），都不能被改掉
+        conn.execute(
+            insert(Conversation),
+            [
+                {
+                    "id": chat_id,
+                    "user_id": 1,
+                    "title": title,
+                    "message_count": count,
+                    "last_role": role,
+                    "archived": archived,
+                }
+                for chat_id, title, count, role, archived in [
+                    (1, "a", 0, None, False),
+                    (2, "b", 1, "user", False),
+                    (3, "c", 4, None, True),
+                ]
+            ],
+        )
+        conn.execute(
+            insert(Chat),
+            [
+                {"chat_id": 1, "role": "user", "content": "你好"},
+                {"chat_id": 1, "role": "assistant", "content": "你好呀"},
+                {"chat_id": 2, "role": "user", "content": "在吗"},
+            ],
+        )
+    migrate_db(engine)
+    with engine.connect() as conn:
+        rows = conn.execute(
+            select(
+                Conversation.id,
+                Conversation.message_count,
+                Conversation.last_message_preview,
+                Conversation.last_role,
+            ).order_by(Conversation.id)
+        ).all()
+    assert [tuple(row) for row in rows] == [
+        (1, 2, "你好呀", "assistant"),
+        (2, 1, None, "user"),
+        (3, 4, None, None),
+    ]
+
+
+def test_deleted_at_backfill_is_retried(tables):
+    engine = tables
+    with engine.begin() as conn:
+        conn.execute(
+            insert(User),
+            [
+                {"user_id": 1, "name": "a", "password": "x", "is_deleted": True},
+                {"user_id": 2, "name": "b", "password": "x", "is_deleted": False},
+            ],
+        )
+    # 上一次启动加了列但回填失败：没有完成标记，这次启动补上
+    migrate_db(engine)
+    with engine.connect() as conn:
+        deleted_at = dict(conn.execute(select(User.user_id, User.deleted_at)).all())
+    assert deleted_at[1] is not None
+    assert deleted_at[2] is None
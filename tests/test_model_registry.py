@@ -0,0 +1,131 @@
+import asyncio
+import time
+
+import httpx
+import openai
+import pytest
+from openai import AsyncOpenAI
+
+from model import registry
+from model.registry import ModelRegistry, Upstream, NoUpstreamAvailable, is_upstream_failure
+
+pytestmark = pytest.mark.anyio
+
+MESSAGES = [{"role": "user", "content": "你好"}]
+
+
+@pytest.fixture
+async def make_registry(monkeypatch):
+    """
+    每个上游一个不重试、超时很短的客户端，熔断阈值和冷却时间调小
+    """
+    monkeypatch.setattr(registry, "circuit_failures", 2)
+    monkeypatch.setattr(registry, "circuit_cooldown", 0.2)
+    monkeypatch.setattr(registry, "circuit_max_cooldown", 1.0)
+    clients = []
+
+    def make(*fakes) -> ModelRegistry:
+        upstreams = []
+        for i, fake in enumerate(fakes):
+            upstream = Upstream(f"u{i}", fake.base_url, "test-key")
+            upstream.client = AsyncOpenAI(
+                api_key="test-key", base_url=fake.base_url, max_retries=0, timeout=0.5
+            )
+            clients.append(upstream.client)
+            upstreams.append(upstream)
+        return ModelRegistry(upstreams)
+
+    yield make
+    for client in clients:
+        await client.close()
+
+
+async def collect(model_registry: ModelRegistry) -> str:
+    return "".join([delta async for delta in model_registry.stream("deepseek-chat", MESSAGES)])
+
+
+def test_only_transport_and_retryable_status_errors_fail_over():
+    request = httpx.Request("POST", "http://upstream/v1/chat/completions")
+
+    def status_error(code):
+        return openai.APIStatusError("x", response=httpx.Response(code, request=request), body=None)
+
+    assert is_upstream_failure(openai.APIConnectionError(request=request))
+    assert is_upstream_failure(openai.APITimeoutError(request=request))
+    assert is_upstream_failure(httpx.ReadTimeout("timeout"))
+    assert is_upstream_failure(status_error(429))
+    assert is_upstream_failure(status_error(503))
+    assert not is_upstream_failure(status_error(400))
+    assert not is_upstream_failure(ValueError("bug"))
+    assert not is_upstream_failure(openai.APIError("bad event", request, body=None))
+
+
+async def test_routes_to_lowest_latency(fake_upstream, make_registry):
+    slow = fake_upstream(first_delay=0.2)
+    fast = fake_upstream()
+    model_registry = make_registry(slow, fast)
+    # 两个都没试过时按配置顺序各试一次，之后按首 token 延迟的滑动平均排序
+    for _ in range(4):
+        assert await collect(model_registry) == "你好呀，我是昔涟"
+    slow_upstream, fast_upstream = model_registry.upstreams
+    assert fast_upstream.latency < slow_upstream.latency
+    assert model_registry.candidates("deepseek-chat")[0] is fast_upstream
+    assert len(slow.requests) == 1
+    assert len(fast.requests) == 3
+
+
+async def test_fails_over_before_first_token(fake_upstream, make_registry):
+    broken = fake_upstream(mode="error")
+    hanging = fake_upstream(mode="hang")
+    healthy = fake_upstream()
+    model_registry = make_registry(broken, hanging, healthy)
+    assert await collect(model_registry) == "你好呀，我是昔涟"
+    broken_upstream, hanging_upstream, healthy_upstream = model_registry.upstreams
+    assert broken_upstream.failures == 1
+    assert hanging_upstream.failures == 1
+    assert healthy_upstream.requests == 1
+    # 失败过的上游排到后面，下一次直接走健康的
+    assert await collect(model_registry) == "你好呀，我是昔涟"
+    assert len(broken.requests) == 1
+    assert len(hanging.requests) == 1
+
+
+async def test_client_errors_are_not_failed_over(fake_upstream, make_registry):
+    rejecting = fake_upstream(mode="bad_request")
+    healthy = fake_upstream()
+    model_registry = make_registry(rejecting, healthy)
+    with pytest.raises(openai.BadRequestError):
+        await collect(model_registry)
+    assert model_registry.upstreams[0].failures == 0
+    assert healthy.requests == []
+
+
+async def test_circuit_breaker_transitions(fake_upstream, make_registry):
+    fake = fake_upstream(mode="error")
+    model_registry = make_registry(fake)
+    upstream = model_registry.upstreams[0]
+    for _ in range(2):
+        with pytest.raises(openai.InternalServerError):
+            await collect(model_registry)
+    assert upstream.state == "open"
+    # 熔断期间不再请求上游
+    with pytest.raises(NoUpstreamAvailable):
+        await collect(model_registry)
+    assert len(fake.requests) == 2
+
+    # 冷却结束放一个试探请求，失败了重新熔断，冷却时间翻倍
+    await asyncio.sleep(0.25)
+    assert upstream.available(time.monotonic())
+    assert upstream.state == "half_open"
+    with pytest.raises(openai.InternalServerError):
+        await collect(model_registry)
+    assert upstream.state == "open"
+    assert upstream.cooldown == pytest.approx(0.4)
+
+    # 上游恢复后试探成功，回到 closed，冷却时间复原
+    fake.mode = "ok"
+    await asyncio.sleep(0.45)
+    assert await collect(model_registry) == "你好呀，我是昔涟"
+    assert upstream.state == "closed"
+    assert upstream.cooldown == pytest.approx(0.2)
+    assert len(fake.requests) == 4
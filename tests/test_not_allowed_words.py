@@ -0,0 +1,66 @@
+import pytest
+from fastapi import HTTPException
+
+from database.engine_creating import SessionLocal
+from database.management import (
+    NotallowedWordManagement,
+    NotAllowedWordsUnavailable,
+    NOT_ALLOWED_WORDS_VERSION_KEY,
+)
+from database.redis_client import bump_version, get_version
+from router.admin import not_allowed_words_change
+from security.not_allowed_words import CompiledMatcher
+
+
+@pytest.fixture
+def db(tables):
+    session = SessionLocal()
+    yield session
+    session.close()
+
+
+def test_write_is_seen_by_other_workers(db):
+    other_worker = CompiledMatcher(refresh_interval=0)
+    assert other_worker.check("我想去赌博", db) is None
+    NotallowedWordManagement(db).create_not_allowed_word("赌博")
+    # 写库前后各递增一次
+    assert get_version(NOT_ALLOWED_WORDS_VERSION_KEY) == 2
+    assert other_worker.check("我想去赌博", db) == "赌博"
+
+
+def test_write_fails_when_redis_is_down(db, fake_redis):
+    fake_redis.connected = False
+    with pytest.raises(NotAllowedWordsUnavailable):
+        NotallowedWordManagement(db).create_not_allowed_word("赌博")
+    fake_redis.connected = True
+    assert NotallowedWordManagement(db).get_not_allowed_words_all() is None
+
+
+def test_failed_bump_is_retried_after_redis_recovers(fake_redis):
+    fake_redis.connected = False
+    assert bump_version(NOT_ALLOWED_WORDS_VERSION_KEY, retry=True) is None
+    assert get_version(NOT_ALLOWED_WORDS_VERSION_KEY) is None
+    fake_redis.connected = True
+    assert get_version(NOT_ALLOWED_WORDS_VERSION_KEY) == 1
+    assert get_version(NOT_ALLOWED_WORDS_VERSION_KEY) == 1
+
+
+def test_route_rejects_write_and_drops_local_matcher(db, fake_redis, monkeypatch):
+    from router import admin
+
+    matcher = CompiledMatcher(refresh_interval=60)
+    monkeypatch.setattr(admin, "compiled_matcher", matcher)
+    assert matcher.check("赌博", db) is None
+    fake_redis.connected = False
+    with pytest.raises(HTTPException) as error:
+        with not_allowed_words_change():
+            NotallowedWordManagement(db).create_not_allowed_word("赌博")
+    assert error.value.status_code == 503
+    assert matcher.keyword_processor is None
+
+    # Redis 恢复后写成功，本 worker 不等轮询间隔就能查到新词
+    fake_redis.connected = True
+    assert matcher.check("赌博", db) is None
+    with not_allowed_words_change():
+        NotallowedWordManagement(db).create_not_allowed_word("赌博")
+    assert matcher.check("赌博", db) == "赌博"
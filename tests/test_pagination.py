@@ -0,0 +1,37 @@
+from datetime import datetime
+
+import pytest
+
+from database.database_structure import Chat, NotAllowedWord
+from database.pagination import decode_cursor, encode_cursor, InvalidCursor
+
+KEYS = [Chat.create_at, Chat.id]
+
+
+def test_round_trip():
+    values = [datetime(2026, 1, 1, 12, 0, 0, 123456), 42]
+    assert decode_cursor(encode_cursor(values), KEYS) == values
+
+
+@pytest.mark.parametrize(
+    "values",
+    [
+        ["2026-01-01", {"a": 1}],
+        ["2026-01-01", [1, 2]],
+        ["2026-01-01", None],
+        ["2026-01-01", False],
+        ["2026-01-01", 1.5],
+        ["not a time", 1],
+        [20260101, 1],
+        [["2026-01-01"], 1],
+    ],
+)
+def test_rejects_values_of_the_wrong_type(values):
+    with pytest.raises(InvalidCursor):
+        decode_cursor(encode_cursor(values), KEYS)
+
+
+def test_string_column_rejects_numbers():
+    with pytest.raises(InvalidCursor):
+        decode_cursor(encode_cursor([1]), [NotAllowedWord.word])
+    assert decode_cursor(encode_cursor(["赌博"]), [NotAllowedWord.word]) == ["赌博"]
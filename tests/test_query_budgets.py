@@ -0,0 +1,231 @@
+"""
+QUERY_PROFILE=strict 下跑真实路由：鉴权、违禁词、角色都从冷缓存开始（最坏情况），
+超出 @query_budget 时中间件抛 QueryBudgetExceeded，ASGITransport 会把它原样抛给测试
+"""
+
+from collections import OrderedDict
+from datetime import datetime, timedelta
+
+import httpx
+import pytest
+from fastapi import FastAPI
+from openai import AsyncOpenAI
+from sqlalchemy import insert
+
+import database.character_registry
+import database.endpoint_cache
+import database.export
+import database.utils
+import model.summarizer
+from database.character_registry import character_registry
+from database.database_structure import (
+    User,
+    Conversation,
+    Chat,
+    ArchivedChat,
+    Character,
+    NotAllowedWord,
+)
+from database.engine_creating import engine
+from database.user_state_cache import user_state_cache
+from model.model import llm_client_manager
+from model.registry import model_registry
+from monitoring import query_profiler
+from monitoring.query_profiler import QueryBudgetExceeded, QueryProfilerMiddleware
+from router import user_conversation, admin
+from security.not_allowed_words import compiled_matcher
+from security.security import SecurityUtils
+
+pytestmark = pytest.mark.anyio
+
+USER, ADMIN = 1, 2
+
+
+@pytest.fixture(scope="session")
+def profiled_engine():
+    # 事件监听挂上就摘不掉，同步引擎整个测试会话只挂一次
+    query_profiler.attach_profiler(engine)
+    return engine
+
+
+@pytest.fixture
+def seeded(tables, profiled_engine):
+    """
+    用户 1 有对话 1（在 chats 里）和对话 2（已归档），管理员是用户 2
+    """
+    start = datetime(2026, 1, 1)
+    with tables.begin() as conn:
+        conn.execute(
+            insert(User),
+            [
+                {"user_id": USER, "name": "u1", "password": "x", "is_admin": False},
+                {"user_id": ADMIN, "name": "admin", "password": "x", "is_admin": True},
+                {"user_id": 3, "name": "u3", "password": "x", "is_admin": False},
+            ],
+        )
+        conn.execute(insert(Character).values(id=1, name="昔涟", system_prompt="你是昔涟"))
+        conn.execute(insert(NotAllowedWord).values(word="违禁"))
+        conn.execute(
+            insert(Conversation),
+            [
+                {"id": 1, "user_id": USER, "title": "昔涟_c1", "character_id": 1, "archived": False},
+                {"id": 2, "user_id": USER, "title": "昔涟_c2", "character_id": 1, "archived": True},
+            ],
+        )
+        conn.execute(
+            insert(Chat),
+            [
+                {"chat_id": 1, "role": role, "content": f"m{i}"}
+                for i, role in enumerate(["user", "assistant"] * 5)
+            ],
+        )
+        conn.execute(
+            insert(ArchivedChat),
+            [
+                {
+                    "id": 100 + i,
+                    "chat_id": 2,
+                    "role": role,
+                    "content": f"a{i}",
+                    "create_at": start + timedelta(seconds=i),
+                }
+                for i, role in enumerate(["user", "assistant"] * 5)
+            ],
+        )
+    return tables
+
+
+@pytest.fixture
+async def client(seeded, session_factory, monkeypatch, fake_upstream):
+    monkeypatch.setattr(query_profiler, "profile_mode", "strict")
+    query_profiler.attach_profiler(session_factory.kw["bind"].sync_engine)
+    # 路由、导出、落库、后台任务各自开会话，全部换成本测试事件循环上的引擎
+    for module in (
+        database.utils,
+        database.export,
+        database.endpoint_cache,
+        database.character_registry,
+        user_conversation,
+        model.summarizer,
+    ):
+        monkeypatch.setattr(module, "AsyncSessionLocal", session_factory)
+    # 进程内缓存全部清空，按缓存都没命中的最坏情况算
+    monkeypatch.setattr(user_state_cache, "_local", OrderedDict())
+    monkeypatch.setattr(character_registry, "_by_id", {})
+    monkeypatch.setattr(character_registry, "_by_name", {})
+    compiled_matcher.invalidate()
+
+    upstream = fake_upstream()
+    llm = AsyncOpenAI(api_key="test-key", base_url=upstream.base_url, max_retries=0)
+    monkeypatch.setattr(llm_client_manager, "client", llm)
+    monkeypatch.setattr(model_registry.upstreams[0], "client", llm)
+
+    app = FastAPI()
+    app.add_middleware(QueryProfilerMiddleware)
+    app.include_router(user_conversation.router)
+    app.include_router(admin.router, prefix="/admin")
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+        yield client
+    await llm.close()
+    compiled_matcher.invalidate()
+
+
+def auth(user_id: int) -> dict:
+    token = SecurityUtils.create_access_token({"user_id": user_id})
+    return {"Authorization": f"Bearer {token}"}
+
+
+@pytest.mark.parametrize(
+    "path, body",
+    [
+        ("/create_chat", {"character_name": "昔涟", "chat_name": "new"}),
+        ("/get_character_name", {}),
+        ("/get_character_name", {"cursor": ""}),
+        ("/get_current_user_conversation", {}),
+        ("/get_current_user_conversation", {"cursor": ""}),
+        ("/get_chat_history", {"chat_id": 1}),
+        ("/get_chat_history", {"chat_id": 2}),
+        ("/get_chat_history", {"chat_id": 2, "cursor": ""}),
+        ("/export_chats", {}),
+        ("/export_chats", {"chat_id": 2}),
+        ("/delete_conversation", {"chat_id": 1}),
+    ],
+)
+async def test_chat_routes_within_budget(client, path, body):
+    response = await client.post(path, json=body, headers=auth(USER))
+    assert response.status_code == 200, response.text
+
+
+@pytest.mark.parametrize("chat_id", [1, 2])
+async def test_send_message_within_budget(client, chat_id):
+    # 对话 2 已归档，先搬回来再聊，是最贵的一条路径
+    response = await client.post(
+        "/send_message",
+        json={
+            "chat_id": chat_id,
+            "message": "你好",
+            "model": "deepseek-chat",
+            "whether_regenerate": False,
+        },
+        headers=auth(USER),
+    )
+    assert response.status_code == 200, response.text
+    assert "你好呀，我是昔涟" in response.text.replace("\ndata: ", "")
+    assert int(response.headers["x-query-count"]) > 0
+
+
+@pytest.mark.parametrize(
+    "path, body",
+    [
+        ("/admin/all_user", {}),
+        ("/admin/all_user", {"cursor": ""}),
+        ("/admin/all_user_conversation", {}),
+        ("/admin/all_user_conversation", {"cursor": ""}),
+        ("/admin/get_softed_deleted_user", {"cursor": ""}),
+        ("/admin/get_not_allowed_words", {"cursor": ""}),
+        ("/admin/get_chat_history", {"chat_id": 1}),
+        ("/admin/get_chat_history", {"chat_id": 2, "cursor": ""}),
+        ("/admin/bulk_ban", {"user_ids": [USER, ADMIN, 3, 404]}),
+        ("/admin/bulk_unban", {"user_ids": [USER, 3, 404]}),
+        ("/admin/bulk_soft_delete", {"user_ids": [USER, ADMIN, 3, 404]}),
+        ("/admin/bulk_undo_soft_delete", {"user_ids": [USER, 3, 404]}),
+        ("/admin/export_chats", {}),
+        ("/admin/export_chats", {"user_id": USER}),
+        ("/admin/delete_conversation", {"chat_id": 2}),
+    ],
+)
+async def test_admin_routes_within_budget(client, path, body):
+    response = await client.post(path, json=body, headers=auth(ADMIN))
+    assert response.status_code == 200, response.text
+
+
+async def test_strict_mode_raises_over_budget(client, monkeypatch):
+    monkeypatch.setattr(admin.list_all_user, "query_budget", 1)
+    with pytest.raises(QueryBudgetExceeded):
+        await client.post("/admin/all_user", json={}, headers=auth(ADMIN))
+
+
+def test_every_route_declares_a_budget():
+    from router import user_auth
+
+    for router in (user_auth.router, user_conversation.router, admin.router):
+        for route in router.routes:
+            endpoint = route.endpoint
+            assert (
+                isinstance(getattr(endpoint, "query_budget", None), int)
+                or getattr(endpoint, "query_budget_exempt", None)
+            ), route.path
+
+
+async def test_import_is_exempt_from_budget(client):
+    # 102 个批次，INSERT 的条数超过以前写死的 101 条预算
+    words = "\n".join(f"w{i}" for i in range(102_000)).encode()
+    response = await client.post(
+        "/admin/import_not_allowed_words",
+        files={"file": ("words.txt", words)},
+        headers=auth(ADMIN),
+    )
+    assert response.status_code == 200, response.text
+    assert response.json()["inserted"] == 102_000
+    assert int(response.headers["x-query-count"]) > 102
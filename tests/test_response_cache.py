@@ -0,0 +1,90 @@
+import asyncio
+
+import pytest
+from openai import AsyncOpenAI
+
+from model import model as model_module
+from model.model import CyreneLLMModel
+from model.response_cache import ResponseCache
+
+pytestmark = pytest.mark.anyio
+
+CHUNKS = ("你好", "呀，", "我是", "昔涟")
+
+
+@pytest.fixture
+def upstream(fake_upstream):
+    return fake_upstream(chunks=CHUNKS)
+
+
+@pytest.fixture
+async def client(upstream):
+    client = AsyncOpenAI(api_key="test-key", base_url=upstream.base_url, max_retries=0)
+    yield client
+    await client.close()
+
+
+@pytest.fixture
+def cache(monkeypatch):
+    def install(maxsize=100, ttl=60.0, max_chars=1000) -> ResponseCache:
+        response_cache = ResponseCache(maxsize, ttl, max_chars)
+        monkeypatch.setattr(model_module, "response_cache", response_cache)
+        return response_cache
+
+    return install
+
+
+async def chat(client, contents: str, temperature=0) -> list[str]:
+    dialog = CyreneLLMModel(client, "你是昔涟", [], "deepseek-chat")
+    return [chunk async for chunk in dialog.chatting(contents, temperature=temperature)]
+
+
+async def test_hit_replays_same_chunks_without_upstream_request(client, upstream, cache):
+    response_cache = cache()
+    live = await chat(client, "你好")
+    replayed = await chat(client, "你好")
+    assert live == list(CHUNKS)
+    assert replayed == live
+    assert len(upstream.requests) == 1
+    assert (response_cache.hits, response_cache.misses) == (1, 1)
+    assert response_cache.stats()["entries"] == 1
+
+
+async def test_sampled_requests_are_not_cached(client, upstream, cache):
+    response_cache = cache()
+    await chat(client, "你好", temperature=1.0)
+    await chat(client, "你好", temperature=1.0)
+    assert len(upstream.requests) == 2
+    assert (response_cache.hits, response_cache.misses) == (0, 0)
+
+
+async def test_expired_entry_goes_upstream_again(client, upstream, cache):
+    response_cache = cache(ttl=0.05)
+    await chat(client, "你好")
+    await asyncio.sleep(0.1)
+    assert await chat(client, "你好") == list(CHUNKS)
+    assert len(upstream.requests) == 2
+    assert (response_cache.hits, response_cache.misses) == (0, 2)
+
+
+async def test_char_budget_evicts_least_recently_used(client, upstream, cache):
+    size = sum(len(chunk) for chunk in CHUNKS)
+    response_cache = cache(max_chars=size * 2)
+    await chat(client, "a")
+    await chat(client, "b")
+    await chat(client, "a")
+    # 放进 c 超了预算，淘汰最久没用的 b
+    await chat(client, "c")
+    assert response_cache.stats()["chars"] == size * 2
+    await chat(client, "a")
+    await chat(client, "b")
+    prompts = [request["messages"][-1]["content"] for request in upstream.requests]
+    assert prompts == ["a", "b", "c", "b"]
+    assert (response_cache.hits, response_cache.misses) == (2, 4)
+
+
+def test_entry_larger_than_budget_is_not_cached():
+    response_cache = ResponseCache(100, 60, 3)
+    response_cache.put("key", ["ab", "cd"])
+    assert response_cache.get("key") is None
+    assert response_cache.stats()["chars"] == 0
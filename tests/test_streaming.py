@@ -0,0 +1,54 @@
+import asyncio
+
+import pytest
+
+from model.streaming import sse_stream, DONE_FRAME
+
+pytestmark = pytest.mark.anyio
+
+
+def hanging_upstream(cleaned: list, started: asyncio.Event):
+    async def chunks():
+        try:
+            yield "a"
+            started.set()
+            await asyncio.Event().wait()
+        finally:
+            # 清理本身也要 await，比如关掉上游的 HTTP 连接
+            await asyncio.sleep(0.01)
+            cleaned.append(True)
+
+    return chunks()
+
+
+async def test_done_frame_after_upstream_finishes():
+    async def chunks():
+        yield "你好"
+        yield "呀"
+
+    frames = [frame async for frame in sse_stream(chunks(), max_delay=0.001)]
+    assert "".join(frames).startswith("data: 你好呀")
+    assert frames[-1] == DONE_FRAME
+
+
+async def test_disconnect_waits_for_upstream_cleanup():
+    cleaned = []
+    started = asyncio.Event()
+
+    async def receive():
+        await started.wait()
+        return {"type": "http.disconnect"}
+
+    stream = sse_stream(hanging_upstream(cleaned, started), max_delay=0.001, receive=receive)
+    frames = [frame async for frame in stream]
+    assert DONE_FRAME not in frames
+    assert cleaned == [True]
+
+
+async def test_closing_stream_waits_for_upstream_cleanup():
+    cleaned = []
+    started = asyncio.Event()
+    stream = sse_stream(hanging_upstream(cleaned, started), max_delay=0.001)
+    assert (await stream.__anext__()).startswith("data: a")
+    await stream.aclose()
+    assert cleaned == [True]
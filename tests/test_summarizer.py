@@ -0,0 +1,128 @@
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy import insert
+
+from database.async_management import AsyncConversationManagement
+from database.database_structure import User, Conversation, Chat
+from model import summarizer as summarizer_module
+from model.summarizer import set_summarizer, maybe_compact_conversation
+
+pytestmark = pytest.mark.anyio
+
+TRIGGER, KEEP = 12, 4
+
+
+class StubSummarizer:
+    """
+    不调上游，记下每次收到的已有摘要和要折叠的消息
+    """
+
+    def __init__(self, fail: bool = False):
+        self.calls = []
+        self.fail = fail
+
+    async def summarize(self, previous_summary, messages):
+        self.calls.append((previous_summary, [m["content"] for m in messages]))
+        if self.fail:
+            raise RuntimeError("upstream down")
+        return f"摘要{len(self.calls)}"
+
+
+@pytest.fixture
+def conversation(tables):
+    with tables.begin() as conn:
+        conn.execute(insert(User).values(user_id=1, name="u1", password="x"))
+        conn.execute(insert(Conversation).values(id=1, user_id=1, title="c1"))
+    add_messages(tables, 1, 20)
+    return tables
+
+
+def add_messages(engine, first: int, last: int):
+    start = datetime(2026, 1, 1)
+    with engine.begin() as conn:
+        conn.execute(
+            insert(Chat),
+            [
+                {
+                    "id": i,
+                    "chat_id": 1,
+                    "role": "user" if i % 2 else "assistant",
+                    "content": f"m{i}",
+                    "create_at": start + timedelta(seconds=i),
+                    "token_count": 5,
+                }
+                for i in range(first, last + 1)
+            ],
+        )
+
+
+@pytest.fixture
+def stub(session_factory, monkeypatch):
+    monkeypatch.setattr(summarizer_module, "summary_enabled", True)
+    monkeypatch.setattr(summarizer_module, "summary_trigger_messages", TRIGGER)
+    monkeypatch.setattr(summarizer_module, "summary_keep_recent", KEEP)
+    monkeypatch.setattr(summarizer_module, "AsyncSessionLocal", session_factory)
+    previous = summarizer_module.summarizer
+    stub = StubSummarizer()
+    set_summarizer(stub)
+    yield stub
+    set_summarizer(previous)
+
+
+async def current_state(session_factory):
+    async with session_factory() as db:
+        management = AsyncConversationManagement(db)
+        summary = await management.get_summary(1)
+        after_id = summary.covered_until_id if summary else None
+        history = await management.get_history_chat(1, token_budget=100_000, after_id=after_id)
+    return summary, [message["content"] for message in history]
+
+
+async def test_compaction_keeps_recent_tail(conversation, session_factory, stub):
+    await maybe_compact_conversation(1)
+    assert stub.calls == [(None, [f"m{i}" for i in range(1, 17)])]
+    summary, history = await current_state(session_factory)
+    assert (summary.content, summary.covered_until_id) == ("摘要1", 16)
+    assert summary.token_count > 0
+    # 拼 prompt 时只带摘要之后的原始消息
+    assert history == ["m17", "m18", "m19", "m20"]
+
+
+async def test_rolling_summary_folds_previous_one(conversation, session_factory, stub):
+    await maybe_compact_conversation(1)
+    # 摘要之后只剩 4 条，不够再压缩
+    await maybe_compact_conversation(1)
+    assert len(stub.calls) == 1
+    add_messages(conversation, 21, 30)
+    await maybe_compact_conversation(1)
+    assert stub.calls[1] == ("摘要1", [f"m{i}" for i in range(17, 27)])
+    summary, history = await current_state(session_factory)
+    assert (summary.content, summary.covered_until_id) == ("摘要2", 26)
+    assert history == ["m27", "m28", "m29", "m30"]
+
+
+async def test_below_trigger_does_nothing(tables, session_factory, stub):
+    with tables.begin() as conn:
+        conn.execute(insert(User).values(user_id=1, name="u1", password="x"))
+        conn.execute(insert(Conversation).values(id=1, user_id=1, title="c1"))
+    add_messages(tables, 1, TRIGGER - 1)
+    await maybe_compact_conversation(1)
+    assert stub.calls == []
+    summary, history = await current_state(session_factory)
+    assert summary is None
+    assert len(history) == TRIGGER - 1
+
+
+async def test_failed_summary_saves_nothing_and_releases_lock(
+    conversation, session_factory, stub
+):
+    stub.fail = True
+    await maybe_compact_conversation(1)
+    summary, history = await current_state(session_factory)
+    assert summary is None
+    assert len(history) == 20
+    stub.fail = False
+    await maybe_compact_conversation(1)
+    summary, _ = await current_state(session_factory)
+    assert summary.covered_until_id == 16
@@ -0,0 +1,56 @@
+from datetime import timedelta
+
+import pytest
+from sqlalchemy import insert, select, func, update
+
+from database.async_management import AsyncConversationManagement
+from database.database_structure import User, Conversation, Chat, ArchivedChat
+from database.tiering import ChatTiering, utc_now
+
+pytestmark = pytest.mark.anyio
+
+
+@pytest.fixture
+def idle_conversation(tables):
+    long_ago = utc_now() - timedelta(days=200)
+    with tables.begin() as conn:
+        conn.execute(insert(User).values(user_id=1, name="u1", password="x"))
+        conn.execute(insert(Conversation).values(id=1, user_id=1, title="c1", updated_at=long_ago))
+        conn.execute(
+            insert(Chat),
+            [{"chat_id": 1, "role": "user", "content": f"m{i}"} for i in range(5)],
+        )
+    return 1
+
+
+async def counts(db) -> tuple[int, int]:
+    live = (await db.execute(select(func.count()).select_from(Chat))).scalar()
+    archived = (await db.execute(select(func.count()).select_from(ArchivedChat))).scalar()
+    return live, archived
+
+
+async def test_rehydrated_conversation_is_not_archived_again(idle_conversation, session_factory):
+    tiering = ChatTiering(idle_days=90, grace_days=0, batch_size=2, batch_pause=0, interval=60)
+    async with session_factory() as db:
+        assert await tiering.archive_idle_conversations(db) == 5
+        assert await counts(db) == (0, 5)
+
+        # 只是打开看了看：搬回 chats，updated_at 不变
+        chat = await AsyncConversationManagement(db).get_conversation(idle_conversation)
+        assert await AsyncConversationManagement(db).rehydrate_conversation(chat)
+        assert await counts(db) == (5, 0)
+
+        # 下一轮不会马上又搬回归档
+        assert await tiering.archive_idle_conversations(db) == 0
+        assert await counts(db) == (5, 0)
+
+        # 搬回之后又过了一个保留期还是没人动，才再归档
+        await db.execute(
+            update(Conversation).values(
+                rehydrated_at=utc_now() - timedelta(days=91),
+                updated_at=Conversation.updated_at,
+            )
+        )
+        await db.commit()
+        assert await tiering.archive_idle_conversations(db) == 5
+        assert await counts(db) == (0, 5)
@@ -0,0 +1,83 @@
+import pytest
+
+from database.redis_client import get_redis
+from database.user_state_cache import (
+    UserState,
+    UserStateCache,
+    USER_STATE_KEY,
+    USER_STATE_VERSION_KEY,
+)
+
+pytestmark = pytest.mark.anyio
+
+
+def make_state(user_id: int, is_banned: bool = False) -> UserState:
+    return UserState(user_id, f"user{user_id}", False, is_banned, False)
+
+
+async def test_miss_fills_redis_and_local():
+    cache = UserStateCache(100, 60, 60)
+    calls = []
+
+    async def loader(user_id):
+        calls.append(user_id)
+        return make_state(user_id)
+
+    assert (await cache.get(1, loader)).name == "user1"
+    assert get_redis().hgetall(USER_STATE_KEY.format(1))["name"] == "user1"
+    await cache.get(1, loader)
+    assert calls == [1]
+
+    # 换一个 worker（没有本地缓存）直接读 Redis 副本
+    other = UserStateCache(100, 60, 60)
+    assert (await other.get(1, loader)).name == "user1"
+    assert calls == [1]
+
+
+async def test_invalidate_during_load_is_not_written_back():
+    cache = UserStateCache(100, 60, 60)
+
+    async def stale_loader(user_id):
+        # 查库读到的是封禁之前的状态，返回之前封禁提交并失效
+        state = make_state(user_id)
+        cache.invalidate(user_id)
+        return state
+
+    state = await cache.get(1, stale_loader)
+    assert not state.is_banned
+    assert get_redis().exists(USER_STATE_KEY.format(1)) == 0
+    assert cache._get_local(1) is None
+
+    async def loader(user_id):
+        return make_state(user_id, is_banned=True)
+
+    assert (await cache.get(1, loader)).is_banned
+
+
+async def test_invalidate_from_other_worker_during_load():
+    cache = UserStateCache(100, 60, 60)
+    other = UserStateCache(100, 60, 60)
+
+    async def stale_loader(user_id):
+        state = make_state(user_id)
+        other.invalidate(user_id)
+        # 订阅到的广播在本 worker 上丢掉本地缓存
+        cache._drop_local(user_id)
+        return state
+
+    await cache.get(1, stale_loader)
+    assert get_redis().exists(USER_STATE_KEY.format(1)) == 0
+    assert cache._get_local(1) is None
+
+
+async def test_invalidate_async_drops_cached_state():
+    cache = UserStateCache(100, 60, 60)
+
+    async def loader(user_id):
+        return make_state(user_id)
+
+    await cache.get(1, loader)
+    await cache.invalidate_async(1)
+    assert get_redis().exists(USER_STATE_KEY.format(1)) == 0
+    assert get_redis().get(USER_STATE_VERSION_KEY.format(1)) == "1"
+    assert cache._get_local(1) is None